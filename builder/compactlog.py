@@ -0,0 +1,99 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compact log records, enabled with `custom_log_compact = yes`.
+
+Makes `esp_log_compact.h` available to the project and keeps the format
+strings of its macros in the `.esp_log_fmt` section, which is not loaded to
+flash. The format strings are written to `${PROGNAME}.logfmt.json` next to
+the firmware, the monitor filter reads them from the ELF itself. The records
+are binary, the monitor has to run with `monitor_encoding = latin-1`.
+"""
+
+import codecs
+import json
+import os
+import sys
+
+Import("env")
+
+MONITOR_DIR = os.path.join(env.PioPlatform().get_dir(), "monitor")
+if MONITOR_DIR not in sys.path:
+    sys.path.insert(0, MONITOR_DIR)
+
+from esp32_decoder.logfmt import LOG_SECTION, LogFormatTable  # noqa: E402
+
+COMPACTLOG_DIR = os.path.join(env.PioPlatform().get_dir(), "builder", "compactlog")
+
+
+def _is_enabled(env):
+    return env.GetProjectOption("custom_log_compact", "no").lower() in (
+        "1",
+        "yes",
+        "true",
+    )
+
+
+def _write_log_formats(target, source, env):
+    elf_path = target[0].get_abspath()
+    try:
+        table = LogFormatTable.from_elf(elf_path)
+    except (OSError, ValueError) as e:
+        sys.stderr.write("Warning! Failed to read the log formats: %s\n" % e)
+        return
+    if table is None:
+        return
+    with open(os.path.splitext(elf_path)[0] + ".logfmt.json", "w") as fp:
+        json.dump(
+            dict(
+                section=LOG_SECTION,
+                formats={
+                    str(format_id): dict(level=item.level, format=item.text)
+                    for format_id, item in sorted(table.formats.items())
+                },
+            ),
+            fp,
+            indent=2,
+        )
+
+
+def AddCompactLogAction(env, target_elf):
+    if not _is_enabled(env):
+        return
+    env.AddPostAction(
+        target_elf, env.VerboseAction(_write_log_formats, "Extracting log formats")
+    )
+
+
+def _is_latin1_monitor(env):
+    try:
+        encoding = codecs.lookup(env.GetProjectOption("monitor_encoding", "UTF-8"))
+    except LookupError:
+        return False
+    return encoding.name == "iso8859-1"
+
+
+if _is_enabled(env):
+    if not _is_latin1_monitor(env):
+        print(
+            "Warning! Compact log records need `monitor_encoding = latin-1` "
+            "to be decoded by the monitor"
+        )
+    env.Append(
+        CPPPATH=[COMPACTLOG_DIR],
+        LINKFLAGS=["-T", os.path.join(COMPACTLOG_DIR, "esp_log_compact.ld")],
+    )
+
+env.AddMethod(AddCompactLogAction)
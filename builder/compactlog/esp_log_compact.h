@@ -0,0 +1,328 @@
+/*
+ * Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+/*
+ * Compact log records, expanded on the host by the `esp32_log_decoder`
+ * monitor filter. Enable them with `custom_log_compact = yes` and set
+ * `monitor_encoding = latin-1`, so the monitor passes the bytes through.
+ *
+ * ESP_LOGCE/W/I/D/V take the same arguments as ESP_LOGx. The format string
+ * is kept in the `.esp_log_fmt` section, which is not loaded to flash, and
+ * only a binary record is printed:
+ *
+ *     "\x1e" length COBS(payload)
+ *
+ * COBS keeps the frame free of zero bytes, so it is written with the
+ * regular `esp_log_write` and any custom vprintf handler. The payload of
+ * a log record is
+ *
+ *     varint(format offset + 1) varint(timestamp) tag ID arguments
+ *
+ * Tags are interned: the first use of a tag, and every 64th use after it,
+ * is preceded by the record `varint(0) tag ID tag`, so a monitor started
+ * later learns the tag as well. Tags above ESP_LOG_COMPACT_MAX_TAGS are
+ * sent inline after the ID 0xff. Integers and pointers are sent as
+ * varints, `long long` as 64-bit varints, floating point numbers as 8
+ * bytes and strings with a length byte. Define ESP_LOG_COMPACT_OVERRIDE
+ * before including this header to turn ESP_LOGx of the including file into
+ * compact records. Up to 8 arguments are supported.
+ */
+
+#pragma once
+
+#include <stddef.h>
+#include <stdint.h>
+#include <string.h>
+
+#include "esp_log.h"
+#include "freertos/FreeRTOS.h"
+
+#ifndef ESP_LOG_COMPACT_MAX_RECORD
+#define ESP_LOG_COMPACT_MAX_RECORD 96
+#endif
+
+#ifndef ESP_LOG_COMPACT_MAX_TAGS
+#define ESP_LOG_COMPACT_MAX_TAGS 64
+#endif
+
+#define ESP_LOG_COMPACT_MARKER 0x1e
+#define ESP_LOG_COMPACT_TAG_INLINE 0xff
+/* Uses of a tag between two of its definitions */
+#define ESP_LOG_COMPACT_TAG_PERIOD 64
+/* The length byte of a frame counts the COBS overhead as well */
+#define ESP_LOG_COMPACT_MAX_FRAME (ESP_LOG_COMPACT_MAX_RECORD + ESP_LOG_COMPACT_MAX_RECORD / 254 + 1)
+
+#if ESP_LOG_COMPACT_MAX_FRAME > 255
+#error "ESP_LOG_COMPACT_MAX_RECORD is too large"
+#endif
+
+#ifdef __cplusplus
+extern "C" {
+#endif
+
+typedef struct {
+    uint8_t data[ESP_LOG_COMPACT_MAX_RECORD];
+    size_t len;
+} esp_log_compact_record_t;
+
+static inline void esp_log_compact_put(esp_log_compact_record_t *record, const void *data, size_t len)
+{
+    if (record->len + len > sizeof(record->data)) {
+        len = sizeof(record->data) - record->len;
+    }
+    memcpy(record->data + record->len, data, len);
+    record->len += len;
+}
+
+static inline void esp_log_compact_put_u8(esp_log_compact_record_t *record, uint8_t value)
+{
+    esp_log_compact_put(record, &value, 1);
+}
+
+static inline void esp_log_compact_put_varint(esp_log_compact_record_t *record, uint64_t value)
+{
+    while (value >= 0x80) {
+        esp_log_compact_put_u8(record, (uint8_t)(value | 0x80));
+        value >>= 7;
+    }
+    esp_log_compact_put_u8(record, (uint8_t)value);
+}
+
+static inline void esp_log_compact_put_u32(esp_log_compact_record_t *record, uint32_t value)
+{
+    esp_log_compact_put_varint(record, value);
+}
+
+static inline void esp_log_compact_put_u64(esp_log_compact_record_t *record, uint64_t value)
+{
+    esp_log_compact_put_varint(record, value);
+}
+
+static inline void esp_log_compact_put_f64(esp_log_compact_record_t *record, double value)
+{
+    esp_log_compact_put(record, &value, sizeof(value));
+}
+
+static inline void esp_log_compact_put_ptr(esp_log_compact_record_t *record, const void *value)
+{
+    esp_log_compact_put_u32(record, (uint32_t)(uintptr_t)value);
+}
+
+static inline void esp_log_compact_put_str(esp_log_compact_record_t *record, const char *value)
+{
+    size_t len = value ? strlen(value) : 0;
+    uint8_t size = len > 255 ? 255 : (uint8_t)len;
+    esp_log_compact_put_u8(record, size);
+    esp_log_compact_put(record, value, size);
+}
+
+/*
+ * Returns the ID of a tag or -1 when the table is full, `define` is set
+ * when the tag has to be sent. Weak, so all files share one table.
+ */
+__attribute__((weak)) int esp_log_compact_tag_id(const char *tag, int *define)
+{
+    static const char *tags[ESP_LOG_COMPACT_MAX_TAGS];
+    static uint8_t uses[ESP_LOG_COMPACT_MAX_TAGS];
+    static int count;
+    static portMUX_TYPE lock = portMUX_INITIALIZER_UNLOCKED;
+    int id = -1;
+
+    portENTER_CRITICAL(&lock);
+    for (int i = 0; i < count; i++) {
+        if (tags[i] == tag) {
+            id = i;
+            break;
+        }
+    }
+    if (id < 0 && count < ESP_LOG_COMPACT_MAX_TAGS) {
+        id = count++;
+        tags[id] = tag;
+        uses[id] = 0;
+    }
+    if (id >= 0) {
+        *define = uses[id] == 0;
+        uses[id] = (uses[id] + 1) % ESP_LOG_COMPACT_TAG_PERIOD;
+    }
+    portEXIT_CRITICAL(&lock);
+    return id;
+}
+
+static inline void esp_log_compact_send(esp_log_level_t level, const char *tag,
+                                        const esp_log_compact_record_t *record)
+{
+    /* marker, length, COBS data and the terminating zero */
+    uint8_t frame[ESP_LOG_COMPACT_MAX_FRAME + 3];
+    uint8_t *out = frame + 2;
+    size_t code_pos = 0;
+    size_t len = 1;
+    uint8_t code = 1;
+
+    for (size_t i = 0; i < record->len; i++) {
+        if (record->data[i] == 0) {
+            out[code_pos] = code;
+            code_pos = len++;
+            code = 1;
+            continue;
+        }
+        out[len++] = record->data[i];
+        if (++code == 0xff) {
+            out[code_pos] = code;
+            code_pos = len++;
+            code = 1;
+        }
+    }
+    out[code_pos] = code;
+    frame[0] = ESP_LOG_COMPACT_MARKER;
+    frame[1] = (uint8_t)len;
+    frame[len + 2] = 0;
+    esp_log_write(level, tag, "%s", (const char *)frame);
+}
+
+static inline void esp_log_compact_begin(esp_log_compact_record_t *record, esp_log_level_t level,
+                                         const char *tag, const char *format)
+{
+    int define = 0;
+    int id = esp_log_compact_tag_id(tag, &define);
+
+    if (define) {
+        record->len = 0;
+        esp_log_compact_put_u8(record, 0);
+        esp_log_compact_put_u8(record, (uint8_t)id);
+        esp_log_compact_put(record, tag, strlen(tag));
+        esp_log_compact_send(level, tag, record);
+    }
+    record->len = 0;
+    /* the offset in the section, 0 is the tag definition */
+    esp_log_compact_put_u32(record, (uint32_t)(uintptr_t)format + 1);
+    esp_log_compact_put_u32(record, esp_log_timestamp());
+    if (id < 0) {
+        esp_log_compact_put_u8(record, ESP_LOG_COMPACT_TAG_INLINE);
+        esp_log_compact_put_str(record, tag);
+    } else {
+        esp_log_compact_put_u8(record, (uint8_t)id);
+    }
+}
+
+#ifdef __cplusplus
+}
+
+static inline void esp_log_compact_put_arg(esp_log_compact_record_t *record, const char *value)
+{
+    esp_log_compact_put_str(record, value);
+}
+
+static inline void esp_log_compact_put_arg(esp_log_compact_record_t *record, char *value)
+{
+    esp_log_compact_put_str(record, value);
+}
+
+static inline void esp_log_compact_put_arg(esp_log_compact_record_t *record, double value)
+{
+    esp_log_compact_put_f64(record, value);
+}
+
+static inline void esp_log_compact_put_arg(esp_log_compact_record_t *record, float value)
+{
+    esp_log_compact_put_f64(record, value);
+}
+
+static inline void esp_log_compact_put_arg(esp_log_compact_record_t *record, long long value)
+{
+    esp_log_compact_put_u64(record, (uint64_t)value);
+}
+
+static inline void esp_log_compact_put_arg(esp_log_compact_record_t *record, unsigned long long value)
+{
+    esp_log_compact_put_u64(record, value);
+}
+
+static inline void esp_log_compact_put_arg(esp_log_compact_record_t *record, const void *value)
+{
+    esp_log_compact_put_ptr(record, value);
+}
+
+static inline void esp_log_compact_put_arg(esp_log_compact_record_t *record, void *value)
+{
+    esp_log_compact_put_ptr(record, value);
+}
+
+template <typename T>
+static inline void esp_log_compact_put_arg(esp_log_compact_record_t *record, T value)
+{
+    esp_log_compact_put_u32(record, (uint32_t)(uintptr_t)value);
+}
+
+#define ESP_LOG_COMPACT_PUT_ARG(record, value) esp_log_compact_put_arg((record), (value))
+#else
+#define ESP_LOG_COMPACT_PUT_ARG(record, value) \
+    _Generic((value), \
+        char *: esp_log_compact_put_str, \
+        const char *: esp_log_compact_put_str, \
+        float: esp_log_compact_put_f64, \
+        double: esp_log_compact_put_f64, \
+        long long: esp_log_compact_put_u64, \
+        unsigned long long: esp_log_compact_put_u64, \
+        void *: esp_log_compact_put_ptr, \
+        const void *: esp_log_compact_put_ptr, \
+        default: esp_log_compact_put_u32)((record), (value))
+#endif
+
+#define _ESP_LOG_COMPACT_COUNT(...) _ESP_LOG_COMPACT_COUNT_(_, ##__VA_ARGS__, 8, 7, 6, 5, 4, 3, 2, 1, 0)
+#define _ESP_LOG_COMPACT_COUNT_(_0, _1, _2, _3, _4, _5, _6, _7, _8, count, ...) count
+#define _ESP_LOG_COMPACT_CAT(a, b) _ESP_LOG_COMPACT_CAT_(a, b)
+#define _ESP_LOG_COMPACT_CAT_(a, b) a##b
+
+#define _ESP_LOG_COMPACT_PUT_0(r)
+#define _ESP_LOG_COMPACT_PUT_1(r, a) ESP_LOG_COMPACT_PUT_ARG(r, a);
+#define _ESP_LOG_COMPACT_PUT_2(r, a, ...) ESP_LOG_COMPACT_PUT_ARG(r, a); _ESP_LOG_COMPACT_PUT_1(r, __VA_ARGS__)
+#define _ESP_LOG_COMPACT_PUT_3(r, a, ...) ESP_LOG_COMPACT_PUT_ARG(r, a); _ESP_LOG_COMPACT_PUT_2(r, __VA_ARGS__)
+#define _ESP_LOG_COMPACT_PUT_4(r, a, ...) ESP_LOG_COMPACT_PUT_ARG(r, a); _ESP_LOG_COMPACT_PUT_3(r, __VA_ARGS__)
+#define _ESP_LOG_COMPACT_PUT_5(r, a, ...) ESP_LOG_COMPACT_PUT_ARG(r, a); _ESP_LOG_COMPACT_PUT_4(r, __VA_ARGS__)
+#define _ESP_LOG_COMPACT_PUT_6(r, a, ...) ESP_LOG_COMPACT_PUT_ARG(r, a); _ESP_LOG_COMPACT_PUT_5(r, __VA_ARGS__)
+#define _ESP_LOG_COMPACT_PUT_7(r, a, ...) ESP_LOG_COMPACT_PUT_ARG(r, a); _ESP_LOG_COMPACT_PUT_6(r, __VA_ARGS__)
+#define _ESP_LOG_COMPACT_PUT_8(r, a, ...) ESP_LOG_COMPACT_PUT_ARG(r, a); _ESP_LOG_COMPACT_PUT_7(r, __VA_ARGS__)
+
+/* The entry of a format string is its level letter followed by the format */
+#define ESP_LOG_COMPACT(level, letter, tag, format, ...) do { \
+        if (LOG_LOCAL_LEVEL >= (level) && esp_log_level_get(tag) >= (level)) { \
+            static const char _esp_log_compact_format[] \
+                __attribute__((section(".esp_log_fmt"), used, aligned(1))) = letter format; \
+            esp_log_compact_record_t _esp_log_compact_record; \
+            esp_log_compact_begin(&_esp_log_compact_record, (level), (tag), _esp_log_compact_format); \
+            _ESP_LOG_COMPACT_CAT(_ESP_LOG_COMPACT_PUT_, _ESP_LOG_COMPACT_COUNT(__VA_ARGS__))(&_esp_log_compact_record, ##__VA_ARGS__) \
+            esp_log_compact_send((level), (tag), &_esp_log_compact_record); \
+        } \
+    } while (0)
+
+#define ESP_LOGCE(tag, format, ...) ESP_LOG_COMPACT(ESP_LOG_ERROR, "E", tag, format, ##__VA_ARGS__)
+#define ESP_LOGCW(tag, format, ...) ESP_LOG_COMPACT(ESP_LOG_WARN, "W", tag, format, ##__VA_ARGS__)
+#define ESP_LOGCI(tag, format, ...) ESP_LOG_COMPACT(ESP_LOG_INFO, "I", tag, format, ##__VA_ARGS__)
+#define ESP_LOGCD(tag, format, ...) ESP_LOG_COMPACT(ESP_LOG_DEBUG, "D", tag, format, ##__VA_ARGS__)
+#define ESP_LOGCV(tag, format, ...) ESP_LOG_COMPACT(ESP_LOG_VERBOSE, "V", tag, format, ##__VA_ARGS__)
+
+#ifdef ESP_LOG_COMPACT_OVERRIDE
+#undef ESP_LOGE
+#undef ESP_LOGW
+#undef ESP_LOGI
+#undef ESP_LOGD
+#undef ESP_LOGV
+#define ESP_LOGE ESP_LOGCE
+#define ESP_LOGW ESP_LOGCW
+#define ESP_LOGI ESP_LOGCI
+#define ESP_LOGD ESP_LOGCD
+#define ESP_LOGV ESP_LOGCV
+#endif
@@ -0,0 +1,211 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Delta upload with esptool, enabled with `custom_upload_delta = yes`.
+
+The device is asked for the MD5 of every 64 KB block of an image and then
+of every 4 KB sector of a block which differs, only the differing sectors
+are written. A ledger of the images last written to each device, keyed by
+its MAC address, skips the images which are still on the device after a
+single MD5 check of the whole region, so an erased device is written again.
+The ledger is shared by all projects and is ignored with
+`custom_upload_delta_ledger = no`.
+
+The flash parameters are applied to the images with internals of esptool
+4.x, the regular upload is run with other versions and when the delta
+upload fails.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import zlib
+
+Import("env")
+
+BLOCK_SIZE = 0x10000
+SECTOR_SIZE = 0x1000
+# the esptool versions whose internals are used, see `_prepare_images`
+ESPTOOL_MAJOR_VERSION = "4"
+
+
+def _import_esptool(env):
+    esptool_dir = os.path.dirname(env.subst("$UPLOADER"))
+    if esptool_dir not in sys.path:
+        sys.path.insert(0, esptool_dir)
+    import esptool  # pylint: disable=import-outside-toplevel
+
+    version = getattr(esptool, "__version__", "")
+    if version.split(".")[0] != ESPTOOL_MAJOR_VERSION or not hasattr(
+        getattr(esptool, "cmds", None), "_update_image_flash_params"
+    ):
+        raise RuntimeError("esptool %s is not supported" % (version or "?"))
+    return esptool
+
+
+def _get_ledger_path(env):
+    return os.path.join(env.subst("$PROJECT_CORE_DIR"), ".cache", "delta_upload.json")
+
+
+def _load_ledger(path):
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_ledger(path, ledger):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path + ".tmp", "w") as fp:
+        json.dump(ledger, fp, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def get_changed_sectors(esp, offset, data):
+    """Returns the `[start, end)` ranges of `data` which differ on flash."""
+    changed = []
+    for block in range(0, len(data), BLOCK_SIZE):
+        block_data = data[block : block + BLOCK_SIZE]
+        if esp.flash_md5sum(offset + block, len(block_data)) == hashlib.md5(
+            block_data
+        ).hexdigest():
+            continue
+        for sector in range(block, block + len(block_data), SECTOR_SIZE):
+            sector_data = data[sector : sector + SECTOR_SIZE]
+            if esp.flash_md5sum(offset + sector, len(sector_data)) == hashlib.md5(
+                sector_data
+            ).hexdigest():
+                continue
+            end = sector + len(sector_data)
+            if changed and changed[-1][1] == sector:
+                changed[-1] = (changed[-1][0], end)
+            else:
+                changed.append((sector, end))
+    return changed
+
+
+def write_range(esp, offset, data):
+    compressed = zlib.compress(data, 9)
+    blocks = esp.flash_defl_begin(len(data), len(compressed), offset)
+    for seq in range(blocks):
+        esp.flash_defl_block(
+            compressed[seq * esp.FLASH_WRITE_SIZE : (seq + 1) * esp.FLASH_WRITE_SIZE],
+            seq,
+        )
+    if esp.flash_md5sum(offset, len(data)) != hashlib.md5(data).hexdigest():
+        raise IOError("verification of 0x%x failed" % offset)
+
+
+def _connect(env, esptool):
+    esp = esptool.cmds.detect_chip(
+        env.subst("$UPLOAD_PORT"),
+        connect_mode=env.BoardConfig().get("upload.before_reset", "default_reset"),
+    )
+    esp = esp.run_stub()
+    esp.change_baud(int(env.subst("$UPLOAD_SPEED")))
+    return esp
+
+
+def _prepare_images(env, esptool, esp, regions):
+    """Reads the images with the flash parameters applied like `write_flash`."""
+    cmds = esptool.cmds
+    args = argparse.Namespace(
+        chip=env.BoardConfig().get("build.mcu", "esp32"),
+        flash_mode=env.subst("${__get_board_flash_mode(__env__)}"),
+        flash_freq=env.subst("${__get_board_f_image(__env__)}"),
+        flash_size="detect",
+    )
+    cmds.detect_flash_size(esp, args)
+    images = []
+    for offset, path in regions:
+        offset = int(env.subst(str(offset)), 0)
+        with open(env.subst(path), "rb") as fp:
+            data = fp.read()
+        # esptool pads images to a multiple of 4 bytes
+        data += b"\xff" * (-len(data) % 4)
+        data = cmds._update_image_flash_params(  # pylint: disable=protected-access
+            esp, offset, args, data
+        )
+        images.append((offset, data))
+    return images
+
+
+def _delta_upload(env, regions):
+    esptool = _import_esptool(env)
+    esp = _connect(env, esptool)
+    try:
+        mac = _get_mac(esp)
+        images = _prepare_images(env, esptool, esp, regions)
+        use_ledger = env.GetProjectOption(
+            "custom_upload_delta_ledger", "yes"
+        ).lower() in ("1", "yes", "true")
+        ledger_path = _get_ledger_path(env)
+        ledger = _load_ledger(ledger_path)
+        device = ledger.setdefault(mac, {})
+
+        for offset, data in images:
+            key = "0x%x" % offset
+            sha256 = hashlib.sha256(data).hexdigest()
+            if (
+                use_ledger
+                and device.get(key, {}).get("sha256") == sha256
+                and esp.flash_md5sum(offset, len(data))
+                == hashlib.md5(data).hexdigest()
+            ):
+                print("0x%08x: unchanged since the last upload to %s" % (offset, mac))
+                continue
+            start = time.time()
+            changed = get_changed_sectors(esp, offset, data)
+            for range_start, range_end in changed:
+                write_range(esp, offset + range_start, data[range_start:range_end])
+            print(
+                "0x%08x: wrote %d of %d bytes in %.1f seconds"
+                % (
+                    offset,
+                    sum(end - begin for begin, end in changed),
+                    len(data),
+                    time.time() - start,
+                )
+            )
+            device[key] = dict(size=len(data), sha256=sha256, time=int(time.time()))
+            _save_ledger(ledger_path, ledger)
+
+        if env.BoardConfig().get("upload.after_reset", "hard_reset") == "hard_reset":
+            esp.hard_reset()
+    finally:
+        # esptool 4.x has no public way to close the port
+        esp._port.close()  # pylint: disable=protected-access
+
+
+def _get_mac(esp):
+    return ":".join("%02x" % value for value in esp.read_mac())
+
+
+def DeltaUpload(env, regions, target, source):
+    """Uploads `(offset, path)` regions, falls back to `$UPLOADCMD`."""
+    try:
+        _delta_upload(env, regions)
+        return 0
+    except Exception as e:  # pylint: disable=broad-except
+        print("Warning! Delta upload failed (%s), uploading the whole image" % e)
+    return env.VerboseAction("$UPLOADCMD", "Uploading $SOURCE")(target, source, env)
+
+
+env.AddMethod(DeltaUpload)
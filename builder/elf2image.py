@@ -0,0 +1,185 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Converts the firmware ELF to the flash image in the SCons process.
+
+`esptool.py elf2image` is imported from the esptool package of the
+platform instead of started as a new interpreter, the command line is the
+same. A hash of the loadable contents and the conversion flags is saved
+next to the image and the conversion is skipped when it did not change, a
+relink which only changed the debug information keeps the image. Only the
+SHA256 of the ELF embedded with `--elf-sha256-offset` is updated then,
+along with the checksum and the appended digest of the image.
+"""
+
+import hashlib
+import json
+import os
+import struct
+import subprocess
+import sys
+
+Import("env")
+
+PT_LOAD = 1
+SHF_ALLOC = 0x2
+# PROGBITS, INIT_ARRAY, FINI_ARRAY and PREINIT_ARRAY like `elf2image`
+SECTION_TYPES = (1, 14, 15, 16)
+IMAGE_HEADER_SIZE = 8
+EXTENDED_HEADER_SIZE = 16
+# `hash_appended` of the extended header
+HASH_APPENDED_OFFSET = IMAGE_HEADER_SIZE + 15
+CHECKSUM_MAGIC = 0xEF
+ELF_SHA256_OFFSET_FLAG = "--elf-sha256-offset"
+
+
+def get_loadable_contents(path):
+    """Returns the entry point, the `(vaddr, paddr, memsz)` of the loadable
+    segments and the `(addr, data)` of the sections with their contents.
+
+    The segment headers tell where a section is loaded from, the ELF header
+    which may be mapped in a segment changes with the debug information.
+    """
+    with open(path, "rb") as fp:
+        ident = fp.read(16)
+        if len(ident) < 16 or ident[:4] != b"\x7fELF" or ident[4] != 1:
+            raise ValueError("%s is not a 32-bit ELF file" % path)
+        fp.seek(24)
+        entry, phoff, shoff = struct.unpack("<III", fp.read(12))
+        fp.seek(42)
+        phentsize, phnum, shentsize, shnum = struct.unpack("<HHHH", fp.read(8))
+
+        segments = []
+        for i in range(phnum):
+            fp.seek(phoff + i * phentsize)
+            p_type, _, vaddr, paddr, _, memsz = struct.unpack("<6I", fp.read(24))
+            if p_type == PT_LOAD and memsz:
+                segments.append((vaddr, paddr, memsz))
+
+        sections = []
+        for i in range(shnum):
+            fp.seek(shoff + i * shentsize)
+            _, sh_type, flags, addr, offset, size = struct.unpack(
+                "<6I", fp.read(24)
+            )
+            if sh_type in SECTION_TYPES and flags & SHF_ALLOC and size:
+                fp.seek(offset)
+                sections.append((addr, fp.read(size)))
+    return entry, segments, sections
+
+
+def get_image_key(path, argv):
+    entry, segments, sections = get_loadable_contents(path)
+    digest = hashlib.sha256(json.dumps([entry, segments, argv]).encode())
+    for addr, data in sections:
+        digest.update(struct.pack("<II", addr, len(data)))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def get_file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def embed_elf_sha256(image_path, offset, elf_sha256):
+    """Replaces the embedded ELF SHA256 and updates checksum and digest."""
+    with open(image_path, "r+b") as fp:
+        image = bytearray(fp.read())
+        segments = image[1]
+        pos = IMAGE_HEADER_SIZE + EXTENDED_HEADER_SIZE
+        for _ in range(segments):
+            _, size = struct.unpack_from("<II", image, pos)
+            pos += 8 + size
+        # the checksum is the last byte of the padding to 16 bytes
+        checksum_pos = pos + 15 - pos % 16
+        old = image[offset : offset + len(elf_sha256)]
+        checksum = image[checksum_pos]
+        for value in bytes(old) + elf_sha256:
+            checksum ^= value
+        image[offset : offset + len(elf_sha256)] = elf_sha256
+        image[checksum_pos] = checksum
+        if image[HASH_APPENDED_OFFSET]:
+            digest_pos = checksum_pos + 1
+            image[digest_pos : digest_pos + 32] = hashlib.sha256(
+                image[:digest_pos]
+            ).digest()
+        fp.seek(0)
+        fp.write(image)
+
+
+def _run_esptool(env, argv):
+    esptool_dir = os.path.dirname(env.subst("$OBJCOPY"))
+    if esptool_dir not in sys.path:
+        sys.path.insert(0, esptool_dir)
+    try:
+        import esptool  # pylint: disable=import-outside-toplevel
+
+        esptool.main(argv)
+        return 0
+    except ImportError:
+        pass
+    except SystemExit as e:
+        return e.code or 0
+    except Exception as e:  # pylint: disable=broad-except
+        sys.stderr.write("Warning! esptool failed in-process: %s\n" % e)
+    return subprocess.call([env.subst("$PYTHONEXE"), env.subst("$OBJCOPY")] + argv)
+
+
+def ElfToImage(env, target, source):
+    target_path = target[0].get_abspath()
+    source_path = source[0].get_abspath()
+    flags = env.subst_list("$ELF2IMAGEFLAGS")[0]
+    argv = [str(flag) for flag in flags]
+    key_path = target_path + ".hash"
+
+    key = get_image_key(source_path, argv)
+    elf_sha256_offset = None
+    if ELF_SHA256_OFFSET_FLAG in argv:
+        elf_sha256_offset = int(argv[argv.index(ELF_SHA256_OFFSET_FLAG) + 1], 0)
+
+    try:
+        with open(key_path) as fp:
+            state = json.load(fp)
+    except (OSError, ValueError):
+        state = {}
+    if state.get("key") == key and os.path.isfile(target_path):
+        if elf_sha256_offset is not None:
+            elf_sha256 = get_file_sha256(source_path)
+            if state.get("elf_sha256") != elf_sha256.hex():
+                embed_elf_sha256(target_path, elf_sha256_offset, elf_sha256)
+                state["elf_sha256"] = elf_sha256.hex()
+                with open(key_path, "w") as fp:
+                    json.dump(state, fp)
+        print("Loadable segments are unchanged, keeping %s" % target[0])
+        return 0
+
+    if os.path.isfile(key_path):
+        os.remove(key_path)
+    result = _run_esptool(env, argv + ["-o", target_path, source_path])
+    if result:
+        return result
+    state = {"key": key}
+    if elf_sha256_offset is not None:
+        state["elf_sha256"] = get_file_sha256(source_path).hex()
+    with open(key_path, "w") as fp:
+        json.dump(state, fp)
+    return 0
+
+
+env.AddMethod(ElfToImage)
@@ -0,0 +1,168 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Factory image with the bootloader, the partition table, the OTA data, the
+application and optionally the filesystem image at their flash offsets, so
+a device is programmed with a single write at offset 0.
+
+The image is updated through a memory map, only the regions whose source
+image changed are written again. `factory.json` next to the image lists
+the offset, the size and the SHA256 of every region and of the image.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import sys
+
+Import("env")
+
+ERASED = b"\xff"
+CHUNK_SIZE = 1024 * 1024
+
+
+def get_file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _fill(image, start, end):
+    for pos in range(start, end, CHUNK_SIZE):
+        size = min(CHUNK_SIZE, end - pos)
+        image[pos : pos + size] = ERASED * size
+
+
+def _copy(image, offset, path, size):
+    if not size:
+        return
+    with open(path, "rb") as fp, mmap.mmap(
+        fp.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        image[offset : offset + size] = data
+
+
+def _load_manifest(path):
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def _build_factory_image(target, source, env):
+    image_path = target[0].get_abspath()
+    manifest_path = os.path.join(os.path.dirname(image_path), "factory.json")
+    regions = sorted(
+        (int(env.subst(str(offset)), 0), node.get_abspath())
+        for offset, node in zip(env["FACTORY_OFFSETS"], source)
+    )
+    regions = [
+        dict(
+            offset=offset,
+            path=path,
+            size=os.path.getsize(path),
+            sha256=get_file_sha256(path),
+        )
+        for offset, path in regions
+    ]
+    for region, next_region in zip(regions, regions[1:]):
+        if region["offset"] + region["size"] > next_region["offset"]:
+            sys.stderr.write(
+                "Error: %s at 0x%x overlaps %s at 0x%x\n"
+                % (
+                    region["path"],
+                    region["offset"],
+                    next_region["path"],
+                    next_region["offset"],
+                )
+            )
+            env.Exit(1)
+    total_size = max(region["offset"] + region["size"] for region in regions)
+
+    # the regions of the previous image are reused when no offset changed
+    previous = {
+        item["offset"]: item for item in _load_manifest(manifest_path).get("regions", [])
+    }
+    incremental = os.path.isfile(image_path) and sorted(previous) == [
+        region["offset"] for region in regions
+    ]
+    with open(image_path, "r+b" if incremental else "w+b") as fp:
+        fp.truncate(total_size)
+        with mmap.mmap(fp.fileno(), total_size) as image:
+            if not incremental:
+                _fill(image, 0, total_size)
+            written = 0
+            for region in regions:
+                old = previous.get(region["offset"]) if incremental else None
+                if old is not None and (old["size"], old["sha256"]) == (
+                    region["size"],
+                    region["sha256"],
+                ):
+                    continue
+                _copy(image, region["offset"], region["path"], region["size"])
+                if old is not None and old["size"] > region["size"]:
+                    _fill(
+                        image,
+                        region["offset"] + region["size"],
+                        min(region["offset"] + old["size"], total_size),
+                    )
+                written += 1
+            image.flush()
+            image_sha256 = hashlib.sha256(image).hexdigest()
+
+    with open(manifest_path, "w") as fp:
+        json.dump(
+            dict(
+                chip=env.BoardConfig().get("build.mcu", "esp32"),
+                flash_mode=env.subst("${__get_board_flash_mode(__env__)}"),
+                flash_freq=env.subst("${__get_board_f_image(__env__)}"),
+                flash_size=env.BoardConfig().get("upload.flash_size", "4MB"),
+                size=total_size,
+                sha256=image_sha256,
+                regions=[
+                    dict(
+                        offset=region["offset"],
+                        path=region["path"],
+                        size=region["size"],
+                        sha256=region["sha256"],
+                    )
+                    for region in regions
+                ],
+            ),
+            fp,
+            indent=2,
+        )
+    print("Updated %d of %d regions of %s" % (written, len(regions), target[0]))
+
+
+def BuildFactoryImage(env, images):
+    """Builds `factory.bin` of `(offset, image)` pairs, offsets may be
+    construction variables which are only known at build time."""
+    target = env.Command(
+        os.path.join("$BUILD_DIR", "factory.bin"),
+        [image for _, image in images],
+        env.VerboseAction(_build_factory_image, "Building factory image $TARGET"),
+        FACTORY_OFFSETS=[offset for offset, _ in images],
+    )
+    # regions are compared with the manifest, unchanged ones are not written
+    env.AlwaysBuild(target)
+    return target
+
+
+env.AddMethod(BuildFactoryImage)
@@ -20,7 +20,6 @@ Espressif IoT Development Framework for ESP32 MCU
 https://github.com/espressif/esp-idf
 """
 
-import copy
 import json
 import subprocess
 import sys
@@ -1068,6 +1067,35 @@ def get_partition_info(pt_path, pt_offset, pt_params):
         )
         env.Exit(1)
 
+    partitions_table = env.GetPartitionTable(pt_path, pt_offset)
+    if pt_params["name"] == "boot":
+        partition = partitions_table.get_boot_partition()
+    else:
+        partition = partitions_table.find(
+            type=pt_params["type"], subtype=pt_params["subtype"]
+        )
+    result = {"size": 0, "offset": 0}
+    if partition is not None:
+        result = {"size": hex(partition.size), "offset": hex(partition.offset)}
+
+    # Cross-check the in-process reader with the tool of the framework
+    if env.GetProjectOption("custom_partitions_parttool", "no").lower() in (
+        "1",
+        "yes",
+        "true",
+    ):
+        expected = get_partition_info_parttool(pt_path, pt_offset, pt_params)
+        if expected != result:
+            print(
+                "Warning! Partition info %s differs from parttool.py %s for %s"
+                % (result, expected, pt_params)
+            )
+            return expected
+
+    return result
+
+
+def get_partition_info_parttool(pt_path, pt_offset, pt_params):
     cmd = [
         get_python_exe(),
         os.path.join(FRAMEWORK_DIR, "components", "partition_table", "parttool.py"),
@@ -1613,6 +1641,8 @@ env.AddBuildMiddleware(_skip_prj_source_files)
 fwpartitions_dir = os.path.join(FRAMEWORK_DIR, "components", "partition_table")
 partitions_csv = board.get("build.partitions", "partitions_singleapp.csv")
 partition_table_offset = sdk_config.get("PARTITION_TABLE_OFFSET", 0x8000)
+# the bootloader reads the table at the offset of sdkconfig
+env.Replace(PARTITIONS_TABLE_OFFSET=partition_table_offset)
 
 env.Replace(
     PARTITIONS_TABLE_CSV=os.path.abspath(
@@ -1661,7 +1691,7 @@ env.Prepend(
             os.path.join("$BUILD_DIR", "bootloader.bin"),
         ),
         (
-            board.get("upload.partition_table_offset", hex(partition_table_offset)),
+            hex(partition_table_offset),
             os.path.join("$BUILD_DIR", "partitions.bin"),
         ),
     ],
@@ -1755,12 +1785,7 @@ if sdk_config.get("SOC_MMU_PAGE_SIZE_CONFIGURABLE", False):
 if mmu_page_size != "64KB":
     extra_elf2bin_flags += " --flash-mmu-page-size %s" % mmu_page_size
 
-action = copy.deepcopy(env["BUILDERS"]["ElfToBin"].action)
-
-action.cmd_list = env["BUILDERS"]["ElfToBin"].action.cmd_list.replace(
-    "-o", extra_elf2bin_flags + " -o"
-)
-env["BUILDERS"]["ElfToBin"].action = action
+env.Append(ELF2IMAGEFLAGS=extra_elf2bin_flags.split())
 
 #
 # Compile ULP sources in 'ulp' folder
@@ -1796,54 +1821,26 @@ if ota_partition_params["size"] and ota_partition_params["offset"]:
         ]
     )
 
-def _parse_size(value):
-    if isinstance(value, int):
-        return value
-    elif value.isdigit():
-        return int(value)
-    elif value.startswith("0x"):
-        return int(value, 16)
-    elif value[-1].upper() in ("K", "M"):
-        base = 1024 if value[-1].upper() == "K" else 1024 * 1024
-        return int(value[:-1]) * base
-    return value
-
 #
 # Configure application partition offset
 #
 
-partitions_csv = env.subst("$PARTITIONS_TABLE_CSV")
-result = []
-next_offset = 0
-bound = int(board.get("upload.offset_address", "0x10000"), 16) # default 0x10000
-with open(partitions_csv) as fp:
-    for line in fp.readlines():
-        line = line.strip()
-        if not line or line.startswith("#"):
-            continue
-        tokens = [t.strip() for t in line.split(",")]
-        if len(tokens) < 5:
-            continue
-        partition = {
-            "name": tokens[0],
-            "type": tokens[1],
-            "subtype": tokens[2],
-            "offset": tokens[3] or next_offset,
-            "size": tokens[4],
-            "flags": tokens[5] if len(tokens) > 5 else None
-        }
-        result.append(partition)
-        next_offset = _parse_size(partition["offset"])
-        if (partition["subtype"] == "ota_0"):
-            bound = next_offset
-        next_offset = (next_offset + bound - 1) & ~(bound - 1)
-
-env.Replace(ESP32_APP_OFFSET=str(hex(bound)))
+env.Replace(
+    ESP32_APP_OFFSET=hex(
+        env.GetPartitionTable(table_offset=partition_table_offset).get_app_offset(
+            int(board.get("upload.offset_address", "0x10000"), 16)
+        )
+    )
+)
 
 #
-# Propagate application offset to debug configurations
+# Propagate application offset to debug configurations and the location of
+# the bootloader ELF to the exception decoder
 #
 
 env["INTEGRATION_EXTRA_DATA"].update(
-    {"application_offset": env.subst("$ESP32_APP_OFFSET")}
+    {
+        "application_offset": env.subst("$ESP32_APP_OFFSET"),
+        "bootloader_elf_path": env.subst(os.path.join("$BUILD_DIR", "bootloader.elf")),
+    }
 )
@@ -193,3 +193,8 @@ ulp_env.Depends(os.path.join("$BUILD_DIR", "${PROGNAME}.elf"), ulp_assembly)
 ulp_env.Requires(os.path.join("$BUILD_DIR", "${PROGNAME}.elf"), ulp_assembly)
 
 env.AppendUnique(CPPPATH=ULP_BUILD_DIR, LIBPATH=ULP_BUILD_DIR)
+
+# Let the exception decoder symbolize addresses in the ULP program
+env["INTEGRATION_EXTRA_DATA"].update(
+    {"ulp_elf_path": os.path.join(ULP_BUILD_DIR, "ulp_main")}
+)
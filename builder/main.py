@@ -14,10 +14,10 @@
 
 import re
 import sys
-from os.path import isfile, join
+from os.path import join
 
 from SCons.Script import (
-    ARGUMENTS, COMMAND_LINE_TARGETS, AlwaysBuild, Builder, Default,
+    ARGUMENTS, COMMAND_LINE_TARGETS, Action, AlwaysBuild, Builder, Default,
     DefaultEnvironment)
 
 from platformio.util import get_serial_ports
@@ -116,74 +116,32 @@ def _get_board_boot_mode(env):
     return build_boot
 
 
-def _parse_size(value):
-    if isinstance(value, int):
-        return value
-    elif value.isdigit():
-        return int(value)
-    elif value.startswith("0x"):
-        return int(value, 16)
-    elif value[-1].upper() in ("K", "M"):
-        base = 1024 if value[-1].upper() == "K" else 1024 * 1024
-        return int(value[:-1]) * base
-    return value
-
-
 def _parse_partitions(env):
-    partitions_csv = env.subst("$PARTITIONS_TABLE_CSV")
-    if not isfile(partitions_csv):
-        sys.stderr.write("Could not find the file %s with partitions "
-                         "table.\n" % partitions_csv)
-        env.Exit(1)
-        return
-
-    result = []
-    next_offset = 0
-    bound = int(board.get("upload.offset_address", "0x10000"), 16) # default 0x10000
-    with open(partitions_csv) as fp:
-        for line in fp.readlines():
-            line = line.strip()
-            if not line or line.startswith("#"):
-                continue
-            tokens = [t.strip() for t in line.split(",")]
-            if len(tokens) < 5:
-                continue
-            partition = {
-                "name": tokens[0],
-                "type": tokens[1],
-                "subtype": tokens[2],
-                "offset": tokens[3] or next_offset,
-                "size": tokens[4],
-                "flags": tokens[5] if len(tokens) > 5 else None
-            }
-            result.append(partition)
-            next_offset = _parse_size(partition["offset"])
-            if (partition["subtype"] == "ota_0"):
-                bound = next_offset
-            next_offset = (next_offset + bound - 1) & ~(bound - 1)
+    partitions_table = env.GetPartitionTable(
+        table_offset=env["PARTITIONS_TABLE_OFFSET"])
+    app_offset = hex(
+        partitions_table.get_app_offset(
+            int(board.get("upload.offset_address", "0x10000"), 16)
+        )
+    )
     # Configure application partition offset
-    env.Replace(ESP32_APP_OFFSET=str(hex(bound)))
+    env.Replace(ESP32_APP_OFFSET=app_offset)
     # Propagate application offset to debug configurations
-    env["INTEGRATION_EXTRA_DATA"].update({"application_offset": str(hex(bound))})
-    return result
+    env["INTEGRATION_EXTRA_DATA"].update({"application_offset": app_offset})
+    return partitions_table.partitions
 
 
 def _update_max_upload_size(env):
     if not env.get("PARTITIONS_TABLE_CSV"):
         return
-    sizes = {
-        p["subtype"]: _parse_size(p["size"]) for p in _parse_partitions(env)
-        if p["type"] in ("0", "app")
-    }
-
-    partitions = {p["name"]: p for p in _parse_partitions(env)}
+    partitions = {p.name: p for p in _parse_partitions(env)}
 
     # User-specified partition name has the highest priority
     custom_app_partition_name = board.get("build.app_partition_name", "")
     if custom_app_partition_name:
-        selected_partition = partitions.get(custom_app_partition_name, {})
+        selected_partition = partitions.get(custom_app_partition_name)
         if selected_partition:
-            board.update("upload.maximum_size", _parse_size(selected_partition["size"]))
+            board.update("upload.maximum_size", selected_partition.size)
             return
         else:
             print(
@@ -192,12 +150,11 @@ def _update_max_upload_size(env):
             )
 
     for p in partitions.values():
-        if p["type"] in ("0", "app") and p["subtype"] in ("ota_0"):
-            board.update("upload.maximum_size", _parse_size(p["size"]))
+        if p.type == "app" and p.subtype == "ota_0":
+            board.update("upload.maximum_size", p.size)
             break
 
 
-
 def _to_unix_slashes(path):
     return path.replace("\\", "/")
 
@@ -210,7 +167,7 @@ def _to_unix_slashes(path):
 def fetch_fs_size(env):
     fs = None
     for p in _parse_partitions(env):
-        if p["type"] == "data" and p["subtype"] in ("spiffs", "fat", "littlefs"):
+        if p.type == "data" and p.subtype in ("spiffs", "fat", "littlefs"):
             fs = p
     if not fs:
         sys.stderr.write(
@@ -219,8 +176,8 @@ def fetch_fs_size(env):
         )
         env.Exit(1)
         return
-    env["FS_START"] = _parse_size(fs["offset"])
-    env["FS_SIZE"] = _parse_size(fs["size"])
+    env["FS_START"] = fs.offset
+    env["FS_SIZE"] = fs.size
     env["FS_PAGE"] = int("0x100", 16)
     env["FS_BLOCK"] = int("0x1000", 16)
 
@@ -245,6 +202,7 @@ if mcu in ("esp32c2", "esp32c3", "esp32c6", "esp32h2"):
 
 if "INTEGRATION_EXTRA_DATA" not in env:
     env["INTEGRATION_EXTRA_DATA"] = {}
+env["INTEGRATION_EXTRA_DATA"].update({"mcu": mcu})
 
 env.Replace(
     __get_board_boot_mode=_get_board_boot_mode,
@@ -295,6 +253,23 @@ env.Replace(
 
     ESP32_APP_OFFSET=env.get("INTEGRATION_EXTRA_DATA").get("application_offset"),
 
+    # ESP-IDF builds replace it with the offset of their sdkconfig
+    PARTITIONS_TABLE_OFFSET=int(
+        board.get("upload.partition_table_offset", "0x8000"), 0),
+
+    ELF2IMAGEFLAGS=[
+        "--chip", mcu, "elf2image",
+        "--flash_mode", "${__get_board_flash_mode(__env__)}",
+        "--flash_freq", "${__get_board_f_image(__env__)}",
+        "--flash_size", board.get("upload.flash_size", "4MB")
+    ],
+    # `VerboseAction` takes no `varlist`, verbose builds show the command
+    ELF2IMAGECOMSTR=(
+        '"$PYTHONEXE" "$OBJCOPY" $ELF2IMAGEFLAGS -o $TARGET $SOURCE'
+        if int(ARGUMENTS.get("PIOVERBOSE", 0))
+        else "Building $TARGET"
+    ),
+
     PROGSUFFIX=".elf"
 )
 
@@ -302,17 +277,17 @@ env.Replace(
 if env.get("PROGNAME", "program") == "program":
     env.Replace(PROGNAME="firmware")
 
+env.SConscript("elf2image.py", exports="env")
+
 env.Append(
     BUILDERS=dict(
         ElfToBin=Builder(
-            action=env.VerboseAction(" ".join([
-                '"$PYTHONEXE" "$OBJCOPY"',
-                "--chip", mcu, "elf2image",
-                "--flash_mode", "${__get_board_flash_mode(__env__)}",
-                "--flash_freq", "${__get_board_f_image(__env__)}",
-                "--flash_size", board.get("upload.flash_size", "4MB"),
-                "-o", "$TARGET", "$SOURCES"
-            ]), "Building $TARGET"),
+            # the flags are part of the action signature, so changing the
+            # flash parameters rebuilds the image
+            action=Action(
+                lambda source, target, env: env.ElfToImage(target, source),
+                "$ELF2IMAGECOMSTR",
+                varlist=["ELF2IMAGEFLAGS"]),
             suffix=".bin"
         ),
         DataToBin=Builder(
@@ -340,6 +315,8 @@ env.Append(
     )
 )
 
+env.SConscript("partitions.py", exports="env")
+
 if not env.get("PIOFRAMEWORK"):
     env.SConscript("frameworks/_bare.py", exports="env")
 
@@ -347,6 +324,9 @@ if not env.get("PIOFRAMEWORK"):
 # Target: Build executable and linkable firmware or FS image
 #
 
+env.SConscript("symbolstore.py", exports="env")
+env.SConscript("compactlog.py", exports="env")
+
 target_elf = None
 if "nobuild" in COMMAND_LINE_TARGETS:
     target_elf = join("$BUILD_DIR", "${PROGNAME}.elf")
@@ -357,6 +337,8 @@ if "nobuild" in COMMAND_LINE_TARGETS:
         target_firm = join("$BUILD_DIR", "${PROGNAME}.bin")
 else:
     target_elf = env.BuildProgram()
+    env.AddSymbolStoreAction(target_elf)
+    env.AddCompactLogAction(target_elf)
     if set(["buildfs", "uploadfs", "uploadfsota"]) & set(COMMAND_LINE_TARGETS):
         target_firm = env.DataToBin(
             join("$BUILD_DIR", "${ESP32_FS_IMAGE_NAME}"), "$PROJECT_DATA_DIR"
@@ -372,6 +354,31 @@ env.AddPlatformTarget("buildfs", target_firm, target_firm, "Build Filesystem Ima
 AlwaysBuild(env.Alias("nobuild", target_firm))
 target_buildprog = env.Alias("buildprog", target_firm, target_firm)
 
+#
+# Target: Build factory image
+#
+
+env.SConscript("factory.py", exports="env")
+
+factory_images = list(env.get("FLASH_EXTRA_IMAGES", []))
+factory_images.append(("$ESP32_APP_OFFSET", join("$BUILD_DIR", "${PROGNAME}.bin")))
+if "buildfactory" in COMMAND_LINE_TARGETS and env.GetProjectOption(
+    "custom_factory_fs", "no"
+).lower() in ("1", "yes", "true"):
+    fetch_fs_size(env)
+    fs_image = join("$BUILD_DIR", "${ESP32_FS_IMAGE_NAME}.bin")
+    if "nobuild" not in COMMAND_LINE_TARGETS and not set(
+        ["buildfs", "uploadfs", "uploadfsota"]
+    ) & set(COMMAND_LINE_TARGETS):
+        fs_image = env.DataToBin(
+            join("$BUILD_DIR", "${ESP32_FS_IMAGE_NAME}"), "$PROJECT_DATA_DIR"
+        )
+    factory_images.append(("$FS_START", fs_image))
+target_factory = env.BuildFactoryImage(factory_images)
+env.AddPlatformTarget(
+    "buildfactory", target_factory, target_factory, "Build Factory Image"
+)
+
 # update max upload size based on CSV file
 if env.get("PIOMAINPROG"):
     env.AddPreAction(
@@ -470,6 +477,21 @@ elif upload_protocol == "esptool":
         env.VerboseAction("$UPLOADCMD", "Uploading $SOURCE")
     ]
 
+    delta_upload = env.GetProjectOption(
+        "custom_upload_delta", "no").lower() in ("1", "yes", "true")
+    if delta_upload:
+        env.SConscript("deltaflash.py", exports="env")
+        if "uploadfs" in COMMAND_LINE_TARGETS:
+            delta_regions = [("$FS_START", "$SOURCE")]
+        else:
+            delta_regions = [("$ESP32_APP_OFFSET", "$SOURCE")] + list(
+                env.get("FLASH_EXTRA_IMAGES", []))
+        upload_actions[-1] = env.VerboseAction(
+            lambda source, target, env: env.DeltaUpload(
+                [(offset, env.subst(path, source=source, target=target))
+                 for offset, path in delta_regions], target, source),
+            "Uploading $SOURCE (delta)")
+
 elif upload_protocol == "dfu":
 
     hwids = board.get("build.hwids", [["0x2341", "0x0070"]])
@@ -565,13 +587,15 @@ env.AddPlatformTarget(
 # Target: Erase Flash
 #
 
+erase_actions = [
+    env.VerboseAction(BeforeUpload, "Looking for upload port..."),
+    env.VerboseAction("$ERASECMD", "Erasing...")
+]
+
 env.AddPlatformTarget(
     "erase",
     None,
-    [
-        env.VerboseAction(BeforeUpload, "Looking for upload port..."),
-        env.VerboseAction("$ERASECMD", "Erasing...")
-    ],
+    erase_actions,
     "Erase Flash",
 )
 
@@ -0,0 +1,267 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Partition table of the project, shared by the platform and the framework
+build scripts.
+
+The CSV is parsed once per build, the result is kept per file and changes
+only when its modification time and its content change. Partitions without
+an offset are placed like `gen_esp32part.py` does: right after the previous
+partition, apps aligned to 64 KB and data partitions to 4 KB. The binary
+`partitions.bin` written by `gen_esp32part.py` is read as well.
+"""
+
+import collections
+import hashlib
+import os
+import struct
+import sys
+
+Import("env")
+
+PARTITION_TABLE_SIZE = 0x1000
+APP_ALIGNMENT = 0x10000
+DATA_ALIGNMENT = 0x1000
+
+TYPES = {"app": 0x00, "data": 0x01}
+SUBTYPES = {
+    "app": dict(
+        [("factory", 0x00), ("test", 0x20)]
+        + [("ota_%d" % i, 0x10 + i) for i in range(16)]
+    ),
+    "data": {
+        "ota": 0x00,
+        "phy": 0x01,
+        "nvs": 0x02,
+        "coredump": 0x03,
+        "nvs_keys": 0x04,
+        "efuse": 0x05,
+        "undefined": 0x06,
+        "esphttpd": 0x80,
+        "fat": 0x81,
+        "spiffs": 0x82,
+        "littlefs": 0x83,
+    },
+}
+FLAGS = {"encrypted": 0x01, "readonly": 0x02}
+
+# Binary format: magic, type, subtype, offset, size, name, flags
+ENTRY_FORMAT = "<2sBBII16sI"
+ENTRY_SIZE = struct.calcsize(ENTRY_FORMAT)
+ENTRY_MAGIC = b"\xaa\x50"
+MD5_MAGIC = b"\xeb\xeb"
+
+Partition = collections.namedtuple(
+    "Partition", ["name", "type", "subtype", "offset", "size", "flags"]
+)
+
+
+class PartitionTable(collections.namedtuple("PartitionTable", ["path", "partitions"])):
+    """Immutable list of partitions with their resolved offsets and sizes.
+
+    Known types and subtypes are given by name, `"0"` becomes `"app"` for
+    example, unknown ones are kept as written.
+    """
+
+    __slots__ = ()
+
+    def find_all(self, name=None, type=None, subtype=None):
+        # pylint: disable=redefined-builtin
+        return [
+            p
+            for p in self.partitions
+            if (name is None or p.name == name)
+            and (type is None or p.type == type)
+            and (subtype is None or p.subtype in _as_tuple(subtype))
+        ]
+
+    def find(self, name=None, type=None, subtype=None):
+        # pylint: disable=redefined-builtin
+        result = self.find_all(name, type, subtype)
+        return result[0] if result else None
+
+    def get_boot_partition(self):
+        """The app the bootloader starts without OTA data, as in `parttool.py`."""
+        return (
+            self.find(type="app", subtype="factory")
+            or self.find(type="app", subtype="ota_0")
+            or self.find(type="app")
+        )
+
+    def get_app_offset(self, default=0x10000):
+        """Offset the application is uploaded to, the first OTA slot."""
+        ota_0 = self.find(type="app", subtype="ota_0")
+        return ota_0.offset if ota_0 is not None else default
+
+
+def _as_tuple(value):
+    return value if isinstance(value, tuple) else (value,)
+
+
+def parse_size(value):
+    value = value.strip()
+    if value.lower().startswith("0x"):
+        return int(value, 16)
+    if value[-1:].upper() in ("K", "M"):
+        return int(value[:-1], 0) * (1024 if value[-1].upper() == "K" else 1024 * 1024)
+    return int(value)
+
+
+def _normalize_type(value):
+    if value in TYPES:
+        return value
+    number = int(value, 0)
+    for name, type_id in TYPES.items():
+        if type_id == number:
+            return name
+    return value
+
+
+def _normalize_subtype(type_name, value):
+    subtypes = SUBTYPES.get(type_name, {})
+    if value in subtypes or not value:
+        return value
+    try:
+        number = int(value, 0)
+    except ValueError:
+        return value
+    for name, subtype_id in subtypes.items():
+        if subtype_id == number:
+            return name
+    return value
+
+
+def _align(value, alignment):
+    return (value + alignment - 1) & ~(alignment - 1)
+
+
+def parse_partitions_csv(path, table_offset=0x8000):
+    partitions = []
+    next_offset = table_offset + PARTITION_TABLE_SIZE
+    with open(path) as fp:
+        for line_number, line in enumerate(fp, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            tokens = [t.strip() for t in line.split(",")]
+            if len(tokens) < 5:
+                continue
+            try:
+                type_name = _normalize_type(tokens[1])
+                subtype = _normalize_subtype(type_name, tokens[2])
+                if tokens[3]:
+                    offset = parse_size(tokens[3])
+                else:
+                    offset = _align(
+                        next_offset,
+                        APP_ALIGNMENT if type_name == "app" else DATA_ALIGNMENT,
+                    )
+                size = parse_size(tokens[4])
+            except ValueError as e:
+                raise ValueError("%s:%d: %s" % (path, line_number, e))
+            flags = set(
+                flag.strip()
+                for flag in (tokens[5] if len(tokens) > 5 else "").split(":")
+                if flag.strip()
+            )
+            # in the order of the flag bits, like the binary table
+            flags = tuple(flag for flag in FLAGS if flag in flags) + tuple(
+                sorted(flags - set(FLAGS))
+            )
+            partitions.append(
+                Partition(tokens[0], type_name, subtype, offset, size, flags)
+            )
+            next_offset = offset + size
+    return PartitionTable(path, tuple(partitions))
+
+
+def _get_name(ids, value):
+    for name, item_id in ids.items():
+        if item_id == value:
+            return name
+    return "0x%02x" % value
+
+
+def parse_partitions_bin(path):
+    partitions = []
+    with open(path, "rb") as fp:
+        data = fp.read()
+    for pos in range(0, len(data) - ENTRY_SIZE + 1, ENTRY_SIZE):
+        magic, type_id, subtype_id, offset, size, name, flags = struct.unpack_from(
+            ENTRY_FORMAT, data, pos
+        )
+        if magic == MD5_MAGIC:
+            continue
+        if magic != ENTRY_MAGIC:
+            break
+        type_name = _get_name(TYPES, type_id)
+        partitions.append(
+            Partition(
+                name.rstrip(b"\0").decode("utf-8", "replace"),
+                type_name,
+                _get_name(SUBTYPES.get(type_name, {}), subtype_id),
+                offset,
+                size,
+                tuple(name for name, bit in FLAGS.items() if flags & bit),
+            )
+        )
+    return PartitionTable(path, tuple(partitions))
+
+
+def parse_partitions(path, table_offset=0x8000):
+    with open(path, "rb") as fp:
+        is_binary = fp.read(len(ENTRY_MAGIC)) == ENTRY_MAGIC
+    if is_binary:
+        return parse_partitions_bin(path)
+    return parse_partitions_csv(path, table_offset)
+
+
+# (path, mtime, size, table offset) -> table and (path, SHA256, table offset)
+# -> table, a touched but unchanged file is not parsed again
+_tables = {}
+
+
+def GetPartitionTable(env, path=None, table_offset=None):
+    path = os.path.abspath(env.subst(path or "$PARTITIONS_TABLE_CSV"))
+    if table_offset is None:
+        table_offset = env.get("PARTITIONS_TABLE_OFFSET") or int(
+            env.BoardConfig().get("upload.partition_table_offset", "0x8000"), 0
+        )
+    try:
+        st = os.stat(path)
+    except OSError:
+        sys.stderr.write(
+            "Could not find the file %s with partitions table.\n" % path
+        )
+        env.Exit(1)
+        return None
+
+    stat_key = (path, st.st_mtime, st.st_size, table_offset)
+    if stat_key in _tables:
+        return _tables[stat_key]
+    with open(path, "rb") as fp:
+        content_key = (path, hashlib.sha256(fp.read()).hexdigest(), table_offset)
+    if content_key not in _tables:
+        try:
+            _tables[content_key] = parse_partitions(path, table_offset)
+        except ValueError as e:
+            sys.stderr.write("Error: invalid partition table %s\n" % e)
+            env.Exit(1)
+            return None
+    _tables[stat_key] = _tables[content_key]
+    return _tables[stat_key]
+
+
+env.AddMethod(GetPartitionTable)
@@ -0,0 +1,64 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Archives every linked firmware ELF in a store indexed by its SHA256, so
+the exception decoder can symbolize backtraces of older firmwares.
+"""
+
+import os
+import sys
+
+Import("env")
+
+# The store layout is shared with the exception decoder
+MONITOR_DIR = os.path.join(env.PioPlatform().get_dir(), "monitor")
+if MONITOR_DIR not in sys.path:
+    sys.path.insert(0, MONITOR_DIR)
+
+from esp32_decoder.store import SymbolStore  # noqa: E402
+
+
+def GetSymbolStoreDir(env):
+    return env.GetProjectOption(
+        "custom_exception_decoder_symbol_store",
+        os.path.join(env.subst("$PROJECT_WORKSPACE_DIR"), "symbols"),
+    )
+
+
+def _get_store_size(env):
+    return int(
+        env.GetProjectOption("custom_exception_decoder_symbol_store_size", 20)
+    )
+
+
+def _archive_elf(target, source, env):
+    store = SymbolStore(env.GetSymbolStoreDir())
+    try:
+        store.add(target[0].get_abspath())
+        store.prune(_get_store_size(env))
+    except OSError as e:
+        sys.stderr.write("Warning! Failed to archive firmware ELF: %s\n" % e)
+
+
+def AddSymbolStoreAction(env, target_elf):
+    if _get_store_size(env) <= 0:
+        return
+    env.AddPostAction(
+        target_elf, env.VerboseAction(_archive_elf, "Archiving $TARGET")
+    )
+
+
+env.AddMethod(GetSymbolStoreDir)
+env.AddMethod(AddSymbolStoreAction)
@@ -0,0 +1,46 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Command line tools of the Espressif 32 monitor helpers. Run them with the
+Python interpreter of PlatformIO Core, e.g.
+
+    python ~/.platformio/platforms/espressif32/monitor/esp32_decoder --help
+"""
+
+import argparse
+import os
+import sys
+
+if not __package__:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from esp32_decoder import benchmark, coredump, multimon, offline  # noqa: E402
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="esp32_decoder")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+    benchmark.add_parser(commands)
+    coredump.add_parser(commands)
+    multimon.add_parser(commands)
+    offline.add_parser(commands)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
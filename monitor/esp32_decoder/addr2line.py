@@ -0,0 +1,147 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+import subprocess
+import sys
+
+from esp32_decoder.symbols import Location
+
+IS_WINDOWS = sys.platform.startswith("win")
+
+
+class Addr2LineProcess(object):
+    """Long-lived `addr2line` process which symbolizes addresses in batches.
+
+    Addresses are written to the process stdin and the answers are read back
+    from its stdout, so a backtrace costs a single round trip instead of one
+    process spawn (and one read of the debug ELF) per address. The process is
+    restarted when it dies or when the firmware file changes on disk.
+    """
+
+    # Appended to every batch, the answer for it marks the end of the batch
+    SENTINEL = "0xffffffff"
+    # The answers of a batch are only read once all of it was written, larger
+    # batches would fill the stdout pipe of addr2line and block both sides
+    MAX_BATCH_SIZE = 256
+    INLINED_PREFIX = " (inlined by) "
+
+    def __init__(self, addr2line_path, firmware_path):
+        self.addr2line_path = addr2line_path
+        self.firmware_path = firmware_path
+        self._process = None
+        self._firmware_signature = None
+
+    def _get_firmware_signature(self):
+        st = os.stat(self.firmware_path)
+        return (st.st_ino, st.st_size, st.st_mtime)
+
+    def _ensure_running(self):
+        signature = self._get_firmware_signature()
+        if self._process is not None and (
+            self._process.poll() is not None
+            or signature != self._firmware_signature
+        ):
+            self.close()
+        if self._process is not None:
+            return
+
+        self._process = subprocess.Popen(
+            [self.addr2line_path, u"-afipC", u"-e", self.firmware_path],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+            encoding="mbcs" if IS_WINDOWS else "utf-8",
+            errors="replace",
+            bufsize=1,
+        )
+        self._firmware_signature = signature
+
+    def _read_batch(self, size):
+        entries = []
+        while len(entries) <= size:
+            line = self._process.stdout.readline()
+            if not line:
+                raise EOFError("addr2line exited unexpectedly")
+            line = line.rstrip("\r\n")
+            if line.startswith(self.INLINED_PREFIX) and entries:
+                entries[-1].append(line[len(self.INLINED_PREFIX) :])
+            else:
+                entries.append([line.split(": ", 1)[-1]])
+        # the last entry belongs to the sentinel address
+        return entries[:size]
+
+    def lookup(self, addresses):
+        """Returns `addr2line -fipC` output lines for every address"""
+        try:
+            self._ensure_running()
+            result = []
+            for start in range(0, len(addresses), self.MAX_BATCH_SIZE):
+                batch = addresses[start : start + self.MAX_BATCH_SIZE]
+                self._process.stdin.write(
+                    "".join("%s\n" % addr for addr in batch + [self.SENTINEL])
+                )
+                self._process.stdin.flush()
+                result.extend(self._read_batch(len(batch)))
+            return result
+        except (EOFError, OSError, ValueError):
+            self.close()
+            raise
+
+    def close(self):
+        process, self._process = self._process, None
+        if process is None:
+            return
+        try:
+            process.stdin.close()
+            process.wait(timeout=1)
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            process.kill()
+
+
+class Addr2LineSymbolizer(object):
+    """Symbolization backend built on top of the toolchain `addr2line`"""
+
+    LOCATION_RE = re.compile(r"^(.*) at (.*):(\?|\d+)(?: \(discriminator \d+\))?$")
+
+    def __init__(self, addr2line_path, firmware_path):
+        self.firmware_path = firmware_path
+        self._process = Addr2LineProcess(addr2line_path, firmware_path)
+
+    def _parse_location(self, output):
+        m = self.LOCATION_RE.match(output)
+        if m is None:
+            return Location(output, None, 0)
+        function, path, line = m.groups()
+        return Location(
+            None if function == "??" else function,
+            None if path == "??" else path,
+            int(line) if line.isdigit() else 0,
+        )
+
+    def lookup(self, addresses):
+        result = []
+        outputs = self._process.lookup(["0x%08x" % addr for addr in addresses])
+        for lines in outputs:
+            # throw out addresses not from ELF
+            if lines == ["?? ??:0"]:
+                result.append(())
+                continue
+            result.append(tuple(self._parse_location(line) for line in lines))
+        return result
+
+    def close(self):
+        self._process.close()
@@ -0,0 +1,123 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Replays a captured serial log through the exception decoder line path at
+a given byte rate and reports whether it keeps up with the serial port.
+"""
+
+import codecs
+import time
+
+from esp32_decoder.parser import BacktraceParser, get_elf_arch
+from esp32_decoder.stream import LineAssembler, insert_after_lines
+from esp32_decoder.symbols import format_backtrace
+
+
+def make_line_handler(symbolizer=None, parser=None):
+    parser = parser or BacktraceParser()
+
+    def _handle_line(line):
+        frames = parser.parse(line)
+        if not frames:
+            return ""
+        if symbolizer is None:
+            return "".join(
+                "  #%-2d 0x%08x in ??\n" % (i, frame.address)
+                for i, frame in enumerate(frames)
+            )
+        results = symbolizer.lookup([frame.lookup_address for frame in frames])
+        return format_backtrace([frame.address for frame in frames], results)
+
+    return _handle_line
+
+
+def replay(path, baudrate, handle_line, chunk_interval=0.01, paced=True):
+    """Feeds the log to the line path in chunks of `chunk_interval` seconds.
+
+    A serial port with 8N1 framing delivers `baudrate / 10` bytes per second.
+    """
+    chunk_size = max(1, int(baudrate / 10 * chunk_interval))
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    assembler = LineAssembler()
+    stats = dict(bytes=0, chunks=0, busy=0.0, max_latency=0.0, late_chunks=0)
+
+    started = time.perf_counter()
+    with open(path, "rb") as fp:
+        for data in iter(lambda: fp.read(chunk_size), b""):
+            text = decoder.decode(data)
+            begin = time.perf_counter()
+            insert_after_lines(text, assembler.feed(text), handle_line)
+            latency = time.perf_counter() - begin
+
+            stats["bytes"] += len(data)
+            stats["chunks"] += 1
+            stats["busy"] += latency
+            stats["max_latency"] = max(stats["max_latency"], latency)
+            if latency > chunk_interval:
+                stats["late_chunks"] += 1
+            if paced:
+                delay = started + stats["chunks"] * chunk_interval - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+    stats["elapsed"] = time.perf_counter() - started
+    return stats
+
+
+def _run(args):
+    symbolizer = parser = None
+    if args.elf:
+        from esp32_decoder.elf import (  # pylint: disable=import-outside-toplevel
+            ElfSymbolizer,
+        )
+
+        symbolizer = ElfSymbolizer(args.elf)
+        parser = BacktraceParser(get_elf_arch(args.elf))
+    stats = replay(
+        args.log,
+        args.baudrate,
+        make_line_handler(symbolizer, parser),
+        chunk_interval=args.chunk_ms / 1000.0,
+        paced=not args.no_pace,
+    )
+    rate = args.baudrate / 10.0
+    throughput = stats["bytes"] / stats["busy"] if stats["busy"] else float("inf")
+    print("Replayed %d bytes in %d chunks" % (stats["bytes"], stats["chunks"]))
+    print("Wall time:          %.3f s" % stats["elapsed"])
+    print("Time in line path:  %.3f s" % stats["busy"])
+    print("Throughput:         %.2f MB/s" % (throughput / 1e6))
+    print("Port byte rate:     %.2f MB/s" % (rate / 1e6))
+    print("Headroom:           %.1fx" % (throughput / rate))
+    print("Max chunk latency:  %.3f ms" % (stats["max_latency"] * 1000))
+    print("Late chunks:        %d" % stats["late_chunks"])
+    return 0 if not stats["late_chunks"] else 1
+
+
+def add_parser(commands):
+    parser = commands.add_parser(
+        "bench", help="Replay a captured serial log through the decoder line path"
+    )
+    parser.add_argument("log", help="captured serial log")
+    parser.add_argument("--baudrate", type=int, default=115200)
+    parser.add_argument(
+        "--chunk-ms",
+        type=float,
+        default=10,
+        help="interval between serial reads in milliseconds",
+    )
+    parser.add_argument("--elf", help="symbolize backtraces with this firmware")
+    parser.add_argument(
+        "--no-pace", action="store_true", help="replay as fast as possible"
+    )
+    parser.set_defaults(func=_run)
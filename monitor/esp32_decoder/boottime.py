@@ -0,0 +1,218 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Splits the boot of the firmware into phases with the timestamps of its log:
+
+    rst:0x1 (POWERON_RESET),boot:0x13 (SPI_FAST_FLASH_BOOT)
+    I (29) boot: ESP-IDF v5.1 2nd stage bootloader
+    I (253) cpu_start: Pro cpu up.
+    I (312) main_task: Calling app_main()
+    I (1843) esp_netif_handlers: sta ip: 192.168.1.2, mask: ...
+
+Each boot point is taken from the first line with one of its markers, the
+log timestamps count milliseconds since the reset. A phase is the time
+between two consecutive points which were reached. A reset is detected by
+the banner of the ROM or by log timestamps which go back in time.
+"""
+
+import collections
+import re
+
+RESET_MARKERS = ("rst:", "ESP-ROM:")
+RESET_REASON_RE = re.compile(r"rst:0x[0-9a-fA-F]+ \(([A-Z0-9_]+)\)")
+# `I (1234) tag: ...`, or with the system time `I (12:34:56.789) tag: ...`
+LOG_TIMESTAMP_RE = re.compile(
+    r"^(?:\x1b\[[0-9;]*m)?[EWIDV] \((?:(\d+)|(\d+):(\d+):(\d+)\.(\d+))\) "
+)
+# timestamps which go back by more than this start a new boot
+RESET_TOLERANCE_MS = 100
+
+POINT_RESET = "reset"
+BOOT_POINTS = (
+    ("bootloader", ("2nd stage bootloader",)),
+    ("app", ("cpu_start: ", "app_init: ", "Pro cpu up")),
+    ("app_main", ("Calling app_main()", "Starting scheduler")),
+    ("wifi", ("wifi:connected with", "sta ip: ", "got ip:")),
+)
+
+
+def parse_points(text):
+    """Parses user defined boot points, one `name = marker` per line."""
+    result = []
+    for item in (text or "").splitlines():
+        name, sep, marker = item.partition("=")
+        if sep and name.strip() and marker.strip():
+            result.append((name.strip(), (marker.strip(),)))
+    return result
+
+
+def get_log_timestamp(line):
+    """Returns the log timestamp of a line in milliseconds or None."""
+    m = LOG_TIMESTAMP_RE.match(line)
+    if m is None:
+        return None
+    if m.group(1) is not None:
+        return int(m.group(1))
+    hours, minutes, seconds, millis = (int(value) for value in m.groups()[1:])
+    return ((hours * 60 + minutes) * 60 + seconds) * 1000 + millis
+
+
+class Boot(object):
+    def __init__(self, now, reason=None):
+        # set once the boot is finished
+        self.number = None
+        self.reason = reason
+        self.host_time = now
+        # the monitor was started in the middle of this boot
+        self.partial = False
+        # point name -> milliseconds since the reset
+        self.points = collections.OrderedDict([(POINT_RESET, 0)])
+        self.last_timestamp = None
+        self.last_host_time = None
+
+    def get_phases(self):
+        """Returns `(name, duration)` of the phases in the order of time."""
+        points = sorted(self.points.items(), key=lambda item: item[1])
+        return [
+            ("%s..%s" % (start, end), end_time - start_time)
+            for (start, start_time), (end, end_time) in zip(points, points[1:])
+        ]
+
+    @property
+    def duration(self):
+        return max(self.points.values())
+
+
+class BootTracker(object):
+    """Tracks the boot points of the log lines of a device.
+
+    `feed_line` returns the boot which was finished by the line, a boot
+    ends when the `last` point or, without one, all points are reached,
+    with the next reset or when it `expire`s. A boot which was not seen from its reset is left out.
+    """
+
+    def __init__(self, points=None, last=None):
+        self.points = list(BOOT_POINTS) + list(points or ())
+        self.last = last
+        self.markers = tuple(
+            marker for _, markers in self.points for marker in markers
+        )
+        self.current = None
+        # phase name -> durations of all boots
+        self.phases = collections.OrderedDict()
+        self.totals = []
+
+    def feed_line(self, line, now):
+        finished = None
+        timestamp = get_log_timestamp(line)
+        if any(marker in line for marker in RESET_MARKERS):
+            m = RESET_REASON_RE.search(line)
+            # the ROM banner is printed over several lines
+            if self.current is None or len(self.current.points) > 1 or (
+                self.current.last_timestamp is not None
+            ):
+                finished = self.reset(now, m.group(1) if m else None)
+            elif m is not None:
+                self.current.reason = m.group(1)
+            return finished
+        if (
+            timestamp is not None
+            and self.current is not None
+            and self.current.last_timestamp is not None
+            and timestamp < self.current.last_timestamp - RESET_TOLERANCE_MS
+        ):
+            finished = self.reset(now)
+        if self.current is None:
+            if timestamp is None:
+                return None
+            self.reset(now)
+            self.current.partial = True
+
+        boot = self.current
+        if timestamp is not None:
+            boot.last_timestamp = timestamp
+            boot.last_host_time = now
+        for name, markers in self.points:
+            if name in boot.points or not any(marker in line for marker in markers):
+                continue
+            if timestamp is None and boot.last_timestamp is not None:
+                # a line printed without a timestamp, e.g. by `printf()`
+                timestamp = boot.last_timestamp + int(
+                    (now - boot.last_host_time) * 1000
+                )
+            boot.points[name] = timestamp or 0
+            if name == self.last or (
+                self.last is None and len(boot.points) == len(self.points) + 1
+            ):
+                return finished or self.finish()
+        return finished
+
+    def reset(self, now, reason=None):
+        finished = self.finish()
+        self.current = Boot(now, reason)
+        return finished
+
+    def expire(self, now, timeout):
+        """Finishes a boot which did not reach the last point in time."""
+        if self.current is None or now - self.current.host_time < timeout:
+            return None
+        return self.finish()
+
+    def finish(self):
+        boot, self.current = self.current, None
+        if boot is None or boot.partial or len(boot.points) < 2:
+            return None
+        for name, duration in boot.get_phases():
+            self.phases.setdefault(name, []).append(duration)
+        self.totals.append(boot.duration)
+        boot.number = len(self.totals)
+        return boot
+
+
+def get_distribution(values):
+    """Returns `(min, median, p90, max)` of a list of values."""
+    values = sorted(values)
+    return (
+        values[0],
+        values[len(values) // 2],
+        values[min(len(values) - 1, len(values) * 9 // 10)],
+        values[-1],
+    )
+
+
+def format_boot(boot, tracker, prefix="  "):
+    lines = [
+        "%sBoot #%d%s: %d ms\n"
+        % (
+            prefix,
+            boot.number,
+            " (%s)" % boot.reason if boot.reason else "",
+            boot.duration,
+        )
+    ]
+    for name, duration in boot.get_phases():
+        lines.append("%s  %-28s %8d ms\n" % (prefix, name, duration))
+    if len(tracker.totals) > 1:
+        lines.append(
+            "%s  %-28s %6s %8s %8s %8s %8s\n"
+            % (prefix, "PHASE", "BOOTS", "MIN", "MEDIAN", "P90", "MAX")
+        )
+        rows = list(tracker.phases.items()) + [("total", tracker.totals)]
+        for name, durations in rows:
+            lines.append(
+                "%s  %-28s %6d %8d %8d %8d %8d\n"
+                % ((prefix, name, len(durations)) + get_distribution(durations))
+            )
+    return "".join(lines) + "\n"
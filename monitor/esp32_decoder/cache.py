@@ -0,0 +1,128 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from esp32_decoder.symbols import Location
+
+
+def get_file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SymbolCache(object):
+    """Persistent LRU cache of symbolized addresses.
+
+    Entries are keyed by the SHA256 of the firmware ELF and the address, so
+    a rebuilt firmware never hits stale entries and the same firmware is
+    shared between monitor sessions and project environments. The least
+    recently used entries are evicted once `max_entries` is exceeded.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS frames (
+            elf TEXT NOT NULL,
+            address INTEGER NOT NULL,
+            locations TEXT NOT NULL,
+            used REAL NOT NULL,
+            UNIQUE (elf, address)
+        );
+        CREATE INDEX IF NOT EXISTS frames_used ON frames (used);
+    """
+
+    def __init__(self, path, max_entries=50000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self._db = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self._db.executescript(self.SCHEMA)
+        self._size = self._db.execute("SELECT COUNT(*) FROM frames").fetchone()[0]
+
+    @staticmethod
+    def _encode(locations):
+        return json.dumps([list(loc) for loc in locations])
+
+    @staticmethod
+    def _decode(data):
+        return tuple(Location(*loc) for loc in json.loads(data))
+
+    def get_many(self, elf_hash, addresses):
+        result = {}
+        now = time.time()
+        with self._lock:
+            for address in set(addresses):
+                row = self._db.execute(
+                    "SELECT locations FROM frames WHERE elf = ? AND address = ?",
+                    (elf_hash, address),
+                ).fetchone()
+                if row is not None:
+                    result[address] = self._decode(row[0])
+            if result:
+                self._db.executemany(
+                    "UPDATE frames SET used = ? WHERE elf = ? AND address = ?",
+                    [(now, elf_hash, address) for address in result],
+                )
+                self._db.commit()
+        return result
+
+    def put_many(self, elf_hash, items):
+        now = time.time()
+        with self._lock:
+            before = self._db.total_changes
+            self._db.executemany(
+                "INSERT OR REPLACE INTO frames VALUES (?, ?, ?, ?)",
+                [
+                    (elf_hash, address, self._encode(locations), now)
+                    for address, locations in items.items()
+                ],
+            )
+            self._size += self._db.total_changes - before
+            if self._size > self.max_entries:
+                self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        # drop a bit more than required to not evict on every insert
+        excess = self._size - int(self.max_entries * 0.9)
+        self._db.execute(
+            "DELETE FROM frames WHERE rowid IN "
+            "(SELECT rowid FROM frames ORDER BY used LIMIT ?)",
+            (excess,),
+        )
+        self._size = self._db.execute("SELECT COUNT(*) FROM frames").fetchone()[0]
+
+    def lookup(self, elf_hash, addresses, resolve):
+        """Symbolizes addresses, only cache misses are passed to `resolve`"""
+        known = self.get_many(elf_hash, addresses)
+        missing = [addr for addr in addresses if addr not in known]
+        if missing:
+            resolved = dict(zip(missing, resolve(missing)))
+            self.put_many(elf_hash, resolved)
+            known.update(resolved)
+        return [known[addr] for addr in addresses]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
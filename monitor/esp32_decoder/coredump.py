@@ -0,0 +1,549 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Core dumps of ESP-IDF in the ELF format.
+
+With `CONFIG_ESP_COREDUMP_ENABLE_TO_UART` the panic handler prints the core
+dump base64 encoded between two markers:
+
+    ================= CORE DUMP START =================
+    AQAAAAcAAAA...
+    ================= CORE DUMP END =================
+
+With `CONFIG_ESP_COREDUMP_ENABLE_TO_FLASH` it is written to the `coredump`
+partition, it can be read from a flash image offline:
+
+    python esp32_decoder coredump --elf firmware.elf flash_image.bin
+
+The dump holds the registers and the stacks of all tasks. The tasks are
+unwound in-process, the saved ELF core can be loaded into GDB for more.
+"""
+
+import binascii
+import collections
+import os
+import re
+import struct
+import sys
+import tempfile
+import time
+
+from esp32_decoder.parser import ARCH_RISCV, ARCH_XTENSA, ELF_MACHINES
+from esp32_decoder.registers import describe_exception_cause
+from esp32_decoder.symbols import format_locations
+
+COREDUMP_START_MARKER = "CORE DUMP START"
+COREDUMP_END_MARKER = "CORE DUMP END"
+BASE64_LINE_RE = re.compile(r"^[A-Za-z0-9+/=]+$")
+BASE64_TEXT_RE = re.compile(rb"^[A-Za-z0-9+/=\r\n]+$")
+
+# data_len, version, tasks_num, tcb_sz, mem_segs_num
+HEADER = struct.Struct("<5I")
+PT_LOAD = 1
+PT_NOTE = 4
+NT_PRSTATUS = 1
+# `elf_prstatus` up to `pr_reg`, the task handle is stored as `pr_pid`
+PRSTATUS_SIZE = 72
+PRSTATUS_PID_OFFSET = 24
+# Xtensa `pr_reg`: pc, ps, lbeg, lend, lcount, sar, windowstart, windowbase,
+# 56 reserved registers and the address registers
+XTENSA_AR_INDEX = 64
+# Xtensa special registers of the `EXTRA_INFO` note
+XTENSA_EXCCAUSE = 232
+XTENSA_EXCVADDR = 238
+# `pcTaskName` in the FreeRTOS TCB
+TASK_NAME_OFFSET = 52
+TASK_NAME_SIZE = 16
+
+# The partition table of a flash image and the type of the core dump partition
+PARTITION_TABLE_OFFSET = 0x8000
+PARTITION_ENTRY = struct.Struct("<2sBBII16sI")
+PARTITION_MAGIC = b"\xaa\x50"
+PARTITION_COREDUMP = (0x01, 0x03)
+
+Task = collections.namedtuple("Task", ["tcb", "registers"])
+
+
+class CoreDumpError(Exception):
+    pass
+
+
+class CoreDump(object):
+    """Reads the tasks and the memory of a core dump."""
+
+    def __init__(self, data):
+        if len(data) < HEADER.size:
+            raise CoreDumpError("the core dump is empty")
+        self.size, self.version, _, _, _ = HEADER.unpack_from(data)
+        if self.size == 0xFFFFFFFF:
+            raise CoreDumpError("there is no core dump, the partition is erased")
+        self.truncated = len(data) < self.size
+        start = data.find(b"\x7fELF", 0, 64)
+        if start == -1:
+            raise CoreDumpError(
+                "core dump version 0x%08x is not in the ELF format" % self.version
+            )
+        self.elf = bytes(data[start : min(len(data), self.size)])
+        self.arch = None
+        self.segments = []
+        self.tasks = []
+        self.app_sha256 = None
+        self.crashed_tcb = None
+        self.exception_registers = {}
+        self.panic_reason = None
+        self._parse()
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, "rb") as fp:
+            return cls(fp.read())
+
+    def _parse(self):
+        elf = self.elf
+        if len(elf) < 52 or elf[4] != 1 or elf[5] != 1:
+            raise CoreDumpError("the core is not a little-endian ELF32 file")
+        (machine,) = struct.unpack_from("<H", elf, 18)
+        self.arch = ELF_MACHINES.get(machine)
+        (phoff,) = struct.unpack_from("<I", elf, 28)
+        phentsize, phnum = struct.unpack_from("<HH", elf, 42)
+        for i in range(phnum):
+            if phoff + (i + 1) * phentsize > len(elf):
+                break
+            p_type, offset, vaddr, _, filesz, _, _, _ = struct.unpack_from(
+                "<8I", elf, phoff + i * phentsize
+            )
+            data = elf[offset : offset + filesz]
+            if p_type == PT_LOAD and data:
+                self.segments.append((vaddr, data))
+            elif p_type == PT_NOTE:
+                self._parse_notes(data)
+
+    def _parse_notes(self, data):
+        pos = 0
+        while pos + 12 <= len(data):
+            namesz, descsz, note_type = struct.unpack_from("<3I", data, pos)
+            pos += 12
+            name = data[pos : pos + namesz].rstrip(b"\0").decode("ascii", "replace")
+            pos += (namesz + 3) & ~3
+            desc = data[pos : pos + descsz]
+            pos += (descsz + 3) & ~3
+            self._parse_note(name, note_type, desc)
+
+    def _parse_note(self, name, note_type, desc):
+        if name == "CORE" and note_type == NT_PRSTATUS:
+            if len(desc) < PRSTATUS_SIZE + 4:
+                return
+            (tcb,) = struct.unpack_from("<I", desc, PRSTATUS_PID_OFFSET)
+            count = (len(desc) - PRSTATUS_SIZE) // 4
+            registers = struct.unpack_from("<%dI" % count, desc, PRSTATUS_SIZE)
+            self.tasks.append(Task(tcb, registers))
+        elif name == "ESP_CORE_DUMP_INFO" and len(desc) > 4:
+            self.app_sha256 = (
+                desc[4:].split(b"\0")[0].decode("ascii", "replace").lower() or None
+            )
+        elif name == "EXTRA_INFO" and len(desc) >= 4:
+            (self.crashed_tcb,) = struct.unpack_from("<I", desc)
+            if self.arch == ARCH_XTENSA:
+                for i in range(4, len(desc) - 7, 8):
+                    index, value = struct.unpack_from("<II", desc, i)
+                    if index == XTENSA_EXCCAUSE:
+                        self.exception_registers["EXCCAUSE"] = value
+                    elif index == XTENSA_EXCVADDR:
+                        self.exception_registers["EXCVADDR"] = value
+        elif name == "ESP_PANIC_DETAILS":
+            self.panic_reason = (
+                desc.split(b"\0")[0].decode("utf-8", "replace").strip() or None
+            )
+
+    def read(self, address, size):
+        for vaddr, data in self.segments:
+            if vaddr <= address and address + size <= vaddr + len(data):
+                return data[address - vaddr : address - vaddr + size]
+        return None
+
+    def read_word(self, address):
+        data = self.read(address, 4)
+        return struct.unpack("<I", data)[0] if data is not None else None
+
+    def get_segment(self, address):
+        """Returns `(start, data)` of the saved memory holding an address."""
+        for vaddr, data in self.segments:
+            if vaddr <= address < vaddr + len(data):
+                return vaddr, data
+        return None
+
+    def get_task_name(self, task):
+        data = self.read(task.tcb + TASK_NAME_OFFSET, TASK_NAME_SIZE)
+        if data is None:
+            return None
+        name = data.split(b"\0")[0]
+        if not name or any(c < 0x20 or c > 0x7E for c in bytearray(name)):
+            return None
+        return name.decode("ascii")
+
+    def save_elf(self, path):
+        with open(path, "wb") as fp:
+            fp.write(self.elf)
+        return path
+
+
+def get_task_frames(dump, task, is_code, max_depth=32):
+    """Returns the `(address, lookup_address)` pairs of a task backtrace.
+
+    Xtensa tasks are unwound with the base save areas of the windowed ABI,
+    the return addresses of the callers are stored 16 bytes below the stack
+    pointer of the callees. Without frame pointers only the program counter
+    and the return address of a RISC-V task are known.
+    """
+    registers = task.registers
+    pc = registers[0]
+    frames = [(pc, pc)] if pc else []
+    if dump.arch == ARCH_RISCV:
+        ra = registers[1] if len(registers) > 1 else 0
+        if ra and is_code(ra - 1):
+            frames.append((ra, ra - 1))
+        return frames
+    if dump.arch != ARCH_XTENSA or len(registers) < XTENSA_AR_INDEX + 2:
+        return frames
+
+    next_pc = registers[XTENSA_AR_INDEX]
+    sp = registers[XTENSA_AR_INDEX + 1]
+    while next_pc and len(frames) < max_depth:
+        address = (next_pc & 0x3FFFFFFF) | 0x40000000
+        if not is_code(address - 1):
+            break
+        frames.append((address, address - 1))
+        next_pc = dump.read_word(sp - 16)
+        next_sp = dump.read_word(sp - 12)
+        if next_pc is None or next_sp is None or next_sp <= sp:
+            break
+        sp = next_sp
+    return frames
+
+
+def get_stack_pointer(dump, task):
+    index = 2 if dump.arch == ARCH_RISCV else XTENSA_AR_INDEX + 1
+    return task.registers[index] if len(task.registers) > index else None
+
+
+def get_stack_references(dump, task, is_code, limit=8):
+    """Returns the saved stack of a task and the code addresses found on it."""
+    sp = get_stack_pointer(dump, task)
+    segment = dump.get_segment(sp) if sp else None
+    if segment is None:
+        return 0, []
+    start, data = segment
+    stack = data[sp - start :]
+    result = []
+    for (value,) in struct.iter_unpack("<I", stack[: len(stack) & ~3]):
+        if dump.arch == ARCH_XTENSA and value >> 30 in (2, 3):
+            value = (value & 0x3FFFFFFF) | 0x40000000
+        if value and is_code(value - 1) and value not in result:
+            result.append(value)
+            if len(result) == limit:
+                break
+    return len(stack), result
+
+
+def format_core_dump(dump, lookup, is_code, prefix="  "):
+    """Formats the summary of a core dump.
+
+    `lookup(addresses)` symbolizes addresses, `is_code(address)` tells
+    whether an address belongs to a code section.
+    """
+    tasks = sorted(dump.tasks, key=lambda task: task.tcb != dump.crashed_tcb)
+    analyzed = []
+    addresses = []
+    for task in tasks:
+        frames = get_task_frames(dump, task, is_code)
+        stack_size, references = get_stack_references(dump, task, is_code)
+        analyzed.append((task, frames, stack_size, references))
+        addresses.extend(lookup_address for _, lookup_address in frames)
+        addresses.extend(value - 1 for value in references)
+    locations = dict(zip(addresses, lookup(addresses))) if addresses else {}
+
+    lines = [
+        "%sCore dump: %d task(s)%s%s\n"
+        % (
+            prefix,
+            len(dump.tasks),
+            ", firmware ELF SHA256 %s" % dump.app_sha256 if dump.app_sha256 else "",
+            ", TRUNCATED" if dump.truncated else "",
+        )
+    ]
+    if dump.panic_reason:
+        lines.append("%sPanic reason: %s\n" % (prefix, dump.panic_reason))
+    cause = describe_exception_cause(dump.arch, dump.exception_registers)
+    if cause is not None:
+        if "EXCVADDR" in dump.exception_registers:
+            cause += ", EXCVADDR 0x%08x" % dump.exception_registers["EXCVADDR"]
+        lines.append("%sException: %s\n" % (prefix, cause))
+
+    for task, frames, stack_size, references in analyzed:
+        lines.append(
+            "\n%sTask %s (TCB 0x%08x)%s:\n"
+            % (
+                prefix,
+                dump.get_task_name(task) or "?",
+                task.tcb,
+                " crashed" if task.tcb == dump.crashed_tcb else "",
+            )
+        )
+        for i, (address, lookup_address) in enumerate(frames):
+            lines.append(
+                "%s  #%-2d 0x%08x in %s\n"
+                % (
+                    prefix,
+                    i,
+                    address,
+                    format_locations(locations.get(lookup_address)) or "??",
+                )
+            )
+        if not stack_size:
+            continue
+        lines.append(
+            "%s  stack at 0x%08x, %d bytes saved%s\n"
+            % (
+                prefix,
+                get_stack_pointer(dump, task),
+                stack_size,
+                ", code addresses on it:" if references else "",
+            )
+        )
+        for value in references:
+            lines.append(
+                "%s    0x%08x in %s\n"
+                % (prefix, value, format_locations(locations.get(value - 1)) or "??")
+            )
+    return "".join(lines) + "\n"
+
+
+class CoreDumpCapture(object):
+    """Captures the base64 core dumps printed to the UART.
+
+    The base64 text is decoded while it arrives and written to a file in
+    `directory`, `feed` returns the paths of the dumps finished by a chunk.
+    Lines which are not base64, e.g. log lines of the other core, are
+    skipped. A dump over `max_size` bytes is dropped.
+    """
+
+    def __init__(self, directory, max_size=16 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self._tail = ""
+        self._line = ""
+        self._pending = ""
+        self._file = None
+        self._size = 0
+
+    @property
+    def capturing(self):
+        return self._file is not None
+
+    def feed(self, text):
+        finished = []
+        while text:
+            if self._file is None:
+                data = self._tail + text
+                idx = data.find(COREDUMP_START_MARKER)
+                if idx == -1:
+                    self._tail = data[-len(COREDUMP_START_MARKER) + 1 :]
+                    break
+                end = data.find("\n", idx)
+                if end == -1:
+                    # wait for the end of the marker line
+                    self._tail = data[idx:]
+                    break
+                self._tail = ""
+                self._start()
+                text = data[end + 1 :]
+                continue
+
+            data = self._line + text
+            lines = data.split("\n")
+            self._line = lines.pop()
+            text = ""
+            for i, line in enumerate(lines):
+                if COREDUMP_END_MARKER in line:
+                    path = self._finish()
+                    if path is not None:
+                        finished.append(path)
+                    text = "\n".join(lines[i + 1 :] + [self._line])
+                    self._line = ""
+                    break
+                line = line.strip()
+                if BASE64_LINE_RE.match(line):
+                    self._write(line)
+            if self._file is not None and self._size > self.max_size:
+                self.close()
+        return finished
+
+    def _start(self):
+        self.close()
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self._file = tempfile.NamedTemporaryFile(  # pylint: disable=consider-using-with
+            dir=self.directory, prefix="coredump-", suffix=".tmp", delete=False
+        )
+        self._size = 0
+
+    def _write(self, chars):
+        chars = self._pending + chars
+        size = len(chars) & ~3
+        self._pending = chars[size:]
+        if not size:
+            return
+        try:
+            data = binascii.a2b_base64(chars[:size])
+        except binascii.Error:
+            return
+        self._file.write(data)
+        self._size += len(data)
+
+    def _finish(self):
+        if self._pending:
+            self._write("=" * (-len(self._pending) % 4))
+        path = self._file.name
+        self._file.close()
+        self._file = None
+        self._pending = ""
+        if not self._size:
+            os.remove(path)
+            return None
+        target = os.path.join(
+            self.directory,
+            "coredump-%s-%03d.bin"
+            % (time.strftime("%Y%m%d-%H%M%S"), int(time.time() * 1000) % 1000),
+        )
+        os.replace(path, target)
+        return target
+
+    def close(self):
+        """Drops an unfinished dump."""
+        if self._file is None:
+            return
+        self._file.close()
+        os.remove(self._file.name)
+        self._file = None
+        self._pending = ""
+        self._line = ""
+
+
+def find_core_dump_partition(fp):
+    """Returns `(offset, size)` of the core dump partition of a flash image."""
+    fp.seek(PARTITION_TABLE_OFFSET)
+    table = fp.read(0xC00)
+    for pos in range(0, len(table) - PARTITION_ENTRY.size + 1, PARTITION_ENTRY.size):
+        magic, ptype, subtype, offset, size, _, _ = PARTITION_ENTRY.unpack_from(
+            table, pos
+        )
+        if magic != PARTITION_MAGIC:
+            break
+        if (ptype, subtype) == PARTITION_COREDUMP:
+            return offset, size
+    return None
+
+
+def read_core_dump(path, directory):
+    """Loads a core dump from a file.
+
+    The file is a serial log with a base64 core dump, a flash image with a
+    core dump partition or a raw core dump. Base64 dumps are decoded to a
+    file in `directory`. Returns the dump and the path of its raw data.
+    """
+    with open(path, "rb") as fp:
+        head = fp.read(PARTITION_TABLE_OFFSET + 2)
+        if COREDUMP_START_MARKER.encode() in head or BASE64_TEXT_RE.match(head[:64]):
+            fp.seek(0)
+            text = fp.read().decode("utf-8", "replace")
+            if COREDUMP_START_MARKER not in text:
+                text = "%s\n%s\n%s\n" % (
+                    COREDUMP_START_MARKER,
+                    text,
+                    COREDUMP_END_MARKER,
+                )
+            paths = CoreDumpCapture(directory).feed(text)
+            if not paths:
+                raise CoreDumpError("no complete base64 core dump in %s" % path)
+            return CoreDump.from_file(paths[-1]), paths[-1]
+        if head[PARTITION_TABLE_OFFSET:] == PARTITION_MAGIC:
+            partition = find_core_dump_partition(fp)
+            if partition is None:
+                raise CoreDumpError("the flash image has no core dump partition")
+            fp.seek(partition[0])
+            return CoreDump(fp.read(partition[1])), path
+    return CoreDump.from_file(path), path
+
+
+def add_parser(commands):
+    parser = commands.add_parser(
+        "coredump", help="Decode a core dump of a log, a flash image or a file"
+    )
+    parser.add_argument(
+        "path", help="serial log, flash image, core dump partition or raw dump"
+    )
+    parser.add_argument(
+        "--elf",
+        action="append",
+        help="firmware ELF, the one matching the SHA256 of the dump is used "
+        "(repeatable)",
+    )
+    parser.add_argument("--store", help="symbol store with archived firmware ELFs")
+    parser.add_argument("--rom-elf")
+    parser.add_argument(
+        "--addr2line", help="symbolize with this addr2line instead of in-process"
+    )
+    parser.add_argument("--save-elf", help="write the ELF core for GDB to this file")
+    parser.set_defaults(func=_run)
+
+
+def _run(args):
+    # pylint: disable=import-outside-toplevel
+    from esp32_decoder.offline import SymbolServer
+
+    if not args.elf and not args.store:
+        sys.stderr.write("Error: specify the firmware with --elf and/or --store\n")
+        return 2
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            dump, _ = read_core_dump(args.path, directory)
+    except (OSError, CoreDumpError) as e:
+        sys.stderr.write("Error: %s\n" % e)
+        return 1
+
+    images = [("rom", args.rom_elf)] if args.rom_elf else []
+    server = SymbolServer(args.elf or [], images, args.store, args.addr2line)
+    try:
+        firmware = server.get_default()
+        if dump.app_sha256:
+            firmware = server.select(dump.app_sha256)
+            if firmware is None:
+                sys.stderr.write(
+                    "Error: no firmware ELF with SHA256 %s\n" % dump.app_sha256
+                )
+                return 1
+        sys.stdout.write(
+            format_core_dump(
+                dump,
+                lambda addresses: server.lookup(firmware, addresses),
+                lambda address: server.is_code(firmware, address),
+                prefix="",
+            )
+        )
+    finally:
+        server.close()
+    if args.save_elf:
+        dump.save_elf(args.save_elf)
+    return 0
@@ -0,0 +1,337 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+import collections
+import posixpath
+
+from elftools.common.exceptions import ELFError
+from elftools.elf.elffile import ELFFile
+from elftools.elf.sections import SymbolTableSection
+
+from esp32_decoder.symbols import Location
+
+# Scopes which qualify C++ function names, e.g. `ns::Class::method`
+QUALIFYING_TAGS = (
+    "DW_TAG_namespace",
+    "DW_TAG_class_type",
+    "DW_TAG_structure_type",
+    "DW_TAG_union_type",
+)
+
+Function = collections.namedtuple(
+    "Function", ["low", "high", "name", "inlined"]
+)
+InlinedCall = collections.namedtuple(
+    "InlinedCall", ["low", "high", "depth", "name", "call_file", "call_line"]
+)
+
+
+def _to_str(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    return value
+
+
+def get_attr_value(die, name, default=None):
+    attr = die.attributes.get(name)
+    return attr.value if attr is not None else default
+
+
+def get_die_ranges(dwarf, cu, die, base_address=0):
+    """Returns the `[low, high)` address ranges covered by a DIE"""
+    attrs = die.attributes
+    if "DW_AT_low_pc" in attrs and "DW_AT_high_pc" in attrs:
+        low = attrs["DW_AT_low_pc"].value
+        high_attr = attrs["DW_AT_high_pc"]
+        high = high_attr.value
+        if high_attr.form != "DW_FORM_addr":
+            high += low
+        return [(low, high)]
+    if "DW_AT_ranges" not in attrs:
+        return []
+    range_lists = dwarf.range_lists()
+    if range_lists is None:
+        return []
+    result = []
+    base = base_address
+    for entry in range_lists.get_range_list_at_offset(
+        attrs["DW_AT_ranges"].value, cu=cu
+    ):
+        if hasattr(entry, "base_address"):
+            base = entry.base_address
+        elif getattr(entry, "is_absolute", False):
+            result.append((entry.begin_offset, entry.end_offset))
+        else:
+            result.append((base + entry.begin_offset, base + entry.end_offset))
+    return result
+
+
+class IntervalIndex(object):
+    """Sorted list of non-overlapping `[low, high)` intervals.
+
+    Lookups are a binary search over the interval start addresses.
+    """
+
+    def __init__(self, intervals):
+        # ULP programs are linked at address 0
+        intervals = sorted(i for i in intervals if i[0] is not None and i[1] > i[0])
+        self._starts = [i[0] for i in intervals]
+        self._intervals = intervals
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def find(self, address):
+        idx = bisect.bisect_right(self._starts, address) - 1
+        if idx < 0:
+            return None
+        interval = self._intervals[idx]
+        return interval if address < interval[1] else None
+
+
+class CompileUnitIndex(object):
+    """Function ranges, inlined calls and line table rows of a compile unit"""
+
+    def __init__(self, dwarf, cu):
+        self._dwarf = dwarf
+        self._cu = cu
+        top_die = cu.get_top_DIE()
+        self.comp_dir = _to_str(get_attr_value(top_die, "DW_AT_comp_dir", ""))
+        self._line_program = dwarf.line_program_for_CU(cu)
+        self._base_address = get_attr_value(top_die, "DW_AT_low_pc", 0)
+        self._file_names = {}
+        self._build_line_rows()
+        functions = []
+        self._collect_functions(top_die, functions)
+        self.functions = IntervalIndex(functions)
+
+    def _build_line_rows(self):
+        rows = []
+        sequence = []
+        if self._line_program is not None:
+            for entry in self._line_program.get_entries():
+                state = entry.state
+                if state is None:
+                    continue
+                if not state.end_sequence:
+                    sequence.append((state.address, 1, state.file, state.line))
+                    continue
+                # rows at the end address describe no code at all
+                while sequence and sequence[-1][0] >= state.address:
+                    sequence.pop()
+                rows.extend(sequence)
+                rows.append((state.address, 0, None, 0))
+                sequence = []
+        # a sequence may start exactly where another one ends
+        rows.sort(key=lambda row: (row[0], row[1]))
+        self._row_addresses = [row[0] for row in rows]
+        self._rows = rows
+
+    def file_name(self, index):
+        if index in self._file_names:
+            return self._file_names[index]
+        name = None
+        if self._line_program is not None:
+            header = self._line_program.header
+            version = header["version"]
+            entries = header["file_entry"]
+            entry_index = index if version >= 5 else index - 1
+            if 0 <= entry_index < len(entries):
+                entry = entries[entry_index]
+                name = _to_str(entry.name)
+                directories = header["include_directory"]
+                dir_index = entry.dir_index if version >= 5 else entry.dir_index - 1
+                if 0 <= dir_index < len(directories):
+                    name = posixpath.join(_to_str(directories[dir_index]), name)
+                if self.comp_dir and not posixpath.isabs(name) and ":" not in name:
+                    name = posixpath.join(self.comp_dir, name)
+                name = posixpath.normpath(name)
+        self._file_names[index] = name
+        return name
+
+    def line_at(self, address):
+        idx = bisect.bisect_right(self._row_addresses, address) - 1
+        if idx < 0 or self._rows[idx][2] is None:
+            return None, 0
+        _, _, file_index, line = self._rows[idx]
+        return self.file_name(file_index), line
+
+    def _die_ranges(self, die):
+        return get_die_ranges(self._dwarf, self._cu, die, self._base_address)
+
+    def _die_name(self, die):
+        for _ in range(8):
+            if "DW_AT_name" in die.attributes:
+                break
+            for attr in ("DW_AT_abstract_origin", "DW_AT_specification"):
+                if attr in die.attributes:
+                    die = die.get_DIE_from_attribute(attr)
+                    break
+            else:
+                return None
+        else:
+            return None
+
+        names = [_to_str(die.attributes["DW_AT_name"].value)]
+        parent = die.get_parent()
+        while parent is not None and parent.tag in QUALIFYING_TAGS:
+            if "DW_AT_name" in parent.attributes:
+                names.insert(0, _to_str(parent.attributes["DW_AT_name"].value))
+            parent = parent.get_parent()
+        return "::".join(names)
+
+    def _collect_inlined(self, die, depth, result):
+        for child in die.iter_children():
+            if child.tag == "DW_TAG_inlined_subroutine":
+                name = self._die_name(child)
+                call_file = get_attr_value(child, "DW_AT_call_file", 0)
+                call_line = get_attr_value(child, "DW_AT_call_line", 0)
+                for low, high in self._die_ranges(child):
+                    result.append(
+                        InlinedCall(low, high, depth, name, call_file, call_line)
+                    )
+                self._collect_inlined(child, depth + 1, result)
+            elif child.tag == "DW_TAG_lexical_block":
+                self._collect_inlined(child, depth, result)
+
+    def _collect_functions(self, die, result):
+        for child in die.iter_children():
+            if child.tag == "DW_TAG_subprogram":
+                ranges = self._die_ranges(child)
+                if not ranges:
+                    continue
+                name = self._die_name(child)
+                inlined = []
+                self._collect_inlined(child, 1, inlined)
+                for low, high in ranges:
+                    result.append(Function(low, high, name, inlined))
+            elif child.tag in QUALIFYING_TAGS:
+                self._collect_functions(child, result)
+
+    def lookup(self, address):
+        function = self.functions.find(address)
+        path, line = self.line_at(address)
+        if function is None:
+            return (Location(None, path, line),) if path else ()
+
+        chain = sorted(
+            (
+                call
+                for call in function.inlined
+                if call.low <= address < call.high
+            ),
+            key=lambda call: call.depth,
+        )
+        names = [function.name] + [call.name for call in chain]
+        locations = [Location(names[-1], path, line)]
+        # walk from the innermost inlined call out to the real function
+        for idx in range(len(chain) - 1, -1, -1):
+            call = chain[idx]
+            locations.append(
+                Location(names[idx], self.file_name(call.call_file), call.call_line)
+            )
+        return tuple(locations)
+
+
+class ElfSymbolizer(object):
+    """In-process symbolization backend working on the firmware ELF.
+
+    The ELF is opened once. Address ranges of compile units and functions
+    from the symbol table are kept in sorted interval indexes, so an address
+    is resolved with a binary search. DWARF function ranges, inlined calls
+    and line table rows of a compile unit are indexed the first time an
+    address inside it is requested.
+    """
+
+    def __init__(self, firmware_path):
+        self.firmware_path = firmware_path
+        self._fp = open(firmware_path, "rb")
+        try:
+            self._elf = ELFFile(self._fp)
+            self._dwarf = (
+                self._elf.get_dwarf_info() if self._elf.has_dwarf_info() else None
+            )
+            self._symbols = self._build_symbol_index()
+            self._units = self._build_unit_index()
+        except (OSError, ELFError):
+            self._fp.close()
+            raise
+        self._unit_cache = {}
+
+    def _build_symbol_index(self):
+        intervals = []
+        for section in self._elf.iter_sections():
+            if not isinstance(section, SymbolTableSection):
+                continue
+            for symbol in section.iter_symbols():
+                if symbol["st_info"]["type"] != "STT_FUNC" or not symbol["st_size"]:
+                    continue
+                intervals.append(
+                    (
+                        symbol["st_value"],
+                        symbol["st_value"] + symbol["st_size"],
+                        symbol.name,
+                    )
+                )
+        return IntervalIndex(intervals)
+
+    def _build_unit_index(self):
+        if self._dwarf is None:
+            return IntervalIndex([])
+        aranges = self._dwarf.get_aranges()
+        if aranges is not None:
+            return IntervalIndex(
+                (entry.begin_addr, entry.begin_addr + entry.length, entry.info_offset)
+                for entry in aranges.entries
+            )
+
+        # no `.debug_aranges`, fall back to the ranges of the top DIEs
+        intervals = []
+        for cu in self._dwarf.iter_CUs():
+            top_die = cu.get_top_DIE()
+            for low, high in get_die_ranges(
+                self._dwarf, cu, top_die, get_attr_value(top_die, "DW_AT_low_pc", 0)
+            ):
+                intervals.append((low, high, cu.cu_offset))
+        return IntervalIndex(intervals)
+
+    def _get_unit(self, address):
+        unit = self._units.find(address)
+        if unit is None:
+            return None
+        cu_offset = unit[2]
+        if cu_offset not in self._unit_cache:
+            self._unit_cache[cu_offset] = CompileUnitIndex(
+                self._dwarf, self._dwarf.get_CU_at(cu_offset)
+            )
+        return self._unit_cache[cu_offset]
+
+    def lookup_address(self, address):
+        unit = self._get_unit(address)
+        locations = unit.lookup(address) if unit is not None else ()
+        if locations and locations[0].function:
+            return locations
+
+        symbol = self._symbols.find(address)
+        if symbol is None:
+            return locations
+        path, line = locations[0][1:] if locations else (None, 0)
+        return (Location(symbol[2], path, line),) + locations[1:]
+
+    def lookup(self, addresses):
+        return [self.lookup_address(addr) for addr in addresses]
+
+    def close(self):
+        self._fp.close()
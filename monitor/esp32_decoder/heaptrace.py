@@ -0,0 +1,196 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Leak reports of the dumps printed by `heap_trace_dump()`:
+
+    ====== Heap Trace: 2 records (100 capacity) ======
+        6 bytes (@ 0x3ffb5a0c, Internal) allocated CPU 0 ccount 0x1a2b3c4d caller 0x400d1234:0x400d5678:
+        9 bytes (@ 0x3ffb5a20) allocated CPU 0 ccount 0x1a2b3c80 caller 0x400d1234:0x400d5678:
+        freed by 0x400d2222:0x400d5678:
+    ====== Heap Trace Summary ======
+
+The outstanding allocations of a dump are grouped by their call site, the
+first caller outside of the allocator, and compared with the previous dump.
+"""
+
+import collections
+import re
+
+from esp32_decoder.parser import ARCH_XTENSA, return_frame
+from esp32_decoder.symbols import format_location
+
+HEAP_TRACE_MARKER = "Heap Trace"
+HEAP_TRACE_START_RE = re.compile(r"=+ Heap Trace: (\d+) records")
+HEAP_TRACE_END_MARKER = "Heap Trace Summary"
+RECORD_RE = re.compile(
+    r"(\d+) bytes \(@ (0x[0-9a-fA-F]+)[^)]*\) allocated CPU \d+ ccount 0x[0-9a-fA-F]+"
+    r" caller ((?:0x[0-9a-fA-F]+:?)*)"
+)
+FREED_RE = re.compile(r"freed by ((?:0x[0-9a-fA-F]+:?)*)")
+ADDRESS_RE = re.compile(r"0x[0-9a-fA-F]+")
+
+# Functions of the allocator which are skipped to find the call site
+ALLOCATOR_RE = re.compile(
+    r"^(?:_?malloc|_?calloc|_?realloc|_?free|strn?dup|heap_caps_\w+|multi_heap_\w+"
+    r"|_\w+_r|operator new.*|operator delete.*|__wrap_\w+|\w+_malloc\w*"
+    r"|\w+_calloc\w*|\w+_realloc\w*)$"
+)
+
+HeapRecord = collections.namedtuple("HeapRecord", ["size", "address", "callers"])
+
+
+class HeapTraceDump(object):
+    def __init__(self, capacity_records):
+        self.capacity_records = capacity_records
+        self.records = []
+        self.freed = 0
+
+    def outstanding(self):
+        return [record for record in self.records if record is not None]
+
+
+class HeapTraceParser(object):
+    """Collects the records of a heap trace dump line by line.
+
+    `feed_line` returns whether the line belongs to a dump and the dump
+    finished by the line, if any. Freed records are dropped, they are only
+    listed with `HEAP_TRACE_ALL`.
+    """
+
+    def __init__(self):
+        self.current = None
+
+    def feed_line(self, line):
+        m = HEAP_TRACE_START_RE.search(line)
+        if m is not None:
+            finished, self.current = self.current, HeapTraceDump(int(m.group(1)))
+            return True, finished
+        if self.current is None:
+            return False, None
+        if HEAP_TRACE_END_MARKER in line:
+            return True, self.flush()
+
+        m = RECORD_RE.search(line)
+        if m is not None:
+            self.current.records.append(
+                HeapRecord(
+                    int(m.group(1)),
+                    int(m.group(2), 16),
+                    tuple(int(value, 16) for value in ADDRESS_RE.findall(m.group(3))),
+                )
+            )
+            return True, None
+        if FREED_RE.search(line) is not None:
+            if self.current.records:
+                self.current.records[-1] = None
+                self.current.freed += 1
+            return True, None
+        return False, self.flush()
+
+    def flush(self):
+        finished, self.current = self.current, None
+        return finished
+
+
+def get_lookup_address(address, arch):
+    """Returns the address of the call instruction of a caller.
+
+    Recent ESP-IDF releases print the Xtensa callers already moved to the
+    call instruction, older ones the raw return addresses with the window
+    increment in the upper bits.
+    """
+    if arch == ARCH_XTENSA and address & 0xC0000000 == 0x40000000:
+        return address
+    return return_frame(address, arch).lookup_address
+
+
+def get_call_site(locations_chain):
+    """Returns the location of the first caller outside of the allocator.
+
+    `locations_chain` holds the symbolized callers, the direct caller of
+    the allocator first.
+    """
+    for locations in locations_chain:
+        if locations and not ALLOCATOR_RE.match(locations[0].function or ""):
+            return locations[0]
+    return None
+
+
+class LeakReport(object):
+    """Outstanding allocations of a dump grouped by call site."""
+
+    def __init__(self, dump, call_sites):
+        self.dump = dump
+        # call site -> [bytes, count]
+        self.sites = collections.OrderedDict()
+        for record, site in zip(dump.outstanding(), call_sites):
+            entry = self.sites.setdefault(site, [0, 0])
+            entry[0] += record.size
+            entry[1] += 1
+
+    @property
+    def total_bytes(self):
+        return sum(entry[0] for entry in self.sites.values())
+
+    @property
+    def total_count(self):
+        return sum(entry[1] for entry in self.sites.values())
+
+    def ranked(self):
+        return sorted(self.sites.items(), key=lambda item: (-item[1][0], -item[1][1]))
+
+    def diff(self, previous):
+        """Returns the call sites which grew or shrank since `previous`."""
+        result = []
+        for site in set(self.sites) | set(previous.sites):
+            size, count = self.sites.get(site, (0, 0))
+            old_size, old_count = previous.sites.get(site, (0, 0))
+            if size != old_size or count != old_count:
+                result.append((site, size - old_size, count - old_count))
+        return sorted(result, key=lambda item: (-item[1], -item[2]))
+
+
+def format_site(site):
+    return "??" if site is None else format_location(site)
+
+
+def format_leak_report(report, previous=None, prefix="  ", top=20):
+    lines = [
+        "%sHeap trace: %d outstanding allocation(s), %d bytes, %d call site(s)%s\n"
+        % (
+            prefix,
+            report.total_count,
+            report.total_bytes,
+            len(report.sites),
+            ", %d freed" % report.dump.freed if report.dump.freed else "",
+        )
+    ]
+    if report.sites:
+        lines.append("%s%8s %6s  %s\n" % (prefix, "BYTES", "COUNT", "CALL SITE"))
+    for site, (size, count) in report.ranked()[:top]:
+        lines.append("%s%8d %6d  %s\n" % (prefix, size, count, format_site(site)))
+    if previous is not None:
+        changes = report.diff(previous)
+        lines.append(
+            "%sSince the previous dump: %+d bytes, %+d allocation(s)\n"
+            % (
+                prefix,
+                report.total_bytes - previous.total_bytes,
+                report.total_count - previous.total_count,
+            )
+        )
+        for site, size, count in changes[:top]:
+            lines.append("%s%+8d %+6d  %s\n" % (prefix, size, count, format_site(site)))
+    return "".join(lines) + "\n"
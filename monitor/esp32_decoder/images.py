@@ -0,0 +1,157 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+import collections
+import glob
+import os
+import re
+import struct
+
+# Sections which are loaded to memory and hold code
+SHF_ALLOC = 0x2
+SHF_EXECINSTR = 0x4
+
+# The main CPUs see the RTC slow memory of the ULP coprocessor at this address
+ULP_LOAD_ADDRESS = 0x50000000
+
+ROM_ELF_RE = re.compile(r"_rev(\d+)_rom\.elf$")
+
+Image = collections.namedtuple("Image", ["name", "path", "symbolizer", "offset"])
+Image.__doc__ = """A firmware image loaded into the address space of the chip.
+
+`offset` is added to the addresses of the ELF file to get the addresses
+seen by the CPU.
+"""
+
+
+def get_code_ranges(path):
+    """Returns the `[low, high)` ranges of the code sections of an ELF file."""
+    with open(path, "rb") as fp:
+        ident = fp.read(16)
+        if len(ident) < 16 or ident[:4] != b"\x7fELF" or ident[5] != 1:
+            raise ValueError("%s is not a little-endian ELF file" % path)
+        is_64bit = ident[4] == 2
+        if is_64bit:
+            fp.seek(40)
+            (shoff,) = struct.unpack("<Q", fp.read(8))
+            fp.seek(58)
+            entry_format = "<IIQQQQ"
+        else:
+            fp.seek(32)
+            (shoff,) = struct.unpack("<I", fp.read(4))
+            fp.seek(46)
+            entry_format = "<IIIIII"
+        shentsize, shnum = struct.unpack("<HH", fp.read(4))
+
+        result = []
+        entry_size = struct.calcsize(entry_format)
+        for i in range(shnum):
+            fp.seek(shoff + i * shentsize)
+            _, _, flags, addr, _, size = struct.unpack(
+                entry_format, fp.read(entry_size)
+            )
+            if flags & SHF_ALLOC and flags & SHF_EXECINSTR and size:
+                result.append((addr, addr + size))
+    return sorted(result)
+
+
+def get_image_offset(name, path):
+    if name != "ulp":
+        return 0
+    # ULP programs are linked at the start of the RTC slow memory
+    ranges = get_code_ranges(path)
+    return ULP_LOAD_ADDRESS if ranges and ranges[0][0] < ULP_LOAD_ADDRESS else 0
+
+
+def find_rom_elf(mcu, rom_elf_dir=None):
+    """Looks up the ROM ELF of a chip in the directory with the ROM ELF files.
+
+    The directory is taken from `ESP_ROM_ELF_DIR` unless it is given, the
+    ROM of the latest chip revision is used.
+    """
+    rom_elf_dir = rom_elf_dir or os.environ.get("ESP_ROM_ELF_DIR")
+    if not mcu or not rom_elf_dir or not os.path.isdir(rom_elf_dir):
+        return None
+    candidates = []
+    for path in glob.glob(os.path.join(rom_elf_dir, "%s_rev*_rom.elf" % mcu)):
+        m = ROM_ELF_RE.search(path)
+        if m is not None:
+            candidates.append((int(m.group(1)), path))
+    return max(candidates)[1] if candidates else None
+
+
+class ImageMap(object):
+    """Symbolizes addresses with the image which holds their code.
+
+    The code ranges of all images are merged once into a sorted list of
+    non-overlapping intervals, where an image added earlier takes
+    precedence. Routing an address to its image is a single binary search
+    and every image is queried once per batch of addresses.
+    """
+
+    def __init__(self):
+        self.images = []
+        self._starts = []
+        self._intervals = []
+
+    def add(self, name, path, symbolizer, offset=0):
+        image_index = len(self.images)
+        self.images.append(Image(name, path, symbolizer, offset))
+        for low, high in get_code_ranges(path):
+            self._insert(low + offset, high + offset, image_index)
+
+    def _insert(self, low, high, image_index):
+        # keep the parts of the range not taken by previous images
+        idx = bisect.bisect_right(self._starts, low) - 1
+        if idx >= 0 and self._intervals[idx][1] > low:
+            low = self._intervals[idx][1]
+        idx += 1
+        while low < high:
+            if idx < len(self._intervals):
+                next_low, next_high, _ = self._intervals[idx]
+            else:
+                next_low = next_high = high
+            if low < min(next_low, high):
+                self._intervals.insert(idx, (low, min(next_low, high), image_index))
+                self._starts.insert(idx, low)
+                idx += 1
+            low = max(low, next_high)
+            idx += 1
+
+    def find(self, address):
+        """Returns the image which holds the code at `address`"""
+        idx = bisect.bisect_right(self._starts, address) - 1
+        if idx < 0 or address >= self._intervals[idx][1]:
+            return None
+        return self.images[self._intervals[idx][2]]
+
+    def lookup(self, addresses):
+        results = [()] * len(addresses)
+        batches = collections.OrderedDict()
+        for i, address in enumerate(addresses):
+            image = self.find(address)
+            if image is not None:
+                batches.setdefault(image, []).append(i)
+        for image, indexes in batches.items():
+            locations = image.symbolizer.lookup(
+                [addresses[i] - image.offset for i in indexes]
+            )
+            for i, item in zip(indexes, locations):
+                results[i] = item
+        return results
+
+    def close(self):
+        for image in self.images:
+            image.symbolizer.close()
@@ -0,0 +1,266 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Expands the compact log records of `esp_log_compact.h` into text.
+
+The format strings are read once from the `.esp_log_fmt` section of the
+firmware ELF, an entry is the level letter followed by the format and its
+offset in the section identifies it. A record is a binary frame:
+
+    \\x1e, length (u8), COBS(payload)
+
+The payload of a log record is `varint(offset + 1)`, `varint(timestamp)`,
+the tag ID and the arguments, a payload starting with 0 defines the tag of
+an ID. Integers are varints of their bit pattern, they are read according
+to the conversion of the format string.
+"""
+
+import re
+import struct
+
+LOG_SECTION = ".esp_log_fmt"
+RECORD_MARKER = b"\x1e"
+TAG_INLINE = 0xFF
+LEVEL_COLORS = {"E": "\033[0;31m", "W": "\033[0;33m", "I": "\033[0;32m"}
+COLOR_RESET = "\033[0m"
+
+DOUBLE = struct.Struct("<d")
+PRINTF_RE = re.compile(
+    r"%(?P<flags>[-+ #0]*)(?P<width>\*|\d+)?(?:\.(?P<precision>\*|\d+))?"
+    r"(?P<length>hh|h|ll|l|j|z|t|L|q)?(?P<conversion>[diouxXeEfFgGaAcsp])"
+)
+# argument kinds: signed and unsigned 32/64-bit integers, doubles, strings
+SIGNED_32, UNSIGNED_32, SIGNED_64, UNSIGNED_64 = "i", "I", "q", "Q"
+DOUBLE_ARGUMENT = "d"
+STRING_ARGUMENT = "s"
+
+
+def read_varint(data, offset):
+    """Returns the value of a varint and the offset after it."""
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+        if shift > 63:
+            raise ValueError("varint is too long")
+
+
+def cobs_decode(data):
+    result = bytearray()
+    pos = 0
+    while pos < len(data):
+        code = data[pos]
+        if code == 0 or pos + code > len(data):
+            raise ValueError("invalid COBS data")
+        result += data[pos + 1 : pos + code]
+        pos += code
+        if code < 0xFF and pos < len(data):
+            result.append(0)
+    return bytes(result)
+
+
+class RecordSplitter(object):
+    """Splits the bytes of a serial stream into text and record payloads.
+
+    `feed` yields `(True, payload)` for a record and `(False, data)` for
+    the text around it, the start of an incomplete frame is held back
+    until the rest of it arrives.
+    """
+
+    def __init__(self):
+        self._held = b""
+
+    def feed(self, data):
+        data, self._held = self._held + data, b""
+        pos = 0
+        while pos < len(data):
+            idx = data.find(RECORD_MARKER, pos)
+            if idx == -1:
+                break
+            if idx > pos:
+                yield False, data[pos:idx]
+            end = idx + 2 + data[idx + 1] if idx + 1 < len(data) else len(data) + 1
+            if end > len(data):
+                self._held = data[idx:]
+                return
+            try:
+                yield True, cobs_decode(data[idx + 2 : end])
+            except ValueError:
+                yield False, data[idx:end]
+            pos = end
+        if pos < len(data):
+            yield False, data[pos:]
+
+
+def read_elf_section(path, name):
+    """Returns the contents of a section of an ELF file or None."""
+    with open(path, "rb") as fp:
+        ident = fp.read(16)
+        if len(ident) < 16 or ident[:4] != b"\x7fELF" or ident[5] != 1:
+            raise ValueError("%s is not a little-endian ELF file" % path)
+        if ident[4] == 2:
+            fp.seek(40)
+            (shoff,) = struct.unpack("<Q", fp.read(8))
+            fp.seek(58)
+            entry_format = "<IIQQQQ"
+        else:
+            fp.seek(32)
+            (shoff,) = struct.unpack("<I", fp.read(4))
+            fp.seek(46)
+            entry_format = "<IIIIII"
+        shentsize, shnum, shstrndx = struct.unpack("<HHH", fp.read(6))
+        entry_size = struct.calcsize(entry_format)
+
+        headers = []
+        for i in range(shnum):
+            fp.seek(shoff + i * shentsize)
+            name_offset, _, _, _, offset, size = struct.unpack(
+                entry_format, fp.read(entry_size)
+            )
+            headers.append((name_offset, offset, size))
+        if shstrndx >= len(headers):
+            return None
+        fp.seek(headers[shstrndx][1])
+        names = fp.read(headers[shstrndx][2])
+        encoded = name.encode()
+        for name_offset, offset, size in headers:
+            if names[name_offset : names.find(b"\0", name_offset)] == encoded:
+                fp.seek(offset)
+                return fp.read(size)
+    return None
+
+
+class LogFormat(object):
+    """A format string and the layout of its arguments."""
+
+    def __init__(self, level, text):
+        self.level = level
+        self.text = text
+        self.codes = []
+        # `%%` is kept out of the way of the conversions
+        self.template = PRINTF_RE.sub(
+            self._convert, text.replace("%%", "\0")
+        ).replace("\0", "%%")
+
+    def _convert(self, m):
+        conversion = m.group("conversion")
+        for value in (m.group("width"), m.group("precision")):
+            if value == "*":
+                self.codes.append(SIGNED_32)
+        is_64 = m.group("length") in ("ll", "j", "q")
+        if conversion in "di":
+            self.codes.append(SIGNED_64 if is_64 else SIGNED_32)
+        elif conversion in "ouxXc":
+            self.codes.append(UNSIGNED_64 if is_64 else UNSIGNED_32)
+        elif conversion in "eEfFgGaA":
+            self.codes.append(DOUBLE_ARGUMENT)
+            if conversion in "aA":
+                conversion = "g"
+        elif conversion == "s":
+            self.codes.append(STRING_ARGUMENT)
+        elif conversion == "p":
+            self.codes.append(UNSIGNED_32)
+            return "0x%x"
+        if conversion == "u":
+            conversion = "d"
+        precision = m.group("precision")
+        return "%%%s%s%s%s" % (
+            m.group("flags"),
+            m.group("width") or "",
+            "." + precision if precision is not None else "",
+            conversion,
+        )
+
+    def unpack(self, data, offset):
+        values = []
+        for code in self.codes:
+            if code == STRING_ARGUMENT:
+                size = data[offset]
+                values.append(
+                    data[offset + 1 : offset + 1 + size].decode("utf-8", "replace")
+                )
+                offset += 1 + size
+            elif code == DOUBLE_ARGUMENT:
+                values.append(DOUBLE.unpack_from(data, offset)[0])
+                offset += DOUBLE.size
+            else:
+                value, offset = read_varint(data, offset)
+                bits = 64 if code in (SIGNED_64, UNSIGNED_64) else 32
+                value &= (1 << bits) - 1
+                if code in (SIGNED_32, SIGNED_64) and value >> (bits - 1):
+                    value -= 1 << bits
+                values.append(value)
+        return tuple(values)
+
+
+class LogFormatTable(object):
+    """Decodes the compact log records of a firmware."""
+
+    def __init__(self, section, colors=False):
+        self.colors = colors
+        self.formats = {}
+        offset = 0
+        for entry in section.split(b"\0"):
+            if len(entry) > 1:
+                self.formats[offset] = LogFormat(
+                    chr(entry[0]), entry[1:].decode("utf-8", "replace")
+                )
+            offset += len(entry) + 1
+
+    @classmethod
+    def from_elf(cls, path, colors=False):
+        section = read_elf_section(path, LOG_SECTION)
+        return cls(section, colors) if section else None
+
+    @staticmethod
+    def define_tag(payload, tags):
+        """Returns whether the payload defines a tag, `tags` is updated."""
+        if len(payload) < 2 or payload[0] != 0:
+            return False
+        tags[payload[1]] = payload[2:].decode("utf-8", "replace")
+        return True
+
+    def decode(self, payload, tags):
+        """Returns the log line of a record payload or None if it is invalid.
+
+        `tags` maps the tag IDs of the device to their names, a tag
+        definition updates it and returns an empty string.
+        """
+        if self.define_tag(payload, tags):
+            return ""
+        try:
+            format_id, offset = read_varint(payload, 0)
+            log_format = self.formats[format_id - 1]
+            timestamp, offset = read_varint(payload, offset)
+            tag_id = payload[offset]
+            offset += 1
+            if tag_id == TAG_INLINE:
+                size = payload[offset]
+                tag = payload[offset + 1 : offset + 1 + size].decode("utf-8", "replace")
+                offset += 1 + size
+            else:
+                tag = tags.get(tag_id, "?")
+            message = log_format.template % log_format.unpack(payload, offset)
+        except (struct.error, KeyError, IndexError, TypeError, ValueError):
+            return None
+        line = "%s (%d) %s: %s" % (log_format.level, timestamp, tag, message)
+        if self.colors and log_format.level in LEVEL_COLORS:
+            return LEVEL_COLORS[log_format.level] + line + COLOR_RESET
+        return line
@@ -0,0 +1,345 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Monitors the serial ports of several boards at once, e.g. on a test bench:
+
+    python esp32_decoder monitor -d path/to/project -e esp32dev \
+        /dev/ttyUSB0 /dev/ttyUSB1 /dev/ttyUSB2@esp32c3
+
+The output of every port is decoded by its own `esp32_exception_decoder`
+filter of the project environment, which may be given per port after an
+`@`. The decoders share the symbol index of an ELF file, so a firmware
+which runs on all boards is loaded once. Lines are written with the host
+time to a log per port and to a merged log of all ports. A port which
+fails, e.g. an unplugged board, is reopened while the others keep running.
+
+Run it with the Python interpreter of PlatformIO Core, the serial ports are
+read by a thread each and the logs are written by a single asyncio loop.
+"""
+
+import asyncio
+import codecs
+import concurrent.futures
+import os
+import re
+import sys
+import threading
+import time
+
+MONITOR_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DECODER_FILTER = "filter_exception_decoder"
+READ_TIMEOUT = 0.2
+REOPEN_INTERVAL = 1.0
+MERGED_LOG = "merged.log"
+
+
+def format_time(now):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now)) + ".%03d" % (
+        now % 1 * 1000
+    )
+
+
+def get_log_name(port):
+    return re.sub(r"[^\w.-]+", "_", port).strip("_") + ".log"
+
+
+class SharedSymbolizer(object):
+    """A reference to a symbolizer of the pool, lookups are serialized."""
+
+    def __init__(self, pool, key, symbolizer, lock):
+        self._pool = pool
+        self._key = key
+        self._symbolizer = symbolizer
+        self._lock = lock
+
+    def lookup(self, addresses):
+        with self._lock:
+            return self._symbolizer.lookup(addresses)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.release(self._key)
+            self._pool = None
+
+
+class SymbolizerPool(object):
+    """Shares the symbolizers of identical ELF files between decoders.
+
+    Symbolizers are keyed by the SHA256 of the file and closed once the
+    last decoder released them.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key, factory, path):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = [factory(path), 0, threading.Lock()]
+            entry[1] += 1
+        return SharedSymbolizer(self, key, entry[0], entry[2])
+
+    def release(self, key):
+        with self._lock:
+            entry = self._entries[key]
+            entry[1] -= 1
+            if entry[1]:
+                return
+            del self._entries[key]
+        entry[0].close()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class PortLog(object):
+    """Writes the complete lines of a port with the host time."""
+
+    def __init__(self, label, fp, merged_fp):
+        self.label = label
+        self.fp = fp
+        self.merged_fp = merged_fp
+        self.partial = ""
+
+    def write(self, text, now):
+        """Returns the lines written to the merged log."""
+        lines = (self.partial + text).split("\n")
+        self.partial = lines.pop()
+        return self._write_lines(lines, now)
+
+    def flush(self, now):
+        lines, self.partial = [self.partial] if self.partial else [], ""
+        return self._write_lines(lines, now)
+
+    def _write_lines(self, lines, now):
+        if not lines:
+            return ""
+        stamp = format_time(now)
+        merged = "".join(
+            "%s [%s] %s\n" % (stamp, self.label, line.rstrip("\r")) for line in lines
+        )
+        self.fp.write("".join("%s %s\n" % (stamp, line.rstrip("\r")) for line in lines))
+        self.fp.flush()
+        self.merged_fp.write(merged)
+        return merged
+
+
+class PortConsole(object):
+    """Running terminal of a decoder, its background output goes to the log."""
+
+    def __init__(self, monitor, port):
+        self.monitor = monitor
+        self.port = port
+
+    @property
+    def console(self):
+        return self
+
+    def write(self, text):
+        self.monitor.loop.call_soon_threadsafe(
+            self.monitor.output, self.port, text, time.time()
+        )
+
+
+class Port(object):
+    def __init__(self, name, serial, decoder, log):
+        self.name = name
+        self.serial = serial
+        self.decoder = decoder
+        self.log = log
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def read(self):
+        """Reads and decodes the next chunk, runs in the thread of the port."""
+        data = self.serial.read(max(1, self.serial.in_waiting))
+        now = time.time()
+        text = self._text_decoder.decode(data)
+        if text and self.decoder is not None:
+            try:
+                text = self.decoder.rx(text)
+            except Exception as e:  # pylint: disable=broad-except
+                if not text.endswith("\n"):
+                    text += "\n"
+                text += "--- decoder failed: %s ---\n" % e
+        return text, now
+
+    def reopen(self):
+        self.serial.close()
+        self.serial.open()
+
+
+class MultiMonitor(object):
+    def __init__(self, log_dir, echo=True):
+        self.log_dir = log_dir
+        self.echo = echo
+        self.ports = []
+        self.loop = None
+        if not os.path.isdir(log_dir):
+            os.makedirs(log_dir)
+        self.merged_fp = open(  # pylint: disable=consider-using-with
+            os.path.join(log_dir, MERGED_LOG), "a", encoding="utf-8"
+        )
+
+    def add_port(self, name, serial, decoder=None):
+        fp = open(  # pylint: disable=consider-using-with
+            os.path.join(self.log_dir, get_log_name(name)), "a", encoding="utf-8"
+        )
+        port = Port(name, serial, decoder, PortLog(name, fp, self.merged_fp))
+        self.ports.append(port)
+        return port
+
+    def output(self, port, text, now):
+        self.echo_merged(port.log.write(text, now))
+
+    def echo_merged(self, merged):
+        if merged and self.echo:
+            sys.stdout.write(merged)
+            sys.stdout.flush()
+
+    def report(self, port, message):
+        """Logs a failure of the port on a line of its own."""
+        now = time.time()
+        self.echo_merged(
+            port.log.flush(now) + port.log.write("--- %s ---\n" % message, now)
+        )
+
+    async def run_port(self, port, executor):
+        while True:
+            try:
+                text, now = await self.loop.run_in_executor(executor, port.read)
+            except Exception as e:  # pylint: disable=broad-except
+                self.report(port, "%s failed: %s" % (port.name, e))
+                await self.reopen_port(port, executor)
+                continue
+            if text:
+                self.output(port, text, now)
+
+    async def reopen_port(self, port, executor):
+        while True:
+            await asyncio.sleep(REOPEN_INTERVAL)
+            try:
+                await self.loop.run_in_executor(executor, port.reopen)
+            except Exception:  # pylint: disable=broad-except
+                continue
+            self.report(port, "%s reopened" % port.name)
+            return
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.ports))
+        try:
+            await asyncio.gather(
+                *(self.run_port(port, executor) for port in self.ports)
+            )
+        finally:
+            executor.shutdown(wait=True)
+
+    def close(self):
+        now = time.time()
+        for port in self.ports:
+            port.log.flush(now)
+            port.log.fp.close()
+            port.serial.close()
+        self.merged_fp.close()
+
+
+def load_decoder_class(pool):
+    # pylint: disable=import-outside-toplevel
+    from platformio.compat import load_python_module
+
+    module = load_python_module(
+        "platformio.device.monitor.filters." + DECODER_FILTER,
+        os.path.join(MONITOR_DIR, DECODER_FILTER + ".py"),
+    )
+    cls = module.Esp32ExceptionDecoder
+    cls.symbolizer_pool = pool
+    return cls
+
+
+def add_parser(commands):
+    parser = commands.add_parser(
+        "monitor", help="Monitor and decode several serial ports at once"
+    )
+    parser.add_argument(
+        "ports", nargs="+", metavar="PORT[@ENV]", help="serial port to monitor"
+    )
+    parser.add_argument("-d", "--project-dir", default=os.getcwd())
+    parser.add_argument("-e", "--environment", help="default project environment")
+    parser.add_argument(
+        "-b", "--baud", type=int, help="baud rate, `monitor_speed` by default"
+    )
+    parser.add_argument(
+        "--log-dir", help="directory of the logs, `monitor` in the build directory"
+    )
+    parser.add_argument(
+        "--no-decode", action="store_true", help="only log the output of the ports"
+    )
+    parser.add_argument(
+        "--quiet", action="store_true", help="do not print the merged log"
+    )
+    parser.set_defaults(func=_run)
+
+
+def _run(args):
+    # pylint: disable=import-outside-toplevel
+    import serial
+    from platformio.project.config import ProjectConfig
+
+    project_dir = os.path.abspath(args.project_dir)
+    # the filters read the configuration of the current directory
+    os.chdir(project_dir)
+    config = ProjectConfig.get_instance(os.path.join(project_dir, "platformio.ini"))
+    default_env = args.environment or (config.default_envs() or config.envs())[0]
+    monitor = MultiMonitor(
+        args.log_dir
+        or os.path.join(config.get("platformio", "build_dir"), "monitor"),
+        echo=not args.quiet,
+    )
+    pool = SymbolizerPool()
+    decoder_class = None if args.no_decode else load_decoder_class(pool)
+    try:
+        for item in args.ports:
+            name, _, environment = item.rpartition("@")
+            if not name:
+                name, environment = item, default_env
+            try:
+                port = serial.serial_for_url(
+                    name,
+                    args.baud
+                    or int(config.get("env:" + environment, "monitor_speed", 115200)),
+                    timeout=READ_TIMEOUT,
+                )
+            except serial.SerialException as e:
+                sys.stderr.write("Error: %s\n" % e)
+                return 1
+            port = monitor.add_port(name, port)
+            if decoder_class is not None:
+                decoder = decoder_class(
+                    dict(project_dir=project_dir, environment=environment, port=name)
+                )
+                decoder.set_running_terminal(PortConsole(monitor, port))
+                port.decoder = decoder()
+        sys.stderr.write(
+            "Monitoring %d port(s) with %d symbol index(es), logs in %s\n"
+            % (len(monitor.ports), len(pool), monitor.log_dir)
+        )
+        asyncio.run(monitor.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        monitor.close()
+    return 0
@@ -0,0 +1,564 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Decodes the backtraces in captured serial logs, e.g. the logs collected
+from a fleet of devices:
+
+    python esp32_decoder decode --elf firmware.elf --store .pio/symbols \
+        --output-dir decoded logs/
+
+With `--summary` the crashes are grouped by their signature and ranked by
+frequency, the decoded logs are only written when an output directory is
+given.
+
+Log files are decoded in parallel by a pool of processes. The symbol
+indexes of the firmwares given with `--elf` are built once before the
+workers are forked and shared with them, so symbolization runs in parallel
+without building an index per worker. Where processes are spawned instead
+of forked, e.g. on Windows, every worker builds its own indexes. Files are
+read chunk by chunk and gzip compressed logs are decompressed on the fly.
+"""
+
+import codecs
+import gzip
+import json
+import multiprocessing
+import os
+import sys
+import threading
+
+from esp32_decoder.cache import get_file_sha256
+from esp32_decoder.images import ImageMap, get_image_offset
+from esp32_decoder.parser import (
+    ELF_SHA256_MARKER,
+    ELF_SHA256_RE,
+    BacktraceParser,
+    get_elf_arch,
+)
+from esp32_decoder.signature import REASON_MARKERS, CrashAggregator, CrashTracker
+from esp32_decoder.store import SymbolStore
+from esp32_decoder.stream import LineAssembler, insert_after_lines
+from esp32_decoder.symbols import format_backtrace
+
+CHUNK_SIZE = 1024 * 1024
+OUTPUT_FORMATS = ("annotated", "json")
+
+
+def create_symbolizer(path, addr2line_path=None):
+    if addr2line_path:
+        from esp32_decoder.addr2line import (  # pylint: disable=import-outside-toplevel
+            Addr2LineSymbolizer,
+        )
+
+        return Addr2LineSymbolizer(addr2line_path, path)
+    from esp32_decoder.elf import (  # pylint: disable=import-outside-toplevel
+        ElfSymbolizer,
+    )
+
+    return ElfSymbolizer(path)
+
+
+class SymbolServer(object):
+    """Symbolizes addresses for the firmwares found in the logs.
+
+    Firmwares are identified by the SHA256 of their ELF. The image map of
+    a firmware is created on the first lookup and kept until the end.
+    The backends are those of the exception decoder, by default `addr2line`
+    is used when its path is given. With `auto` the ELF reader is preferred
+    and a firmware switches to `addr2line` once the ELF reader fails.
+    """
+
+    BACKENDS = ("auto", "elf", "addr2line")
+
+    def __init__(
+        self,
+        elf_paths,
+        images=(),
+        store_path=None,
+        addr2line_path=None,
+        backend=None,
+    ):
+        self.images = list(images)
+        self.store = SymbolStore(store_path) if store_path else None
+        self.addr2line_path = addr2line_path
+        self.backend = backend or ("addr2line" if addr2line_path else "elf")
+        self._paths = {}
+        for path in elf_paths:
+            self._paths.setdefault(get_file_sha256(path), path)
+        self._firmwares = {}
+        self._lock = threading.Lock()
+
+    def preload(self):
+        """Builds the image maps of the known firmwares, e.g. before a fork."""
+        for firmware in list(self._paths):
+            self._get_firmware(firmware)
+
+    def get_default(self):
+        """Returns the firmware used before a log prints its ELF SHA256."""
+        return next(iter(self._paths), None)
+
+    def select(self, sha256_prefix):
+        sha256_prefix = sha256_prefix.lower()
+        with self._lock:
+            for sha256 in self._paths:
+                if sha256.startswith(sha256_prefix):
+                    return sha256
+        path = self.store.find(sha256_prefix) if self.store else None
+        if path is None:
+            return None
+        sha256 = os.path.basename(path)[: -len(".elf")]
+        with self._lock:
+            self._paths.setdefault(sha256, path)
+        return sha256
+
+    def get_arch(self, firmware):
+        return get_elf_arch(self._paths[firmware])
+
+    def is_code(self, firmware, address):
+        images, _, _ = self._get_firmware(firmware)
+        return images.find(address) is not None
+
+    def lookup(self, firmware, addresses):
+        images, lock, backend = self._get_firmware(firmware)
+        with lock:
+            try:
+                return images.lookup(addresses)
+            except Exception as e:  # pylint: disable=broad-except
+                if self.backend != "auto" or backend == "addr2line":
+                    raise
+                fallback = self._switch_to_addr2line(firmware, e)
+                return fallback.lookup(addresses)
+
+    def _create_images(self, firmware, backend):
+        addr2line_path = self.addr2line_path if backend == "addr2line" else None
+        images = ImageMap()
+        try:
+            for name, path in [("app", self._paths[firmware])] + self.images:
+                symbolizer = create_symbolizer(path, addr2line_path)
+                try:
+                    images.add(name, path, symbolizer, get_image_offset(name, path))
+                except Exception:
+                    symbolizer.close()
+                    raise
+        except Exception:
+            images.close()
+            raise
+        return images
+
+    def _switch_to_addr2line(self, firmware, error):
+        sys.stderr.write(
+            "failed to read symbols of %s, switching to addr2line: %s\n"
+            % (self._paths[firmware], error)
+        )
+        images = self._create_images(firmware, "addr2line")
+        with self._lock:
+            old = self._firmwares.get(firmware)
+            self._firmwares[firmware] = (
+                images,
+                old[1] if old else threading.Lock(),
+                "addr2line",
+            )
+        if old is not None:
+            old[0].close()
+        return images
+
+    def _get_firmware(self, firmware):
+        with self._lock:
+            if firmware in self._firmwares:
+                return self._firmwares[firmware]
+            backend = "elf" if self.backend == "auto" else self.backend
+            try:
+                images = self._create_images(firmware, backend)
+            except Exception as e:  # pylint: disable=broad-except
+                if self.backend != "auto" or not self.addr2line_path:
+                    raise
+                error = e
+            else:
+                self._firmwares[firmware] = (images, threading.Lock(), backend)
+                return self._firmwares[firmware]
+        self._switch_to_addr2line(firmware, error)
+        return self._firmwares[firmware]
+
+    def close(self):
+        with self._lock:
+            for images, _, _ in self._firmwares.values():
+                images.close()
+            self._firmwares.clear()
+
+
+class LogDecoder(object):
+    """Decodes the crash reports of a single log.
+
+    Symbolized addresses are memoized, so a crash repeated across the logs
+    of a fleet is looked up once per worker.
+    """
+
+    MAX_MEMO_SIZE = 100000
+
+    def __init__(self, server, memo=None, tracker=None, source=None):
+        self.server = server
+        self.memo = memo if memo is not None else {}
+        self.tracker = tracker
+        self.source = source
+        self.markers = ("0x", ELF_SHA256_MARKER)
+        if tracker is not None:
+            self.markers += REASON_MARKERS
+        self.parser = BacktraceParser()
+        self.firmware = None
+        self.stats = dict(backtraces=0, frames=0, unknown_frames=0, missing_firmware=0)
+        self.select(server.get_default())
+
+    def select(self, firmware):
+        self.firmware = firmware
+        self.parser.arch = self.server.get_arch(firmware) if firmware else None
+
+    def handle_sha256(self, sha256_prefix):
+        firmware = self.server.select(sha256_prefix)
+        if firmware is None:
+            self.stats["missing_firmware"] += 1
+        self.select(firmware)
+
+    def lookup(self, addresses):
+        missing = [
+            addr for addr in set(addresses) if (self.firmware, addr) not in self.memo
+        ]
+        if missing:
+            if len(self.memo) > self.MAX_MEMO_SIZE:
+                self.memo.clear()
+            for addr, locations in zip(
+                missing, self.server.lookup(self.firmware, missing)
+            ):
+                self.memo[(self.firmware, addr)] = locations
+        return [self.memo[(self.firmware, addr)] for addr in addresses]
+
+    def decode(self, line):
+        """Returns the frames of a line and their locations."""
+        if self.tracker is not None:
+            self.tracker.feed_line(line, self.source)
+        m = ELF_SHA256_RE.search(line)
+        if m is not None:
+            self.handle_sha256(m.group(1))
+            return None
+        frames = self.parser.parse(line)
+        if not frames or self.firmware is None:
+            return None
+        results = self.lookup([frame.lookup_address for frame in frames])
+        self.stats["backtraces"] += 1
+        self.stats["frames"] += len(frames)
+        self.stats["unknown_frames"] += sum(1 for item in results if not item)
+        if self.tracker is not None:
+            self.tracker.add_backtrace(
+                self.parser.kind, self.parser.arch, results, self.firmware, self.source
+            )
+        return frames, results
+
+    def finish(self):
+        if self.tracker is not None:
+            self.tracker.flush()
+
+    def annotate(self, line):
+        decoded = self.decode(line)
+        if decoded is None:
+            return ""
+        frames, results = decoded
+        prefix = line[: len(line) - len(line.lstrip(" "))]
+        return format_backtrace([frame.address for frame in frames], results, prefix)
+
+    def to_record(self, line, line_number):
+        decoded = self.decode(line)
+        if decoded is None:
+            return None
+        frames, results = decoded
+        return dict(
+            line=line_number,
+            text=line,
+            firmware=self.firmware,
+            frames=[
+                dict(
+                    address="0x%08x" % frame.address,
+                    locations=[loc._asdict() for loc in locations],
+                )
+                for frame, locations in zip(frames, results)
+            ],
+        )
+
+
+def open_log(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def read_text(fp):
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    for data in iter(lambda: fp.read(CHUNK_SIZE), b""):
+        yield decoder.decode(data)
+    yield decoder.decode(b"", final=True)
+
+
+def decode_log(decoder, src, dst=None, output_format="annotated"):
+    """Decodes a log, the output is not written when `dst` is None."""
+    assembler = LineAssembler(markers=decoder.markers)
+    if dst is None:
+        with open_log(src) as fp:
+            for text in read_text(fp):
+                for _, line in assembler.feed(text):
+                    decoder.decode(line)
+            line = assembler.flush()
+            if line is not None:
+                decoder.decode(line)
+        return
+
+    with open_log(src) as fp, open(dst, "w", encoding="utf-8", newline="") as out:
+        if output_format == "annotated":
+            for text in read_text(fp):
+                out.write(insert_after_lines(text, assembler.feed(text), decoder.annotate))
+            line = assembler.flush()
+            trace = decoder.annotate(line) if line is not None else ""
+            if trace:
+                out.write("\n" + trace)
+            return
+
+        line_number = 0
+        for text in read_text(fp):
+            pos = 0
+            for end, line in assembler.feed(text):
+                line_number += text.count("\n", pos, end)
+                pos = end
+                record = decoder.to_record(line, line_number)
+                if record is not None:
+                    out.write(json.dumps(record) + "\n")
+            line_number += text.count("\n", pos)
+        line = assembler.flush()
+        if line is not None:
+            record = decoder.to_record(line, line_number + 1)
+            if record is not None:
+                out.write(json.dumps(record) + "\n")
+
+
+# state of a pool worker
+_server = None
+_memo = {}
+_signature_depth = 0
+
+
+def _init_worker(server_args, signature_depth=0):
+    """A forked worker inherits the server of the parent with its indexes."""
+    global _server, _signature_depth  # pylint: disable=global-statement
+    if _server is None:
+        _server = SymbolServer(*server_args)
+    _signature_depth = signature_depth
+
+
+def _decode_task(task):
+    src, dst, output_format = task
+    tracker = (
+        CrashTracker(CrashAggregator(), _signature_depth) if _signature_depth else None
+    )
+    try:
+        decoder = LogDecoder(_server, _memo, tracker, src)
+        if dst is not None and not os.path.isdir(os.path.dirname(dst)):
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+        decode_log(decoder, src, dst, output_format)
+        decoder.finish()
+    except Exception as e:  # pylint: disable=broad-except
+        return src, None, None, "%s: %s" % (e.__class__.__name__, e)
+    crashes = tracker.aggregator.entries if tracker is not None else None
+    return src, decoder.stats, crashes, None
+
+
+def collect_tasks(paths, output_dir, output_format):
+    """Returns the decode tasks and the inputs skipped for an output clash.
+
+    The `.gz` suffix is dropped from the output name, e.g. `a.log` and
+    `a.log.gz` of the same directory would write the same output.
+    """
+    output_dir = os.path.abspath(output_dir) if output_dir else None
+    tasks = []
+    skipped = []
+    outputs = {}
+    for path in paths:
+        if os.path.isfile(path):
+            files = [(path, os.path.basename(path))]
+        else:
+            files = []
+            for root, dirs, names in os.walk(path):
+                dirs[:] = sorted(
+                    d
+                    for d in dirs
+                    if not d.startswith(".")
+                    and os.path.abspath(os.path.join(root, d)) != output_dir
+                )
+                for name in names:
+                    if not name.startswith("."):
+                        src = os.path.join(root, name)
+                        files.append((src, os.path.relpath(src, path)))
+        for src, relpath in files:
+            if relpath.endswith(".gz"):
+                relpath = relpath[: -len(".gz")]
+            if output_format == "json":
+                relpath += ".jsonl"
+            dst = os.path.join(output_dir, relpath) if output_dir else None
+            if dst is not None:
+                if dst in outputs:
+                    skipped.append((src, outputs[dst]))
+                    continue
+                outputs[dst] = src
+            tasks.append((src, dst, output_format))
+    # start with the largest files to keep all workers busy until the end
+    tasks.sort(key=lambda task: os.path.getsize(task[0]), reverse=True)
+    return tasks, skipped
+
+
+def _run(args):
+    images = [
+        (name, path)
+        for name, path in (
+            ("bootloader", args.bootloader_elf),
+            ("ulp", args.ulp_elf),
+            ("rom", args.rom_elf),
+        )
+        if path
+    ]
+    if not args.elf and not args.store:
+        sys.stderr.write("Error: specify the firmware with --elf and/or --store\n")
+        return 2
+    if not args.output_dir and not args.summary:
+        sys.stderr.write("Error: specify --output-dir and/or --summary\n")
+        return 2
+    for path in (args.elf or []) + [path for _, path in images]:
+        if not os.path.isfile(path):
+            sys.stderr.write("Error: %s does not exist\n" % path)
+            return 2
+    signature_depth = args.depth if args.summary else 0
+    tasks, skipped = collect_tasks(args.paths, args.output_dir, args.format)
+    for src, other in skipped:
+        sys.stderr.write(
+            "%s: skipped, %s is decoded to the same output file\n" % (src, other)
+        )
+    jobs = max(1, min(args.jobs or os.cpu_count() or 1, len(tasks)))
+
+    totals = dict(
+        files=len(skipped),
+        failed=len(skipped),
+        backtraces=0,
+        frames=0,
+        unknown_frames=0,
+    )
+    aggregator = CrashAggregator()
+    server_args = (args.elf or [], images, args.store, args.addr2line)
+    global _server  # pylint: disable=global-statement
+    try:
+        _server = SymbolServer(*server_args)
+        _server.preload()
+    except Exception as e:  # pylint: disable=broad-except
+        sys.stderr.write("Error: failed to read the firmware: %s\n" % e)
+        return 2
+    pool = None
+    if jobs == 1:
+        _init_worker(server_args, signature_depth)
+        results = map(_decode_task, tasks)
+    else:
+        start_methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context(
+            "fork" if "fork" in start_methods else None
+        )
+        pool = context.Pool(  # pylint: disable=consider-using-with
+            jobs, initializer=_init_worker, initargs=(server_args, signature_depth)
+        )
+        results = pool.imap_unordered(_decode_task, tasks)
+    try:
+        for src, stats, crashes, error in results:
+            totals["files"] += 1
+            if error is not None:
+                totals["failed"] += 1
+                sys.stderr.write("%s: %s\n" % (src, error))
+                continue
+            for key in ("backtraces", "frames", "unknown_frames"):
+                totals[key] += stats[key]
+            if crashes:
+                aggregator.merge(crashes)
+            if args.verbose:
+                sys.stderr.write(
+                    "%s: %d backtraces%s\n"
+                    % (
+                        src,
+                        stats["backtraces"],
+                        ", unknown firmware" if stats["missing_firmware"] else "",
+                    )
+                )
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        _server.close()
+
+    # keep stdout parseable when it holds the JSON summary
+    sys.stderr.write(
+        "Decoded %d backtraces (%d frames, %d unknown) in %d files, %d failed\n"
+        % (
+            totals["backtraces"],
+            totals["frames"],
+            totals["unknown_frames"],
+            totals["files"],
+            totals["failed"],
+        )
+    )
+    if args.summary == "json":
+        print(aggregator.to_json(args.top))
+    elif args.summary == "table":
+        print(aggregator.format_table(args.top), end="")
+    return 1 if totals["failed"] else 0
+
+
+def add_parser(commands):
+    parser = commands.add_parser(
+        "decode", help="Decode the backtraces in captured serial logs"
+    )
+    parser.add_argument("paths", nargs="+", help="log files or directories")
+    parser.add_argument("-o", "--output-dir", help="directory for the decoded logs")
+    parser.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default="annotated",
+        help="annotated copies of the logs or a JSON object per backtrace",
+    )
+    parser.add_argument(
+        "--elf",
+        action="append",
+        help="firmware ELF, the first one is used until a log prints its "
+        "ELF SHA256 (repeatable)",
+    )
+    parser.add_argument("--store", help="symbol store with archived firmware ELFs")
+    parser.add_argument("--bootloader-elf")
+    parser.add_argument("--ulp-elf")
+    parser.add_argument("--rom-elf")
+    parser.add_argument(
+        "--addr2line", help="symbolize with this addr2line instead of in-process"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=0, help="worker processes (default: CPUs)"
+    )
+    parser.add_argument(
+        "--summary",
+        choices=("table", "json"),
+        help="print the crashes grouped by signature and ranked by frequency",
+    )
+    parser.add_argument(
+        "--depth", type=int, default=5, help="functions in a crash signature"
+    )
+    parser.add_argument("--top", type=int, help="show only the most frequent crashes")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    parser.set_defaults(func=_run)
@@ -0,0 +1,161 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Extracts the code addresses from the crash report lines printed by ESP-IDF.
+
+Only program counters are symbolized: the stack pointers of an Xtensa
+backtrace and the data registers of a register dump are skipped. Return
+addresses point to the instruction after the call, they are looked up one
+byte earlier so the reported line is the one of the call itself.
+"""
+
+import collections
+import re
+import struct
+
+from esp32_decoder.stream import ADDRESSES_RE
+
+ARCH_XTENSA = "xtensa"
+ARCH_RISCV = "riscv"
+
+# `e_machine` of the ELF header
+ELF_MACHINES = {94: ARCH_XTENSA, 243: ARCH_RISCV}
+
+Frame = collections.namedtuple("Frame", ["address", "lookup_address"])
+Frame.__doc__ = """A code address found in a crash report.
+
+`address` is printed as is, `lookup_address` is passed to the symbolizer.
+"""
+
+# Xtensa: `Backtrace: 0x400d1234:0x3ffb1230 0x400d5678:0x3ffb1250 |<-CORRUPTED`
+# The PCs are already moved to the call instruction by the panic handler.
+BACKTRACE_RE = re.compile(r"Backtrace:\s*((?:0x[0-9a-fA-F]{8}:0x[0-9a-fA-F]{8}\s*)+)")
+PC_SP_RE = re.compile(r"(0x[0-9a-fA-F]{8}):0x[0-9a-fA-F]{8}")
+
+# `abort() was called at PC 0x400d1234 on core 0`, adjusted by the panic
+# handler as well
+ABORT_RE = re.compile(r"abort\(\) was called at PC (0x[0-9a-fA-F]{8})")
+
+# Register dump: `MEPC    : 0x42006e8e  RA      : 0x42006e88  SP      : ...`
+REGISTER_RE = re.compile(r"\b([A-Z][A-Z0-9]*)\s*:\s*(0x[0-9a-fA-F]{8})\b")
+
+# RISC-V stack memory dump: `3fc93b90: 0x00000000 0x42006e88 ...`
+STACK_DUMP_RE = re.compile(r"^\s*[0-9a-fA-F]{8}:((?:\s+0x[0-9a-fA-F]{8})+)\s*$")
+
+ADDRESS_RE = re.compile(r"0x[0-9a-fA-F]{8}")
+
+# Printed at boot: `I (31) app_init: ELF file SHA256:  0123456789abcdef...`
+ELF_SHA256_MARKER = "ELF file SHA256:"
+ELF_SHA256_RE = re.compile(re.escape(ELF_SHA256_MARKER) + r"\s*([0-9a-fA-F]+)")
+
+# Kinds of the parsed lines
+LINE_BACKTRACE = "backtrace"
+LINE_ABORT = "abort"
+LINE_REGISTERS = "registers"
+LINE_STACK = "stack"
+LINE_ADDRESSES = "addresses"
+
+PC_REGISTERS = ("PC", "MEPC")
+RETURN_REGISTERS = {ARCH_XTENSA: ("A0",), ARCH_RISCV: ("RA",)}
+# Registers which are only printed by one of the panic handlers
+ARCH_REGISTERS = {"PS": ARCH_XTENSA, "EXCCAUSE": ARCH_XTENSA, "MEPC": ARCH_RISCV}
+
+
+def get_elf_arch(path):
+    """Returns the architecture of an ELF file or None if it is unknown."""
+    with open(path, "rb") as fp:
+        header = fp.read(20)
+    if len(header) < 20 or header[:4] != b"\x7fELF":
+        return None
+    (machine,) = struct.unpack("<H", header[18:20])
+    return ELF_MACHINES.get(machine)
+
+
+def return_frame(address, arch):
+    if arch == ARCH_XTENSA:
+        # the upper two bits of A0 hold the window increment of the call
+        address = (address & 0x3FFFFFFF) | 0x40000000
+    return Frame(address, address - 1)
+
+
+class BacktraceParser(object):
+    """Turns a line of a crash report into a list of frames.
+
+    The architecture selects which register holds the return address, it
+    is detected from the register names of a dump when not given. `kind`
+    tells which kind of line was parsed last.
+    """
+
+    def __init__(self, arch=None):
+        self.arch = arch
+        self.kind = None
+
+    def parse(self, line):
+        self.kind = None
+        m = BACKTRACE_RE.search(line)
+        if m is not None:
+            self.kind = LINE_BACKTRACE
+            return self._frames(PC_SP_RE.findall(m.group(1)))
+
+        m = ABORT_RE.search(line)
+        if m is not None:
+            self.kind = LINE_ABORT
+            return self._frames([m.group(1)])
+
+        registers = REGISTER_RE.findall(line)
+        if len(registers) > 1:
+            self.kind = LINE_REGISTERS
+            return self._parse_registers(registers)
+
+        m = STACK_DUMP_RE.match(line)
+        if m is not None:
+            self.kind = LINE_STACK
+            return [
+                return_frame(address, self.arch)
+                for address in self._addresses(ADDRESS_RE.findall(m.group(1)))
+            ]
+
+        m = ADDRESSES_RE.search(line)
+        if m is not None:
+            self.kind = LINE_ADDRESSES
+            # a `PC:SP` pair printed by the application
+            return self._frames(
+                item.split(":")[0] for item in m.group(1).split()
+            )
+        return []
+
+    def _parse_registers(self, registers):
+        for name, _ in registers:
+            if name in ARCH_REGISTERS:
+                self.arch = ARCH_REGISTERS[name]
+                break
+
+        result = []
+        for name, value in registers:
+            address = int(value, 16)
+            if not address:
+                continue
+            if name in PC_REGISTERS:
+                result.append(Frame(address, address))
+            elif name in RETURN_REGISTERS.get(self.arch, ()):
+                result.append(return_frame(address, self.arch))
+        return result
+
+    @staticmethod
+    def _addresses(values):
+        return [address for address in (int(v, 16) for v in values) if address]
+
+    def _frames(self, values):
+        return [Frame(address, address) for address in self._addresses(values)]
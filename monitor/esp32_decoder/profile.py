@@ -0,0 +1,265 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Sampling profiles built from program counters printed by the firmware.
+
+The firmware prints the samples it takes, e.g. from a timer interrupt, on
+lines starting with `PROF:`. A sample is the program counter of the
+interrupted code, optionally followed by the return addresses of its
+callers, in hex and separated by commas. A line holds any number of
+samples separated by spaces:
+
+    PROF: 400d1234 400d5678,400d1a2b,400d0f00 42000a10
+
+`PROF:END` ends a profile, e.g. after a benchmark.
+
+Samples are counted as they arrive and only symbolized when the profile
+is written, so a sample costs a dictionary update on the host.
+"""
+
+import collections
+import hashlib
+import json
+import os
+
+from esp32_decoder.parser import return_frame
+
+PROFILE_MARKER = "PROF:"
+PROFILE_END_MARKER = "PROF:END"
+PROFILE_FORMATS = ("folded", "speedscope", "svg")
+# addresses symbolized per lookup, a batch is a round trip to `addr2line`
+LOOKUP_BATCH_SIZE = 256
+
+
+class SampleProfile(object):
+    """Counts the samples of the `PROF:` lines."""
+
+    def __init__(self):
+        self.samples = collections.Counter()
+        self.total = 0
+
+    def feed_line(self, line):
+        """Counts the samples of a line, returns False at the end marker."""
+        idx = line.find(PROFILE_MARKER)
+        if idx == -1:
+            return True
+        if line.startswith(PROFILE_END_MARKER, idx):
+            return False
+        tokens = line[idx + len(PROFILE_MARKER) :].split()
+        self.samples.update(tokens)
+        self.total += len(tokens)
+        return True
+
+    def clear(self):
+        self.samples.clear()
+        self.total = 0
+
+    def get_stacks(self, arch):
+        """Returns the counts of the sampled stacks, the leaf frame first.
+
+        A stack is a tuple of `(address, lookup_address)` pairs.
+        """
+        result = collections.Counter()
+        for token, count in self.samples.items():
+            try:
+                addresses = [int(item, 16) for item in token.split(",") if item]
+            except ValueError:
+                continue
+            if not addresses or not addresses[0]:
+                continue
+            stack = [(addresses[0], addresses[0])]
+            stack.extend(
+                tuple(return_frame(address, arch)) for address in addresses[1:] if address
+            )
+            result[tuple(stack)] += count
+        return result
+
+
+def get_frame_names(locations, address):
+    """Returns the functions of an address, the outermost one first."""
+    if not locations:
+        return ["0x%08x" % address]
+    return [loc.function or "0x%08x" % address for loc in reversed(locations)]
+
+
+def fold_stacks(stacks, lookup, batch_size=LOOKUP_BATCH_SIZE):
+    """Symbolizes the distinct addresses of the stacks in batches.
+
+    Returns `(folded, frames)`: the counts of the stacks as tuples of frame
+    names, the root first, and the `(function, path)` of every name.
+    """
+    addresses = sorted({frame[1] for stack in stacks for frame in stack})
+    locations = {}
+    for start in range(0, len(addresses), batch_size):
+        batch = addresses[start : start + batch_size]
+        locations.update(zip(batch, lookup(batch)))
+    folded = collections.Counter()
+    frames = {}
+    for stack, count in stacks.items():
+        names = []
+        for address, lookup_address in reversed(stack):
+            found = locations.get(lookup_address) or ()
+            names.extend(get_frame_names(found, address))
+            for loc in found:
+                if loc.function:
+                    frames.setdefault(loc.function, loc.path)
+        folded[tuple(names)] += count
+    return folded, frames
+
+
+def write_folded(path, folded):
+    with open(path, "w", encoding="utf-8") as fp:
+        for names, count in sorted(folded.items()):
+            fp.write("%s %d\n" % (";".join(names), count))
+
+
+def write_speedscope(path, folded, frames, name="firmware"):
+    index = {}
+    shared = []
+    samples = []
+    weights = []
+    for names, count in sorted(folded.items()):
+        sample = []
+        for frame_name in names:
+            if frame_name not in index:
+                index[frame_name] = len(shared)
+                frame = dict(name=frame_name)
+                if frames.get(frame_name):
+                    frame["file"] = frames[frame_name]
+                shared.append(frame)
+            sample.append(index[frame_name])
+        samples.append(sample)
+        weights.append(count)
+    with open(path, "w", encoding="utf-8") as fp:
+        json.dump(
+            {
+                "$schema": "https://www.speedscope.app/file-format-schema.json",
+                "shared": dict(frames=shared),
+                "profiles": [
+                    dict(
+                        type="sampled",
+                        name=name,
+                        unit="none",
+                        startValue=0,
+                        endValue=sum(weights),
+                        samples=samples,
+                        weights=weights,
+                    )
+                ],
+                "name": name,
+                "exporter": "esp32_decoder",
+            },
+            fp,
+        )
+
+
+def _escape(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _get_color(name):
+    value = int(hashlib.md5(name.encode()).hexdigest()[:6], 16)
+    return "rgb(%d,%d,%d)" % (
+        205 + value % 50,
+        (value >> 8) % 180 + 50,
+        (value >> 16) % 55,
+    )
+
+
+def write_flamegraph(path, folded, title="Flame graph", width=1200, frame_height=16):
+    """Writes a flame graph of folded stacks as a standalone SVG file."""
+    root = [0, {}]
+    for names, count in folded.items():
+        root[0] += count
+        node = root
+        for name in names:
+            node = node[1].setdefault(name, [0, {}])
+            node[0] += count
+
+    def get_depth(node):
+        return 1 + max([get_depth(child) for child in node[1].values()] or [0])
+
+    depth = get_depth(root)
+    top = 40
+    height = top + depth * frame_height + 10
+    total = root[0] or 1
+    scale = (width - 20.0) / total
+    rects = []
+
+    def add_rects(name, node, x, level):
+        node_width = node[0] * scale
+        if node_width < 0.1:
+            return
+        y = height - 10 - (level + 1) * frame_height
+        label = name
+        chars = int(node_width / 7)
+        if len(label) > chars:
+            label = label[: chars - 2] + ".." if chars > 3 else ""
+        rects.append(
+            '<g><title>%s (%d samples, %.2f%%)</title>'
+            '<rect x="%.1f" y="%d" width="%.1f" height="%d" fill="%s" rx="2"/>'
+            '<text x="%.1f" y="%d">%s</text></g>'
+            % (
+                _escape(name),
+                node[0],
+                100.0 * node[0] / total,
+                x,
+                y,
+                node_width,
+                frame_height - 1,
+                _get_color(name),
+                x + 3,
+                y + frame_height - 4,
+                _escape(label),
+            )
+        )
+        for child_name, child in sorted(node[1].items()):
+            add_rects(child_name, child, x, level + 1)
+            x += child[0] * scale
+
+    add_rects("all", root, 10, 0)
+    with open(path, "w", encoding="utf-8") as fp:
+        fp.write(
+            '<?xml version="1.0" standalone="no"?>\n'
+            '<svg version="1.1" width="%d" height="%d" '
+            'xmlns="http://www.w3.org/2000/svg" font-family="Verdana" font-size="12">\n'
+            '<rect width="100%%" height="100%%" fill="#f8f8f8"/>\n'
+            '<text x="%d" y="24" text-anchor="middle" font-size="17">%s</text>\n'
+            % (width, height, width // 2, _escape(title))
+        )
+        fp.write("\n".join(rects))
+        fp.write("\n</svg>\n")
+
+
+def write_profile(directory, folded, frames, formats=PROFILE_FORMATS, name="profile"):
+    """Writes the profile in the given formats, returns the written paths."""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    paths = []
+    base = os.path.join(directory, name)
+    if "folded" in formats:
+        paths.append(base + ".folded")
+        write_folded(paths[-1], folded)
+    if "speedscope" in formats:
+        paths.append(base + ".speedscope.json")
+        write_speedscope(paths[-1], folded, frames, name)
+    if "svg" in formats:
+        paths.append(base + ".svg")
+        write_flamegraph(
+            paths[-1],
+            folded,
+            "%s, %d samples" % (name, sum(folded.values())),
+        )
+    return paths
@@ -0,0 +1,192 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Register dumps of the panic handler:
+
+    Core  0 register dump:
+    PC      : 0x400d1630  PS      : 0x00060630  A0      : 0x800d1668  ...
+    ...
+    EXCVADDR: 0x00000000  LBEG    : 0x4000c2e0  LEND    : 0x4000c2f6  ...
+
+A dump is collected as a whole, the registers which point into code are
+symbolized and the exception cause is translated into text.
+"""
+
+import collections
+import re
+
+from esp32_decoder.parser import ARCH_RISCV, ARCH_XTENSA, PC_REGISTERS, REGISTER_RE
+from esp32_decoder.symbols import format_locations
+
+DUMP_START_MARKER = "register dump:"
+DUMP_START_RE = re.compile(r"Core\s*(\d+) register dump:")
+# The last registers printed by the panic handlers
+DUMP_END_REGISTERS = ("LCOUNT", "MHARTID")
+
+XTENSA_EXCCAUSES = {
+    0: ("IllegalInstruction", "illegal instruction"),
+    1: ("Syscall", "SYSCALL instruction"),
+    2: ("InstructionFetchError", "error fetching an instruction"),
+    3: ("LoadStoreError", "error on a load or store"),
+    4: ("Level1Interrupt", "level 1 interrupt"),
+    5: ("Alloca", "MOVSP instruction with a spilled caller"),
+    6: ("IntegerDivideByZero", "integer division by zero"),
+    8: ("Privileged", "privileged instruction"),
+    9: ("LoadStoreAlignment", "unaligned load or store"),
+    12: ("InstrPIFDataError", "PIF data error on an instruction fetch"),
+    13: ("LoadStorePIFDataError", "PIF data error on a load or store"),
+    14: ("InstrPIFAddrError", "PIF address error on an instruction fetch"),
+    15: ("LoadStorePIFAddrError", "PIF address error on a load or store"),
+    16: ("InstTLBMiss", "instruction TLB miss"),
+    17: ("InstTLBMultiHit", "multiple instruction TLB hits"),
+    18: ("InstFetchPrivilege", "instruction fetch with insufficient privilege"),
+    20: ("InstFetchProhibited", "instruction fetch from a prohibited region"),
+    24: ("LoadStoreTLBMiss", "load or store TLB miss"),
+    25: ("LoadStoreTLBMultiHit", "multiple load or store TLB hits"),
+    26: ("LoadStorePrivilege", "load or store with insufficient privilege"),
+    28: ("LoadProhibited", "load from a prohibited region"),
+    29: ("StoreProhibited", "store to a prohibited region"),
+}
+XTENSA_EXCCAUSES.update(
+    (32 + i, ("Cp%dDisabled" % i, "coprocessor %d is disabled" % i)) for i in range(8)
+)
+
+RISCV_MCAUSES = {
+    0: ("InstructionAddressMisaligned", "misaligned instruction address"),
+    1: ("InstructionAccessFault", "instruction access fault"),
+    2: ("IllegalInstruction", "illegal instruction"),
+    3: ("Breakpoint", "breakpoint"),
+    4: ("LoadAddressMisaligned", "misaligned load address"),
+    5: ("LoadAccessFault", "load access fault"),
+    6: ("StoreAddressMisaligned", "misaligned store address"),
+    7: ("StoreAccessFault", "store access fault"),
+    8: ("UserEnvCall", "environment call from U-mode"),
+    9: ("SupervisorEnvCall", "environment call from S-mode"),
+    11: ("MachineEnvCall", "environment call from M-mode"),
+    12: ("InstructionPageFault", "instruction page fault"),
+    13: ("LoadPageFault", "load page fault"),
+    15: ("StorePageFault", "store page fault"),
+}
+
+# Registers which hold the faulting address of an exception
+FAULT_ADDRESS_REGISTERS = ("EXCVADDR", "MTVAL")
+
+CodeRegister = collections.namedtuple(
+    "CodeRegister", ["name", "address", "lookup_address"]
+)
+
+
+def describe_exception_cause(arch, registers):
+    """Returns the exception cause as text or None if it is not dumped."""
+    if arch == ARCH_RISCV and "MCAUSE" in registers:
+        mcause = registers["MCAUSE"]
+        if mcause & 0x80000000:
+            return "MCAUSE 0x%08x: interrupt %d" % (mcause, mcause & 0x7FFFFFFF)
+        name, text = RISCV_MCAUSES.get(mcause, ("Unknown", "unknown exception"))
+        return "MCAUSE %d: %s (%s)" % (mcause, name, text)
+    if "EXCCAUSE" in registers:
+        exccause = registers["EXCCAUSE"]
+        name, text = XTENSA_EXCCAUSES.get(exccause, ("Unknown", "reserved cause"))
+        return "EXCCAUSE %d: %s (%s)" % (exccause, name, text)
+    return None
+
+
+def format_register_dump(dump, arch, registers, results, prefix=""):
+    """Formats the compact report of a dump.
+
+    `registers` are the code registers of the dump, `results` their
+    symbolized addresses.
+    """
+    summary = "%sCore %d" % (prefix, dump.core)
+    cause = describe_exception_cause(arch, dump.registers)
+    if cause is not None:
+        summary += ": " + cause
+    for name in FAULT_ADDRESS_REGISTERS:
+        if name in dump.registers:
+            summary += ", %s 0x%08x" % (name, dump.registers[name])
+    lines = [summary + "\n"]
+    for register, locations in zip(registers, results):
+        if locations:
+            lines.append(
+                "%s  %-8s 0x%08x in %s\n"
+                % (prefix, register.name, register.address, format_locations(locations))
+            )
+    return "".join(lines) + "\n"
+
+
+class RegisterDump(object):
+    def __init__(self, core):
+        self.core = core
+        self.registers = collections.OrderedDict()
+        self.lines = []
+
+    def add_line(self, line):
+        self.lines.append(line)
+        for name, value in REGISTER_RE.findall(line):
+            self.registers[name] = int(value, 16)
+
+    def get_code_registers(self, arch, is_code):
+        """Returns the registers which point into code.
+
+        `is_code(address)` tells whether an address belongs to a code
+        section. Return addresses are looked up one byte earlier, on Xtensa
+        the window increment is replaced in the upper bits of A0 first.
+        """
+        result = []
+        for name, value in self.registers.items():
+            if not value:
+                continue
+            lookup_address = value
+            if name in PC_REGISTERS or name in FAULT_ADDRESS_REGISTERS:
+                pass
+            elif arch == ARCH_XTENSA and name == "A0":
+                value = (value & 0x3FFFFFFF) | 0x40000000
+                lookup_address = value - 1
+            elif arch == ARCH_RISCV and name == "RA":
+                lookup_address = value - 1
+            if is_code(lookup_address):
+                result.append(CodeRegister(name, value, lookup_address))
+        return result
+
+
+class RegisterDumpParser(object):
+    """Collects the register dump lines of each core.
+
+    `feed` returns whether the line belongs to a dump and the dump finished
+    by the line, if any. A dump ends with its last register, the next dump
+    or any other line.
+    """
+
+    def __init__(self):
+        self.current = None
+
+    def feed(self, line):
+        m = DUMP_START_RE.search(line)
+        if m is not None:
+            finished, self.current = self.current, RegisterDump(int(m.group(1)))
+            return True, finished
+        if self.current is None:
+            return False, None
+        registers = REGISTER_RE.findall(line)
+        if not registers:
+            return False, self.flush()
+        self.current.add_line(line)
+        if any(name in DUMP_END_REGISTERS for name, _ in registers):
+            return True, self.flush()
+        return True, None
+
+    def flush(self):
+        finished, self.current = self.current, None
+        return finished
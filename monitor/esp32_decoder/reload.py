@@ -0,0 +1,101 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import threading
+import time
+
+
+def get_file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime)
+
+
+class FileWatcher(object):
+    """Detects changes of files by polling their inode, size and mtime.
+
+    `poll` is cheap enough to be called for every chunk of input, the files
+    are checked at most once per `interval`. A change is reported once the
+    files have not changed for one more interval, so a firmware which is
+    still being linked is not picked up.
+    """
+
+    def __init__(self, paths, interval=1.0):
+        self.interval = interval
+        self._last_check = time.monotonic()
+        self._candidate = None
+        self.set_paths(paths)
+
+    def set_paths(self, paths):
+        self.paths = list(paths)
+        self._signature = self._get_signature()
+        self._candidate = None
+
+    def _get_signature(self):
+        return [get_file_signature(path) for path in self.paths]
+
+    def poll(self):
+        now = time.monotonic()
+        if now - self._last_check < self.interval:
+            return False
+        self._last_check = now
+        signature = self._get_signature()
+        if signature == self._signature or None in signature:
+            self._candidate = None
+            return False
+        if signature != self._candidate:
+            self._candidate = signature
+            return False
+        self._signature = signature
+        self._candidate = None
+        return True
+
+
+class BackgroundLoader(object):
+    """Builds a replacement object in a background thread.
+
+    The result is published with a single assignment, the thread which uses
+    the object picks it up with `take` between two requests.
+    """
+
+    def __init__(self, build, name="esp32-symbol-loader"):
+        self.build = build
+        self.name = name
+        self.error = None
+        self._result = None
+        self._thread = None
+
+    @property
+    def busy(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.busy:
+            return False
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        return True
+
+    def _run(self):
+        try:
+            self._result = self.build()
+        except Exception as e:  # pylint: disable=broad-except
+            self.error = e
+
+    def take(self):
+        result, self._result = self._result, None
+        return result
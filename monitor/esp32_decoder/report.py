@@ -0,0 +1,120 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Collects the lines of a crash report printed by the panic handler into a
+single structured report.
+"""
+
+import time
+
+from esp32_decoder.parser import REGISTER_RE
+from esp32_decoder.registers import DUMP_START_RE
+from esp32_decoder.signature import END_MARKERS, get_crash_reason
+
+
+class CrashReport(object):
+    def __init__(self, reason=None, firmware=None):
+        self.timestamp = time.time()
+        self.reason = reason
+        self.firmware = firmware
+        # registers of each core, the dump of a single core has no header
+        self.registers = {}
+        self.core = 0
+        self.backtraces = []
+        self.lines = []
+
+    def add_line(self, line):
+        self.lines.append(line)
+        m = DUMP_START_RE.search(line)
+        if m is not None:
+            self.core = int(m.group(1))
+        for name, value in REGISTER_RE.findall(line):
+            self.registers.setdefault(self.core, {}).setdefault(name, int(value, 16))
+
+    def add_backtrace(self, kind, frames, results):
+        self.backtraces.append((kind, frames, results))
+
+    def to_dict(self):
+        return dict(
+            timestamp=time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(self.timestamp))
+            + ".%03dZ" % (self.timestamp % 1 * 1000),
+            reason=self.reason,
+            elf_sha256=self.firmware,
+            registers={
+                str(core): {name: "0x%08x" % value for name, value in registers.items()}
+                for core, registers in sorted(self.registers.items())
+            },
+            backtraces=[
+                dict(
+                    kind=kind,
+                    frames=[
+                        dict(
+                            address="0x%08x" % frame.address,
+                            locations=[loc._asdict() for loc in locations],
+                        )
+                        for frame, locations in zip(frames, results)
+                    ],
+                )
+                for kind, frames, results in self.backtraces
+            ],
+            lines=self.lines,
+        )
+
+
+class CrashCollector(object):
+    """Groups the lines of crash reports into `CrashReport` objects.
+
+    A report starts with the reason line of the panic handler and ends with
+    the reboot, the next crash or `flush`. Backtraces printed outside of a
+    crash report make a report of their own when any address is known.
+    """
+
+    def __init__(self):
+        self.current = None
+
+    def feed_line(self, line, firmware=None):
+        """Handles a line without code addresses.
+
+        Returns the report finished by this line, if any.
+        """
+        reason = get_crash_reason(line)
+        if reason is not None:
+            report = self.flush()
+            self.current = CrashReport(reason, firmware)
+            self.current.add_line(line)
+            return report
+        if any(marker in line for marker in END_MARKERS):
+            return self.flush()
+        if self.current is not None:
+            self.current.add_line(line)
+        return None
+
+    def add_backtrace(self, line, kind, frames, results, firmware=None):
+        """Returns the report when the backtrace is not part of a crash."""
+        if self.current is None:
+            if not any(results):
+                return None
+            report = CrashReport(firmware=firmware)
+            report.add_line(line)
+            report.add_backtrace(kind, frames, results)
+            return report
+        if line not in self.current.lines[-1:]:
+            self.current.add_line(line)
+        self.current.add_backtrace(kind, frames, results)
+        return None
+
+    def flush(self):
+        report, self.current = self.current, None
+        return report
@@ -0,0 +1,231 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tracks the tasks of the FreeRTOS tables printed by the firmware.
+
+`vTaskGetRunTimeStats()` prints the run time counter of each task:
+
+    main            12345           5%
+
+and `vTaskList()` its state, priority, stack high water mark, number and,
+with ESP-IDF, the core it is pinned to:
+
+    main            X       1       1484    4       0
+
+The fields are separated by tabs. Lines are parsed one by one as they
+arrive, a table ends with a line which does not belong to it or when a
+task is listed again. The CPU usage is the share of the run time each task
+got since the previous run time table.
+"""
+
+import collections
+import csv
+import re
+
+STATS_RE = re.compile(r"^\s*(\S[^\t]*?)\s*\t+\s*(\d+)\s*\t+\s*<?\d+%\s*$")
+LIST_RE = re.compile(
+    r"^\s*(\S[^\t]*?)\s*\t+\s*([XBRDS])\s*\t+\s*(\d+)\s*\t+\s*(\d+)\s*\t+\s*\d+"
+    r"(?:\s*\t+\s*(-?\d+))?\s*$"
+)
+
+TABLE_STATS = "stats"
+TABLE_LIST = "list"
+
+TaskSample = collections.namedtuple("TaskSample", ["time", "cpu", "stack"])
+CSV_FIELDS = [
+    "time",
+    "table",
+    "task",
+    "cpu_percent",
+    "runtime",
+    "stack_high_water_mark",
+    "state",
+    "priority",
+    "core",
+]
+
+
+class TaskHistory(object):
+    """The latest values of a task and a ring buffer of its samples."""
+
+    def __init__(self, name, history):
+        self.name = name
+        self.samples = collections.deque(maxlen=history)
+        self.runtime = None
+        self.cpu = None
+        self.stack = None
+        self.min_stack = None
+        self.state = None
+        self.priority = None
+        self.core = None
+
+    @property
+    def average_cpu(self):
+        values = [sample.cpu for sample in self.samples if sample.cpu is not None]
+        return sum(values) / len(values) if values else None
+
+    @property
+    def is_idle(self):
+        return self.name.startswith("IDLE")
+
+
+class TaskTracker(object):
+    """Builds snapshots of the task tables line by line."""
+
+    def __init__(self, history=120):
+        self.history = history
+        self.tasks = {}
+        self._table = None
+        self._rows = {}
+        self.last_line = None
+
+    @property
+    def pending(self):
+        return self._table is not None
+
+    def feed_line(self, line, now):
+        """Returns the kind of the table finished by this line, if any."""
+        m = STATS_RE.match(line)
+        kind = TABLE_STATS if m is not None else None
+        if m is None:
+            m = LIST_RE.match(line)
+            kind = TABLE_LIST if m is not None else None
+
+        finished = None
+        if self._table is not None and (
+            kind != self._table or m.group(1) in self._rows
+        ):
+            finished = self.finish(now)
+        if kind is not None:
+            self._table = kind
+            self._rows[m.group(1)] = m.groups()[1:]
+            self.last_line = now
+        return finished
+
+    def finish(self, now):
+        """Applies the table read so far, returns its kind."""
+        table, rows = self._table, self._rows
+        self._table = None
+        self._rows = {}
+        if table == TABLE_STATS:
+            self._apply_stats(rows, now)
+        else:
+            self._apply_list(rows, now)
+        # both tables list every task, the missing ones were deleted
+        for name in [name for name in self.tasks if name not in rows]:
+            del self.tasks[name]
+        return table
+
+    def _get_task(self, name):
+        if name not in self.tasks:
+            self.tasks[name] = TaskHistory(name, self.history)
+        return self.tasks[name]
+
+    def _apply_stats(self, rows, now):
+        deltas = {}
+        for name, (runtime,) in rows.items():
+            task = self._get_task(name)
+            runtime = int(runtime)
+            if task.runtime is not None:
+                # the counter is 32 bits wide
+                deltas[name] = (runtime - task.runtime) & 0xFFFFFFFF
+            task.runtime = runtime
+        total = sum(deltas.values())
+        for name in rows:
+            task = self.tasks[name]
+            task.cpu = 100.0 * deltas[name] / total if total and name in deltas else None
+            task.samples.append(TaskSample(now, task.cpu, task.stack))
+
+    def _apply_list(self, rows, now):
+        for name, (state, priority, stack, core) in rows.items():
+            task = self._get_task(name)
+            task.state = state
+            task.priority = int(priority)
+            task.stack = int(stack)
+            task.min_stack = (
+                task.stack if task.min_stack is None else min(task.min_stack, task.stack)
+            )
+            task.core = int(core) if core is not None else None
+            task.samples.append(TaskSample(now, task.cpu, task.stack))
+
+
+def _format_value(value, template):
+    return template % value if value is not None else "-"
+
+
+def format_summary(tracker, prefix=""):
+    tasks = sorted(
+        tracker.tasks.values(),
+        key=lambda task: (task.cpu is None, -(task.cpu or 0), task.name),
+    )
+    idle = sum(task.cpu or 0 for task in tasks if task.is_idle)
+    has_cpu = any(task.cpu is not None for task in tasks)
+    lines = [
+        "%sTasks: %d%s\n"
+        % (
+            prefix,
+            len(tasks),
+            ", CPU busy %.1f%%, idle %.1f%%" % (100 - idle, idle) if has_cpu else "",
+        ),
+        "%s%-16s %6s %6s %6s %9s %5s %4s %4s\n"
+        % (prefix, "TASK", "CPU%", "AVG%", "STACK", "STACK MIN", "STATE", "PRIO", "CORE"),
+    ]
+    for task in tasks:
+        lines.append(
+            "%s%-16s %6s %6s %6s %9s %5s %4s %4s\n"
+            % (
+                prefix,
+                task.name[:16],
+                _format_value(task.cpu, "%.1f"),
+                _format_value(task.average_cpu, "%.1f"),
+                _format_value(task.stack, "%d"),
+                _format_value(task.min_stack, "%d"),
+                task.state or "-",
+                _format_value(task.priority, "%d"),
+                _format_value(task.core, "%d"),
+            )
+        )
+    return "".join(lines) + "\n"
+
+
+class CsvWriter(object):
+    """Appends a row per task and table to a CSV file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._fp = open(path, "a", newline="", encoding="utf-8")  # pylint: disable=consider-using-with
+        self._writer = csv.writer(self._fp)
+        if self._fp.tell() == 0:
+            self._writer.writerow(CSV_FIELDS)
+
+    def write(self, tracker, table, timestamp):
+        for task in sorted(tracker.tasks.values(), key=lambda task: task.name):
+            self._writer.writerow(
+                [
+                    timestamp,
+                    table,
+                    task.name,
+                    "%.2f" % task.cpu if task.cpu is not None else "",
+                    task.runtime if task.runtime is not None else "",
+                    task.stack if task.stack is not None else "",
+                    task.state or "",
+                    task.priority if task.priority is not None else "",
+                    task.core if task.core is not None else "",
+                ]
+            )
+        self._fp.flush()
+
+    def close(self):
+        self._fp.close()
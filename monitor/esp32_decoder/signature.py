@@ -0,0 +1,247 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Crash signatures: a decoded backtrace reduced to the panic reason and the
+names of its top functions, so the same crash has the same signature in
+every build and every log.
+"""
+
+import collections
+import hashlib
+import json
+import re
+
+from esp32_decoder.parser import (
+    ARCH_RISCV,
+    ELF_SHA256_MARKER,
+    LINE_BACKTRACE,
+    LINE_REGISTERS,
+)
+
+REASON_PATTERNS = (
+    (re.compile(r"Guru Meditation Error: Core\s*\d+ panic'ed \(([^)]+)\)"), None),
+    (re.compile(r"abort\(\) was called"), "abort()"),
+    (re.compile(r"assert failed:"), "assert failed"),
+    (re.compile(r"stack overflow in task"), "stack overflow"),
+    (re.compile(r"Task watchdog got triggered"), "task watchdog"),
+)
+# Lines which end a crash report, the next boot prints the ELF SHA256
+END_MARKERS = ("Rebooting...", ELF_SHA256_MARKER)
+# Lines the monitor must pass to the tracker besides the code addresses
+REASON_MARKERS = (
+    "Guru Meditation",
+    "abort()",
+    "assert failed:",
+    "stack overflow",
+    "Task watchdog",
+) + END_MARKERS
+
+# Suffixes of the function clones created by GCC optimizations
+CLONE_SUFFIX_RE = re.compile(
+    r"(?:\.(?:constprop|isra|part|cold|lto_priv|localalias)(?:\.\d+)?)+$"
+)
+CLONE_NOTE_RE = re.compile(r" \[clone [^\]]*\]")
+PARAMETERS_RE = re.compile(r"\(.*\)(?: const)?$")
+ANONYMOUS_NAMESPACE = "(anonymous namespace)"
+
+UNKNOWN_FUNCTION = "??"
+
+# Backtraces of a crash in the order of preference, a RISC-V panic prints
+# MEPC and RA and a full backtrace only when it is enabled
+BACKTRACE_PRIORITY = {LINE_REGISTERS: 1, LINE_BACKTRACE: 2}
+
+
+def get_crash_reason(line):
+    for pattern, reason in REASON_PATTERNS:
+        m = pattern.search(line)
+        if m is not None:
+            return reason or m.group(1)
+    return None
+
+
+def normalize_function(name):
+    """Drops the parts of a function name which vary between builds."""
+    name = CLONE_NOTE_RE.sub("", name)
+    name = name.replace(ANONYMOUS_NAMESPACE, "\0")
+    name = PARAMETERS_RE.sub("", name)
+    name = CLONE_SUFFIX_RE.sub("", name)
+    return name.replace("\0", ANONYMOUS_NAMESPACE)
+
+
+def get_signature_functions(results, depth=5):
+    """Returns the top `depth` function names of a symbolized backtrace.
+
+    Inlined functions count as frames of their own, unknown addresses are
+    skipped.
+    """
+    functions = []
+    for locations in results:
+        for location in locations:
+            if len(functions) == depth:
+                return functions
+            functions.append(normalize_function(location.function or UNKNOWN_FUNCTION))
+    return functions
+
+
+def get_signature_id(reason, functions):
+    data = "\n".join([reason or ""] + list(functions))
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()[:16]
+
+
+class CrashAggregator(object):
+    """Counts crashes by signature.
+
+    Entries are plain dictionaries, so aggregators of separate processes
+    are merged by passing `entries` to `merge`.
+    """
+
+    MAX_SOURCES = 5
+
+    def __init__(self):
+        self.entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, reason, functions, firmware=None, source=None):
+        signature = get_signature_id(reason, functions)
+        entry = self.entries.get(signature)
+        if entry is None:
+            entry = self.entries[signature] = dict(
+                signature=signature,
+                reason=reason,
+                functions=list(functions),
+                count=0,
+                firmwares=[],
+                sources=[],
+            )
+        self._update(entry, 1, [firmware] if firmware else [], [source] if source else [])
+        return entry
+
+    def merge(self, entries):
+        for signature, other in entries.items():
+            entry = self.entries.setdefault(
+                signature, dict(other, count=0, firmwares=[], sources=[])
+            )
+            self._update(entry, other["count"], other["firmwares"], other["sources"])
+
+    def _update(self, entry, count, firmwares, sources):
+        entry["count"] += count
+        for firmware in firmwares:
+            if firmware not in entry["firmwares"]:
+                entry["firmwares"].append(firmware)
+        for source in sources:
+            if len(entry["sources"]) < self.MAX_SOURCES:
+                entry["sources"].append(source)
+
+    def ranked(self, limit=None):
+        entries = sorted(self.entries.values(), key=lambda e: e["count"], reverse=True)
+        return entries[:limit] if limit else entries
+
+    def to_json(self, limit=None):
+        return json.dumps(self.ranked(limit), indent=2)
+
+    def format_table(self, limit=None):
+        entries = self.ranked(limit)
+        if not entries:
+            return "No crashes\n"
+        reason_width = max(6, max(len(e["reason"] or "-") for e in entries))
+        lines = [
+            "%6s  %-16s  %-*s  %s"
+            % ("Count", "Signature", reason_width, "Reason", "Top frames")
+        ]
+        for entry in entries:
+            lines.append(
+                "%6d  %-16s  %-*s  %s"
+                % (
+                    entry["count"],
+                    entry["signature"],
+                    reason_width,
+                    entry["reason"] or "-",
+                    " < ".join(entry["functions"]) or UNKNOWN_FUNCTION,
+                )
+            )
+        return "\n".join(lines) + "\n"
+
+
+class CrashTracker(object):
+    """Turns the lines of crash reports into crashes of an aggregator.
+
+    A crash starts with its reason line and is counted once, with the best
+    backtrace printed for it: the backtrace of the other core is ignored. A
+    full backtrace is counted right away, the RISC-V `MEPC`/`RA` pair is
+    held until the crash report ends in case a full backtrace follows.
+    Backtraces printed outside of a crash report, e.g. by
+    `esp_backtrace_print`, are counted on their own.
+    """
+
+    def __init__(self, aggregator, depth=5):
+        self.aggregator = aggregator
+        self.depth = depth
+        self._reason = None
+        self._in_crash = False
+        self._counted = False
+        self._pending = None
+
+    def feed_line(self, line, source=None):
+        """Handles a line which is not a backtrace.
+
+        Returns the entry of the crash finished by this line, if any.
+        """
+        reason = get_crash_reason(line)
+        if reason is not None:
+            entry = self.flush()
+            self._reason = reason
+            self._in_crash = True
+            self._counted = False
+            return entry
+        if any(marker in line for marker in END_MARKERS):
+            entry = self.flush()
+            self._reason = None
+            self._in_crash = False
+            return entry
+        return None
+
+    def add_backtrace(self, kind, arch, results, firmware=None, source=None):
+        """Returns the entry of the crash when it is counted."""
+        priority = BACKTRACE_PRIORITY.get(kind)
+        if priority is None or (kind == LINE_REGISTERS and arch != ARCH_RISCV):
+            return None
+        crash = (
+            self._reason,
+            get_signature_functions(results, self.depth),
+            firmware,
+            source,
+        )
+        if not self._in_crash:
+            return self.aggregator.add(*crash) if kind == LINE_BACKTRACE else None
+        if self._counted or (
+            self._pending is not None and self._pending[0] >= priority
+        ):
+            return None
+        if priority == max(BACKTRACE_PRIORITY.values()):
+            self._pending = None
+            self._counted = True
+            return self.aggregator.add(*crash)
+        self._pending = (priority, crash)
+        return None
+
+    def flush(self):
+        """Counts the crash held back, if any."""
+        pending, self._pending = self._pending, None
+        if pending is None:
+            return None
+        self._counted = True
+        return self.aggregator.add(*pending[1])
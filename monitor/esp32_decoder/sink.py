@@ -0,0 +1,135 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import json
+import socket
+import threading
+import time
+
+TCP_SCHEME = "tcp://"
+
+
+class JsonLinesSink(object):
+    """Writes records as JSON lines to a file or a TCP socket.
+
+    The target is a file path, records are appended, or `tcp://host:port`.
+    Records are collected in a buffer which is written `flush_interval`
+    seconds after the first pending record by a timer thread, so a burst of
+    records costs a single write and `write` never waits for the target.
+    The socket is connected in the background, a lost connection is retried
+    at most every `retry_interval` seconds and records are dropped and
+    counted in `dropped` while it is down or the buffer is full.
+    """
+
+    def __init__(
+        self, target, flush_interval=1.0, retry_interval=5.0, buffer_size=64 * 1024
+    ):
+        self.target = target
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        self.buffer_size = buffer_size
+        self.dropped = 0
+        self._lock = threading.Lock()
+        # serializes the writes to the target outside of `_lock`
+        self._write_lock = threading.Lock()
+        self._buffer = []
+        self._buffer_len = 0
+        self._fp = None
+        self._socket = None
+        self._timer = None
+        self._connecting = False
+        self._last_attempt = None
+        if self.target.startswith(TCP_SCHEME):
+            self._start_connect()
+        else:
+            # pylint: disable=consider-using-with
+            self._fp = io.open(self.target, "ab")
+
+    def _start_connect(self):
+        if self._connecting or (
+            self._last_attempt is not None
+            and time.monotonic() - self._last_attempt < self.retry_interval
+        ):
+            return
+        self._connecting = True
+        self._last_attempt = time.monotonic()
+        thread = threading.Thread(target=self._connect, name="json-lines-sink")
+        thread.daemon = True
+        thread.start()
+
+    def _connect(self):
+        host, _, port = self.target[len(TCP_SCHEME) :].rpartition(":")
+        try:
+            sock = socket.create_connection((host, int(port)), timeout=5)
+        except (OSError, ValueError):
+            sock = None
+        with self._lock:
+            self._connecting = False
+            if sock is not None:
+                self._socket = sock
+                self._fp = sock.makefile("wb")
+
+    def write(self, record):
+        data = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._lock:
+            if self._fp is None:
+                self.dropped += 1
+                self._start_connect()
+                return
+            if self._buffer_len + len(data) > self.buffer_size and self._buffer:
+                self.dropped += 1
+                return
+            self._buffer.append(data)
+            self._buffer_len += len(data)
+            if self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        with self._write_lock:
+            with self._lock:
+                self._timer = None
+                fp, records = self._fp, self._buffer
+                self._buffer = []
+                self._buffer_len = 0
+            if fp is None or not records:
+                return
+            try:
+                fp.write(b"".join(records))
+                fp.flush()
+            except OSError:
+                with self._lock:
+                    self.dropped += len(records)
+                    if self._fp is fp:
+                        self._close_target()
+
+    def _close_target(self):
+        for item in (self._fp, self._socket):
+            if item is None:
+                continue
+            try:
+                item.close()
+            except OSError:
+                pass
+        self._fp = self._socket = None
+
+    def close(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+        self.flush()
+        with self._lock:
+            self._close_target()
@@ -0,0 +1,86 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+from esp32_decoder.cache import get_file_sha256
+
+
+class SymbolStore(object):
+    """Content-addressed archive of firmware ELF files.
+
+    An ELF is kept as `<sha256[:16]>/<sha256>.elf`. ESP-IDF prints the
+    first 16 digits of the ELF SHA256 at boot, so the ELF of a running
+    firmware is found from the boot log by opening a single directory.
+    """
+
+    PREFIX_SIZE = 16
+
+    def __init__(self, path):
+        self.path = path
+
+    def get_path(self, sha256):
+        sha256 = sha256.lower()
+        return os.path.join(
+            self.path, sha256[: self.PREFIX_SIZE], sha256 + ".elf"
+        )
+
+    def add(self, elf_path, sha256=None):
+        """Copies an ELF into the store unless it is already there."""
+        path = self.get_path(sha256 or get_file_sha256(elf_path))
+        if os.path.isfile(path):
+            # mark it as recently used
+            os.utime(os.path.dirname(path), None)
+            return path
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        # readers never see a partially copied file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fp, open(elf_path, "rb") as src:
+                shutil.copyfileobj(src, fp)
+            os.replace(tmp_path, path)
+        except OSError:
+            os.remove(tmp_path)
+            raise
+        return path
+
+    def find(self, prefix):
+        """Returns the ELF whose SHA256 starts with `prefix` or None."""
+        prefix = prefix.lower()
+        if len(prefix) < self.PREFIX_SIZE:
+            return None
+        directory = os.path.join(self.path, prefix[: self.PREFIX_SIZE])
+        if not os.path.isdir(directory):
+            return None
+        for name in os.listdir(directory):
+            if name.endswith(".elf") and name.startswith(prefix):
+                return os.path.join(directory, name)
+        return None
+
+    def prune(self, max_entries):
+        """Removes the least recently added ELFs above `max_entries`."""
+        if not os.path.isdir(self.path):
+            return
+        entries = sorted(
+            (os.path.getmtime(path), path)
+            for path in (
+                os.path.join(self.path, name) for name in os.listdir(self.path)
+            )
+            if os.path.isdir(path)
+        )
+        for _, path in entries[: max(0, len(entries) - max_entries)]:
+            shutil.rmtree(path, ignore_errors=True)
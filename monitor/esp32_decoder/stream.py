@@ -0,0 +1,196 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+import tempfile
+
+# A run of 32-bit addresses at the end of a line, e.g. a backtrace
+ADDRESSES_RE = re.compile(r"((?:0x[0-9a-fA-F]{8}[: ]?)+)\s?$")
+
+
+class LineAssembler(object):
+    """Splits a stream of text chunks into lines without copying them.
+
+    `feed` scans a chunk for the marker strings first and returns only the
+    lines which contain one of them, lines without a marker are skipped
+    without being sliced out of the chunk. A line which is not terminated
+    yet is kept as a list of fragments until its line break arrives. Once
+    it grows over `spill_size` characters the fragments are moved to a
+    temporary file, so lines of any length are returned complete.
+    """
+
+    def __init__(self, markers=("0x",), spill_size=4096):
+        self.markers = tuple(markers or ())
+        self.spill_size = spill_size
+        # a marker may be split between two chunks
+        self._tail_size = max([len(m) for m in self.markers] or [1]) - 1
+        self._reset()
+
+    def _reset(self):
+        self._parts = []
+        self._size = 0
+        self._spill = None
+        self._tail = ""
+        self._marked = False
+
+    @property
+    def pending(self):
+        return self._size > 0
+
+    def _append(self, fragment, marked=False):
+        self._marked = self._marked or marked
+        self._size += len(fragment)
+        if self._tail_size:
+            self._tail = (self._tail + fragment)[-self._tail_size :]
+        if self._spill is not None:
+            self._spill.write(fragment)
+            return
+        self._parts.append(fragment)
+        if self._size > self.spill_size:
+            self._spill = tempfile.TemporaryFile(
+                mode="w+", encoding="utf-8", errors="replace", newline=""
+            )
+            self._spill.writelines(self._parts)
+            self._parts = []
+
+    def _take(self):
+        if self._spill is not None:
+            self._spill.seek(0)
+            line = self._spill.read()
+            self._spill.close()
+        else:
+            line = "".join(self._parts)
+        self._reset()
+        return line
+
+    def flush(self):
+        """Returns the unterminated line at the end of the stream.
+
+        None is returned when there is no such line or it has no marker.
+        """
+        marked = self._marked or not self.markers
+        line = self._take() if self.pending else None
+        return line if marked else None
+
+    def _has_marker(self, text):
+        if not self.markers:
+            return True
+        return any(marker in text for marker in self.markers)
+
+    def feed(self, text):
+        """Yields `(end, line)` for every complete line with a marker.
+
+        `end` is the offset in `text` right after the line break, the line
+        itself is returned without the line break.
+        """
+        pos = 0
+        if self.pending:
+            idx = text.find("\n")
+            if idx == -1:
+                self._append(text, self._has_marker(self._tail + text))
+                return
+            head = text[:idx]
+            if self._marked or self._has_marker(self._tail + head):
+                yield idx + 1, self._take() + head
+            else:
+                self._reset()
+            pos = idx + 1
+
+        size = len(text)
+        next_markers = dict.fromkeys(self.markers, -2)
+        while pos < size:
+            idx = self._find_marker(text, pos, next_markers)
+            if idx == -1:
+                break
+            start = text.rfind("\n", pos, idx) + 1 or pos
+            end = text.find("\n", idx)
+            if end == -1:
+                self._append(text[start:], marked=True)
+                return
+            yield end + 1, text[start:end]
+            pos = end + 1
+
+        # an unterminated line without a marker (yet)
+        start = text.rfind("\n", pos) + 1 or pos
+        if start < size:
+            self._append(text[start:])
+
+    def _find_marker(self, text, pos, next_markers):
+        if not self.markers:
+            return pos
+        result = -1
+        for marker, idx in next_markers.items():
+            if idx != -1 and idx < pos:
+                idx = next_markers[marker] = text.find(marker, pos)
+            if idx != -1 and (result == -1 or idx < result):
+                result = idx
+        return result
+
+
+def insert_after_lines(text, lines, handle):
+    """Inserts the output of `handle(line)` after every line of `lines`.
+
+    `lines` are `(end, line)` pairs as returned by `LineAssembler.feed`.
+    The text is only rebuilt when something is inserted.
+    """
+    result = []
+    last = 0
+    for end, line in lines:
+        extra = handle(line)
+        if not extra:
+            continue
+        result.append(text[last:end])
+        result.append(extra)
+        last = end
+    if not result:
+        return text
+    result.append(text[last:])
+    return "".join(result)
+
+
+def replace_lines(text, lines, handle):
+    """Replaces every line of `lines` with the output of `handle(line)`.
+
+    The line break is replaced as well, lines are kept when `handle`
+    returns None. A line which started in an earlier chunk is only replaced
+    from the start of `text`.
+    """
+    result = []
+    last = 0
+    for end, line in lines:
+        replacement = handle(line)
+        if replacement is None:
+            continue
+        result.append(text[last : max(last, end - len(line) - 1)])
+        result.append(replacement)
+        last = end
+    if not result:
+        return text
+    result.append(text[last:])
+    return "".join(result)
+
+
+def hold_partial_line(text, marker):
+    """Splits off the unterminated last line when it may hold `marker`.
+
+    Returns `(text, held)`, the held text is passed again with the next
+    chunk, so a line is never shown before it can be replaced.
+    """
+    start = text.rfind("\n") + 1
+    tail = text[start:]
+    if marker in tail or any(
+        tail.endswith(marker[:i]) for i in range(1, len(marker))
+    ):
+        return text[:start], tail
+    return text, ""
@@ -0,0 +1,53 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+
+Location = collections.namedtuple("Location", ["function", "path", "line"])
+Location.__doc__ = """Source location of a code address.
+
+A symbolized address is a tuple of locations, the innermost inlined
+function comes first, followed by the functions it is inlined into. An
+empty tuple means that the address is not known to the firmware.
+"""
+
+INLINED_SEPARATOR = "\n      (inlined by) "
+
+
+def format_location(location):
+    return "%s at %s:%s" % (
+        location.function or "??",
+        location.path or "??",
+        location.line or "?",
+    )
+
+
+def format_locations(locations):
+    return INLINED_SEPARATOR.join(format_location(loc) for loc in locations)
+
+
+def format_backtrace(addresses, results, prefix=""):
+    """Formats symbolized addresses as numbered frames.
+
+    Addresses which are not known to the firmware are left out.
+    """
+    lines = []
+    for address, locations in zip(addresses, results):
+        if not locations:
+            continue
+        lines.append(
+            "%s  #%-2d 0x%08x in %s\n"
+            % (prefix, len(lines), address, format_locations(locations))
+        )
+    return "".join(lines) + "\n" if lines else ""
@@ -0,0 +1,76 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import queue
+import sys
+import threading
+
+
+class DecodeWorker(object):
+    """Runs decode requests in a background thread.
+
+    A request is a function with its arguments. Requests are processed in
+    the order they were submitted and the results are passed to `emit` as
+    soon as they are ready. `submit` never blocks: when `max_pending`
+    requests of the same function are already waiting, the request is
+    dropped and counted in `dropped`, unless it is forced, e.g. a firmware
+    switch which the later requests depend on. Every function has its own
+    limit, a flood of cheap requests never crowds out the others.
+    """
+
+    def __init__(self, emit, max_pending=100):
+        self.emit = emit
+        self.dropped = 0
+        self.max_pending = max_pending
+        # unbounded, the limit only applies to requests which are not forced
+        self._queue = queue.Queue()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._run, name="esp32-exception-decoder", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, func, *args, force=False):
+        with self._lock:
+            pending = self._pending.get(func, 0)
+            if not force and pending >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._pending[func] = pending + 1
+        self._queue.put((func, args))
+        return True
+
+    def _run(self):
+        while True:
+            request = self._queue.get()
+            if request is None:
+                break
+            func, args = request
+            with self._lock:
+                self._pending[func] -= 1
+            try:
+                result = func(*args)
+            except Exception as e:  # pylint: disable=broad-except
+                sys.stderr.write(
+                    "%s: %s failed: %s\n"
+                    % (self._thread.name, getattr(func, "__name__", func), e)
+                )
+                continue
+            if result:
+                self.emit(result)
+
+    def stop(self, timeout=1):
+        self._queue.put(None)
+        self._thread.join(timeout)
@@ -0,0 +1,79 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import time
+
+from platformio.public import DeviceMonitorFilterBase
+
+# PlatformIO loads filters by their file path, make the helper package
+# located next to this file importable
+MONITOR_DIR = os.path.dirname(os.path.realpath(__file__))
+if MONITOR_DIR not in sys.path:
+    sys.path.insert(0, MONITOR_DIR)
+
+from esp32_decoder.boottime import (  # noqa: E402
+    RESET_MARKERS,
+    BootTracker,
+    format_boot,
+    parse_points,
+)
+from esp32_decoder.stream import LineAssembler, insert_after_lines  # noqa: E402
+
+# By design, __init__ is called inside miniterm and we can't pass context to it.
+# pylint: disable=attribute-defined-outside-init
+
+
+class Esp32BootTime(DeviceMonitorFilterBase):
+    """Reports how long each phase of the boot took.
+
+    The phases run from the reset over the 2nd stage bootloader, the start
+    of the application and `app_main()` to the Wi-Fi connection, further
+    points are defined with `custom_boot_time_points`. The durations of all
+    boots seen by the monitor are summarized after each boot.
+    """
+
+    NAME = "esp32_boot_time"
+
+    def __call__(self):
+        points = self.get_option("points", "")
+        if isinstance(points, list):
+            points = "\n".join(points)
+        self.tracker = BootTracker(parse_points(points), self.get_option("last"))
+        self.timeout = float(self.get_option("timeout", 30))
+        # every log line carries a timestamp which may reveal a reset
+        self.assembler = LineAssembler(
+            markers=("(",) + RESET_MARKERS + self.tracker.markers
+        )
+        return self
+
+    def get_option(self, name, default=None):
+        return self.config.get(
+            "env:" + self.environment, "custom_boot_time_" + name, default
+        )
+
+    def rx(self, text):
+        now = time.time()
+        output = self.format_boot(self.tracker.expire(now, self.timeout))
+        return output + insert_after_lines(
+            text,
+            self.assembler.feed(text),
+            lambda line: self.format_boot(self.tracker.feed_line(line, now)),
+        )
+
+    def format_boot(self, boot):
+        if boot is None:
+            return ""
+        return "\n" + format_boot(boot, self.tracker)
@@ -12,9 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import atexit
+import hashlib
 import os
 import re
-import subprocess
+import sqlite3
 import sys
 
 from platformio.exception import PlatformioException
@@ -23,25 +25,122 @@ from platformio.public import (
     load_build_metadata,
 )
 
+# PlatformIO loads filters by their file path, make the helper package
+# located next to this file importable
+MONITOR_DIR = os.path.dirname(os.path.realpath(__file__))
+if MONITOR_DIR not in sys.path:
+    sys.path.insert(0, MONITOR_DIR)
+
+from esp32_decoder.addr2line import Addr2LineSymbolizer  # noqa: E402
+from esp32_decoder.cache import SymbolCache, get_file_sha256  # noqa: E402
+from esp32_decoder.coredump import (  # noqa: E402
+    CoreDump,
+    CoreDumpCapture,
+    CoreDumpError,
+    format_core_dump,
+)
+from esp32_decoder.heaptrace import (  # noqa: E402
+    HEAP_TRACE_MARKER,
+    HeapTraceParser,
+    LeakReport,
+    format_leak_report,
+    get_call_site,
+    get_lookup_address,
+)
+from esp32_decoder.images import (  # noqa: E402
+    ImageMap,
+    find_rom_elf,
+    get_image_offset,
+)
+from esp32_decoder.parser import (  # noqa: E402
+    ELF_SHA256_MARKER,
+    ELF_SHA256_RE,
+    BacktraceParser,
+    get_elf_arch,
+)
+from esp32_decoder.registers import (  # noqa: E402
+    DUMP_START_MARKER,
+    RegisterDumpParser,
+    format_register_dump,
+)
+from esp32_decoder.reload import BackgroundLoader, FileWatcher  # noqa: E402
+from esp32_decoder.report import CrashCollector  # noqa: E402
+from esp32_decoder.signature import (  # noqa: E402
+    REASON_MARKERS,
+    CrashAggregator,
+    CrashTracker,
+)
+from esp32_decoder.sink import JsonLinesSink  # noqa: E402
+from esp32_decoder.store import SymbolStore  # noqa: E402
+from esp32_decoder.stream import LineAssembler, insert_after_lines  # noqa: E402
+from esp32_decoder.symbols import format_backtrace  # noqa: E402
+from esp32_decoder.worker import DecodeWorker  # noqa: E402
+
+try:
+    from esp32_decoder.elf import ElfSymbolizer
+except ImportError:
+    ElfSymbolizer = None
+
 # By design, __init__ is called inside miniterm and we can't pass context to it.
 # pylint: disable=attribute-defined-outside-init
 
-IS_WINDOWS = sys.platform.startswith("win")
-
 
 class Esp32ExceptionDecoder(DeviceMonitorFilterBase):
     NAME = "esp32_exception_decoder"
 
-    ADDR_PATTERN = re.compile(r"((?:0x[0-9a-fA-F]{8}[: ]?)+)\s?$")
-    ADDR_SPLIT = re.compile(r"[ :]")
     PREFIX_RE = re.compile(r"^ *")
 
+    # Symbolization backends: `auto` prefers the in-process ELF reader and
+    # falls back to the toolchain `addr2line`
+    BACKENDS = ("auto", "elf", "addr2line")
+    CRASH_SUMMARY_FORMATS = ("table", "json")
+
+    # Set by the multi-port monitor, the decoders of its ports share the
+    # symbol index of an ELF file instead of loading it once per port
+    symbolizer_pool = None
+
     def __call__(self):
-        self.buffer = ""
+        self.parser = BacktraceParser()
 
         self.firmware_path = None
+        self.image_paths = []
         self.addr2line_path = None
-        self.enabled = self.setup_paths()
+        self.backend = None
+        self.symbolizer = None
+        self.cache = None
+        self.file_hashes = {}
+        self.store = None
+        self.missing_firmware = None
+        self.tracker = None
+        self.collector = None
+        self.sink = None
+        self.watcher = None
+        self.loader = None
+        # the images of a firmware switch while their symbols are loaded
+        self.pending_paths = None
+        self.switch_requested = False
+        self.worker = None
+        self.dumps = None
+        self.coredumps = None
+        self.coredump_worker = None
+        self.heap_traces = None
+        self.heap_report = None
+        self.enabled = self.setup_paths() and self.setup_symbolizer()
+        if self.enabled:
+            self.setup_cache()
+            self.setup_store()
+            self.setup_tracker()
+            self.setup_sink()
+            self.setup_reload()
+            self.setup_worker()
+            self.setup_register_dumps()
+            self.setup_coredump()
+            self.setup_heap_trace()
+
+        markers = ("0x", ELF_SHA256_MARKER, DUMP_START_MARKER, HEAP_TRACE_MARKER)
+        if self.tracker is not None or self.collector is not None:
+            markers += REASON_MARKERS
+        self.assembler = LineAssembler(markers=markers)
 
         if self.config.get("env:" + self.environment, "build_type") != "debug":
             print(
@@ -66,101 +165,654 @@ See https://docs.platformio.org/page/projectconf/build_configurations.html
                     % (self.__class__.__name__, self.firmware_path)
                 )
                 return False
+            self.parser.arch = get_elf_arch(self.firmware_path)
+            self.image_paths = [("app", self.firmware_path)] + self.find_images(data)
 
             cc_path = data.get("cc_path", "")
             if "-gcc" in cc_path:
                 path = cc_path.replace("-gcc", "-addr2line")
                 if os.path.isfile(path):
                     self.addr2line_path = path
-                    return True
         except PlatformioException as e:
             sys.stderr.write(
-                "%s: disabling, exception while looking for addr2line: %s\n"
+                "%s: disabling, exception while looking for the firmware: %s\n"
                 % (self.__class__.__name__, e)
             )
             return False
-        sys.stderr.write(
-            "%s: disabling, failed to find addr2line.\n" % self.__class__.__name__
+        return True
+
+    def find_images(self, data):
+        """Returns the other images which may run code on the chip."""
+        extra = data.get("extra", {})
+        result = []
+
+        bootloader_path = extra.get("bootloader_elf_path")
+        if not bootloader_path:
+            # prebuilt bootloaders are shipped with their ELF files
+            for image in extra.get("flash_images", []):
+                name = os.path.basename(image["path"])
+                if name.startswith("bootloader") and name.endswith(".bin"):
+                    bootloader_path = image["path"][:-4] + ".elf"
+                    break
+        result.append(("bootloader", bootloader_path))
+        result.append(("ulp", extra.get("ulp_elf_path")))
+        result.append(
+            ("rom", self.get_option("rom_elf") or find_rom_elf(extra.get("mcu")))
+        )
+        return [(name, path) for name, path in result if path and os.path.isfile(path)]
+
+    def get_option(self, name, default=None):
+        return self.config.get(
+            "env:" + self.environment, "custom_exception_decoder_" + name, default
+        )
+
+    def setup_symbolizer(self):
+        backend = self.get_option("backend", "auto")
+        if backend not in self.BACKENDS:
+            sys.stderr.write(
+                "%s: unknown backend `%s`, expected one of %s\n"
+                % (self.__class__.__name__, backend, ", ".join(self.BACKENDS))
+            )
+            backend = "auto"
+
+        if backend in ("auto", "elf"):
+            self.symbolizer = self.create_image_map("elf")
+        if self.symbolizer is None and backend in ("auto", "addr2line"):
+            self.symbolizer = self.create_image_map("addr2line")
+        if self.symbolizer is None:
+            sys.stderr.write(
+                "%s: disabling, failed to find a symbolization backend.\n"
+                % self.__class__.__name__
+            )
+            return False
+        atexit.register(self.close_symbolizer)
+        return True
+
+    def close_symbolizer(self):
+        self.symbolizer.close()
+
+    def create_image_map(self, backend, image_paths=None):
+        factory = (
+            self.create_elf_symbolizer
+            if backend == "elf"
+            else self.create_addr2line_symbolizer
+        )
+        images = ImageMap()
+        for name, path in image_paths or self.image_paths:
+            symbolizer = factory(path)
+            if symbolizer is None:
+                if name == "app":
+                    return None
+                continue
+            try:
+                images.add(name, path, symbolizer, get_image_offset(name, path))
+            except (OSError, ValueError) as e:
+                symbolizer.close()
+                sys.stderr.write(
+                    "%s: failed to load %s image: %s\n"
+                    % (self.__class__.__name__, name, e)
+                )
+                if name == "app":
+                    images.close()
+                    return None
+        self.backend = backend
+        return images
+
+    def create_elf_symbolizer(self, path):
+        if ElfSymbolizer is None:
+            return None
+        try:
+            if self.symbolizer_pool is not None:
+                return self.symbolizer_pool.acquire(
+                    self.get_file_hash(path), ElfSymbolizer, path
+                )
+            return ElfSymbolizer(path)
+        except Exception as e:  # pylint: disable=broad-except
+            sys.stderr.write(
+                "%s: failed to load symbols from %s: %s\n"
+                % (self.__class__.__name__, path, e)
+            )
+        return None
+
+    def create_addr2line_symbolizer(self, path):
+        if not self.addr2line_path:
+            return None
+        return Addr2LineSymbolizer(self.addr2line_path, path)
+
+    def setup_cache(self):
+        max_entries = int(self.get_option("cache_size", 50000))
+        if max_entries <= 0:
+            return
+        try:
+            self.cache = SymbolCache(
+                os.path.join(
+                    self.config.get("platformio", "build_dir"),
+                    "esp32_exception_decoder.db",
+                ),
+                max_entries,
+            )
+            atexit.register(self.cache.close)
+        except (OSError, sqlite3.Error) as e:
+            sys.stderr.write(
+                "%s: symbol cache is disabled: %s\n" % (self.__class__.__name__, e)
+            )
+
+    def setup_store(self):
+        self.store = SymbolStore(
+            self.get_option(
+                "symbol_store",
+                os.path.join(self.config.get("platformio", "workspace_dir"), "symbols"),
+            )
         )
-        return False
+
+    def setup_tracker(self):
+        summary_format = self.get_option("crash_summary", "no").lower()
+        if summary_format not in self.CRASH_SUMMARY_FORMATS:
+            return
+        self.tracker = CrashTracker(
+            CrashAggregator(), int(self.get_option("crash_signature_depth", 5))
+        )
+        atexit.register(self.print_crash_summary, summary_format)
+
+    def print_crash_summary(self, summary_format):
+        self.tracker.flush()
+        aggregator = self.tracker.aggregator
+        output = (
+            aggregator.to_json() if summary_format == "json" else aggregator.format_table()
+        )
+        path = self.get_option("crash_summary_file")
+        if not path:
+            sys.stdout.write("\nCrash summary:\n" + output)
+            return
+        with open(path, "w", encoding="utf-8") as fp:
+            fp.write(output)
+
+    def setup_sink(self):
+        target = self.get_option("json_sink")
+        if not target:
+            return
+        try:
+            self.sink = JsonLinesSink(target)
+        except OSError as e:
+            sys.stderr.write(
+                "%s: failed to open the JSON sink %s: %s\n"
+                % (self.__class__.__name__, target, e)
+            )
+            return
+        self.collector = CrashCollector()
+        atexit.register(self.close_sink)
+
+    def close_sink(self):
+        self.write_report(self.collector.flush())
+        self.sink.close()
+        if self.sink.dropped:
+            sys.stderr.write(
+                "%s: %d crash record(s) were not written to %s\n"
+                % (self.__class__.__name__, self.sink.dropped, self.sink.target)
+            )
+
+    def get_port(self):
+        terminal = self.get_running_terminal()
+        if terminal is not None and getattr(terminal, "serial", None) is not None:
+            return terminal.serial.port
+        return self.options.get("port")
+
+    def write_report(self, report):
+        if report is None:
+            return
+        record = report.to_dict()
+        record["port"] = self.get_port()
+        self.sink.write(record)
+
+    def setup_reload(self):
+        # also loads the symbols of a firmware switch off the serial thread
+        self.loader = BackgroundLoader(self.load_symbolizer)
+        if self.get_option("reload", "yes").lower() not in ("1", "yes", "true"):
+            return
+        self.watcher = FileWatcher([path for _, path in self.image_paths])
+
+    def load_symbolizer(self):
+        """Runs in the background when the firmware was rebuilt or switched."""
+        image_paths = list(self.pending_paths or self.image_paths)
+        symbolizer = self.create_image_map(self.backend, image_paths)
+        # hash the new files here instead of on the first backtrace
+        for _, path in image_paths:
+            self.get_file_hash(path)
+        return image_paths, symbolizer
+
+    def check_firmware(self):
+        if self.loader.busy:
+            return
+        changed = self.watcher is not None and self.watcher.poll()
+        if changed or self.switch_requested:
+            self.switch_requested = False
+            self.loader.start()
+
+    def swap_symbolizer(self):
+        if self.loader is None:
+            return
+        if self.loader.error is not None:
+            sys.stderr.write(
+                "%s: failed to reload symbols: %s\n"
+                % (self.__class__.__name__, self.loader.error)
+            )
+            self.loader.error = None
+        result = self.loader.take()
+        if result is None:
+            return
+        image_paths, symbolizer = result
+        if image_paths != (self.pending_paths or self.image_paths):
+            # another firmware was selected in the meantime
+            if symbolizer is not None:
+                symbolizer.close()
+            return
+        self.pending_paths = None
+        if symbolizer is None:
+            return
+        if image_paths == self.image_paths:
+            sys.stderr.write(
+                "%s: reloaded symbols of %s\n"
+                % (self.__class__.__name__, image_paths[0][1])
+            )
+        else:
+            sys.stderr.write(
+                "%s: decoding backtraces with %s\n"
+                % (self.__class__.__name__, image_paths[0][1])
+            )
+        self.use_symbolizer(image_paths, symbolizer)
+
+    def use_symbolizer(self, image_paths, symbolizer):
+        self.symbolizer.close()
+        self.symbolizer = symbolizer
+        if image_paths == self.image_paths:
+            return
+        self.image_paths = image_paths
+        self.parser.arch = get_elf_arch(image_paths[0][1])
+        if self.watcher is not None:
+            self.watcher.set_paths([item[1] for item in image_paths])
+
+    def setup_worker(self):
+        if self.get_option("async", "no").lower() not in ("1", "yes", "true"):
+            return
+        self.worker = DecodeWorker(self.emit)
+        atexit.register(self.stop_worker)
+
+    def stop_worker(self):
+        self.worker.stop()
+        if self.worker.dropped:
+            sys.stderr.write(
+                "%s: %d line(s) were not decoded, the decoding queue was "
+                "full\n" % (self.__class__.__name__, self.worker.dropped)
+            )
+
+    def setup_register_dumps(self):
+        if self.get_option("register_dump", "yes").lower() not in ("1", "yes", "true"):
+            return
+        self.dumps = RegisterDumpParser()
+
+    def setup_coredump(self):
+        if self.get_option("coredump", "yes").lower() not in ("1", "yes", "true"):
+            return
+        self.coredumps = CoreDumpCapture(
+            self.get_option(
+                "coredump_dir",
+                os.path.join(
+                    self.config.get("platformio", "build_dir"),
+                    self.environment,
+                    "coredumps",
+                ),
+            )
+        )
+        # the analysis takes a while, it never runs in the serial thread
+        self.coredump_worker = DecodeWorker(self.emit, max_pending=4)
+        atexit.register(self.coredump_worker.stop)
+
+    def setup_heap_trace(self):
+        if self.get_option("heap_trace", "yes").lower() not in ("1", "yes", "true"):
+            return
+        self.heap_traces = HeapTraceParser()
+        self.heap_trace_top = int(self.get_option("heap_trace_top", "20"))
+
+    def emit(self, text):
+        terminal = self.get_running_terminal()
+        if terminal is not None:
+            terminal.console.write(text)
+            return
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+    def get_file_hash(self, path):
+        st = os.stat(path)
+        signature = (st.st_ino, st.st_size, st.st_mtime)
+        if self.file_hashes.get(path, (None,))[0] != signature:
+            self.file_hashes[path] = (signature, get_file_sha256(path))
+        return self.file_hashes[path][1]
+
+    def find_file_hash(self, path):
+        """Returns None while the file is missing, e.g. during a rebuild."""
+        try:
+            return self.get_file_hash(path)
+        except OSError:
+            return None
+
+    def get_firmware_hash(self):
+        hashes = [self.get_file_hash(path) for _, path in self.image_paths]
+        if len(hashes) == 1:
+            return hashes[0]
+        # symbols of several images are cached under a hash of all of them
+        return hashlib.sha256(" ".join(hashes).encode()).hexdigest()
+
+    def lookup(self, addresses):
+        self.swap_symbolizer()
+        if self.cache is None:
+            return self.resolve(addresses)
+        try:
+            return self.cache.lookup(
+                self.get_firmware_hash(), addresses, self.resolve
+            )
+        except sqlite3.Error as e:
+            sys.stderr.write(
+                "%s: symbol cache is disabled: %s\n" % (self.__class__.__name__, e)
+            )
+            self.cache = None
+        return self.resolve(addresses)
+
+    def resolve(self, addresses):
+        try:
+            return self.symbolizer.lookup(addresses)
+        except Exception as e:  # pylint: disable=broad-except
+            if self.backend == "addr2line":
+                raise
+            # keep decoding with the subprocess backend
+            fallback = self.create_image_map("addr2line")
+            if fallback is None:
+                raise
+            sys.stderr.write(
+                "%s: failed to read symbols, switching to addr2line: %s\n"
+                % (self.__class__.__name__, e)
+            )
+            self.symbolizer.close()
+            self.symbolizer = fallback
+            return self.symbolizer.lookup(addresses)
 
     def rx(self, text):
         if not self.enabled:
             return text
+        self.check_firmware()
+        if self.coredumps is not None:
+            try:
+                paths = self.coredumps.feed(text)
+            except OSError as e:
+                sys.stderr.write(
+                    "%s: failed to save the core dump: %s\n"
+                    % (self.__class__.__name__, e)
+                )
+                self.coredumps.close()
+                paths = []
+            for path in paths:
+                self.coredump_worker.submit(self.analyze_core_dump, path)
+        return insert_after_lines(
+            text, self.assembler.feed(text), self.handle_line
+        )
 
-        last = 0
-        while True:
-            idx = text.find("\n", last)
-            if idx == -1:
-                if len(self.buffer) < 4096:
-                    self.buffer += text[last:]
-                break
+    def handle_line(self, line):
+        m = ELF_SHA256_RE.search(line)
+        requests = []
+        # the callers of a heap trace are reported per call site, not per line
+        in_heap_trace = False
+        if self.heap_traces is not None and m is None:
+            in_heap_trace, heap_dump = self.heap_traces.feed_line(line)
+            if heap_dump is not None:
+                requests.append((self.build_heap_report, heap_dump))
+        frames = self.parser.parse(line) if m is None and not in_heap_trace else None
+        in_dump = False
+        if self.dumps is not None and m is None:
+            in_dump, dump = self.dumps.feed(line)
+            if dump is not None:
+                requests.append((self.build_register_dump, dump, self.parser.arch))
 
-            line = text[last:idx]
-            if self.buffer:
-                line = self.buffer + line
-                self.buffer = ""
-            last = idx + 1
+        if m is not None:
+            requests.append((self.select_firmware, line, m.group(1)))
+        elif frames:
+            requests.append(
+                (
+                    self.build_backtrace,
+                    line,
+                    frames,
+                    self.parser.kind,
+                    self.parser.arch,
+                    in_dump,
+                )
+            )
+        elif not in_heap_trace and (
+            self.tracker is not None or self.collector is not None
+        ):
+            requests.append((self.track_line, line))
 
-            m = self.ADDR_PATTERN.search(line)
-            if m is None:
-                continue
+        if self.worker is not None:
+            for request in requests:
+                # a firmware switch or a heap trace report must not be dropped
+                self.worker.submit(
+                    *request,
+                    force=request[0] in (self.select_firmware, self.build_heap_report)
+                )
+            return ""
+
+        return "".join(request[0](*request[1:]) for request in requests)
 
-            trace = self.build_backtrace(line, m.group(1))
-            if trace:
-                text = text[: idx + 1] + trace + text[idx + 1 :]
-                last += len(trace)
-        return text
-
-    def is_address_ignored(self, address):
-        return address in ("", "0x00000000")
-
-    def filter_addresses(self, adresses_str):
-        addresses = self.ADDR_SPLIT.split(adresses_str)
-        size = len(addresses)
-        while size > 1 and self.is_address_ignored(addresses[size-1]):
-            size -= 1
-        return addresses[:size]
-
-    def build_backtrace(self, line, address_match):
-        addresses = self.filter_addresses(address_match)
-        if not addresses:
+    def track_line(self, line):
+        if self.collector is not None:
+            self.write_report(
+                self.collector.feed_line(
+                    line, firmware=self.find_file_hash(self.image_paths[0][1])
+                )
+            )
+        if self.tracker is None:
             return ""
+        return self.format_crash(self.tracker.feed_line(line))
 
+    def format_crash(self, entry):
+        if entry is None:
+            return ""
+        return "  Crash signature %s, seen %d time(s)\n\n" % (
+            entry["signature"],
+            entry["count"],
+        )
+
+    def select_firmware(self, line, sha256_prefix):
+        """Switches to the ELF of the firmware which runs on the device."""
+        output = self.track_line(line)
+        sha256_prefix = sha256_prefix.lower()
+        if (self.find_file_hash(self.image_paths[0][1]) or "").startswith(
+            sha256_prefix
+        ):
+            # a switch to another firmware is obsolete
+            self.pending_paths = None
+            return output
+
+        path = None
+        if (self.find_file_hash(self.firmware_path) or "").startswith(sha256_prefix):
+            path = self.firmware_path
+        elif self.store is not None:
+            path = self.store.find(sha256_prefix)
+        if path is None:
+            if sha256_prefix != self.missing_firmware:
+                self.missing_firmware = sha256_prefix
+                sys.stderr.write(
+                    "%s: the device runs a firmware with ELF SHA256 %s which is "
+                    "neither the current build nor in the symbol store, "
+                    "backtraces may be wrong\n"
+                    % (self.__class__.__name__, sha256_prefix)
+                )
+            return output
+
+        image_paths = [("app", path)] + self.image_paths[1:]
+        if self.worker is None:
+            # loading an ELF takes a while, the serial thread must go on
+            if image_paths != self.pending_paths:
+                self.pending_paths = image_paths
+                self.switch_requested = True
+            return output + "  Loading symbols of %s\n" % path
+        symbolizer = self.create_image_map(self.backend, image_paths)
+        if symbolizer is None:
+            return output
+        self.use_symbolizer(image_paths, symbolizer)
+        return output + "  Decoding backtraces with %s\n" % path
+
+    def build_backtrace(self, line, frames, kind=None, arch=None, quiet=False):
+        """Symbolizes the frames of a line.
+
+        The frames of a register dump are only tracked, they are `quiet`
+        since the dump is reported as a whole.
+        """
         prefix_match = self.PREFIX_RE.match(line)
         prefix = prefix_match.group(0) if prefix_match is not None else ""
+        # e.g. `abort() was called at PC ...` starts a crash report
+        crash = self.track_line(line)
 
-        trace = ""
-        enc = "mbcs" if IS_WINDOWS else "utf-8"
-        args = [self.addr2line_path, u"-fipC", u"-e", self.firmware_path]
         try:
-            i = 0
-            for addr in addresses:
-                output = (
-                    subprocess.check_output(args + [addr])
-                    .decode(enc)
-                    .strip()
-                )
+            results = self.lookup([frame.lookup_address for frame in frames])
+        except Exception as e:  # pylint: disable=broad-except
+            sys.stderr.write(
+                "%s: failed to symbolize addresses: %s\n"
+                % (self.__class__.__name__, e)
+            )
+            return crash
 
-                # newlines happen with inlined methods
-                output = output.replace(
-                    "\n", "\n     "
-                )
+        trace = ""
+        if not quiet:
+            trace = self.strip_project_dir(
+                format_backtrace([frame.address for frame in frames], results, prefix)
+            )
+        firmware = self.find_file_hash(self.image_paths[0][1])
+        if self.collector is not None:
+            self.write_report(
+                self.collector.add_backtrace(line, kind, frames, results, firmware)
+            )
+        if self.tracker is not None:
+            trace += self.format_crash(
+                self.tracker.add_backtrace(kind, arch, results, firmware=firmware)
+            )
+        return crash + trace
+
+    def build_register_dump(self, dump, arch):
+        """Reports the exception cause and the code registers of a dump."""
+        if not dump.registers:
+            return ""
+        self.swap_symbolizer()
+        # only the registers within the code sections of an image are looked up
+        registers = dump.get_code_registers(
+            arch, lambda address: self.symbolizer.find(address) is not None
+        )
+        try:
+            results = self.lookup([register.lookup_address for register in registers])
+        except Exception as e:  # pylint: disable=broad-except
+            sys.stderr.write(
+                "%s: failed to symbolize addresses: %s\n"
+                % (self.__class__.__name__, e)
+            )
+            results = [()] * len(registers)
+        prefix = self.PREFIX_RE.match(dump.lines[0]).group(0)
+        return self.strip_project_dir(
+            format_register_dump(dump, arch, registers, results, prefix)
+        )
 
-                # throw out addresses not from ELF
-                if output == "?? ??:0":
-                    continue
+    def build_heap_report(self, dump):
+        """Groups the outstanding allocations of a heap trace by call site.
 
-                output = self.strip_project_dir(output)
-                trace += "%s  #%-2d %s in %s\n" % (prefix, i, addr, output)
-                i += 1
-        except subprocess.CalledProcessError as e:
+        Every distinct caller is looked up once, the report is compared with
+        the one of the previous dump.
+        """
+        arch = self.parser.arch or get_elf_arch(self.image_paths[0][1])
+        records = dump.outstanding()
+        chains = [
+            [get_lookup_address(address, arch) for address in record.callers]
+            for record in records
+        ]
+        addresses = sorted(set(address for chain in chains for address in chain))
+        try:
+            results = dict(zip(addresses, self.lookup(addresses)))
+        except Exception as e:  # pylint: disable=broad-except
             sys.stderr.write(
-                "%s: failed to call %s: %s\n"
-                % (self.__class__.__name__, self.addr2line_path, e)
+                "%s: failed to symbolize addresses: %s\n"
+                % (self.__class__.__name__, e)
+            )
+            results = {}
+        report = LeakReport(
+            dump,
+            [
+                get_call_site([results.get(address, ()) for address in chain])
+                for chain in chains
+            ],
+        )
+        previous, self.heap_report = self.heap_report, report
+        return self.strip_project_dir(
+            format_leak_report(report, previous, top=self.heap_trace_top)
+        )
+
+    def find_core_dump_images(self, sha256_prefix):
+        """Returns the images of the firmware which wrote a core dump."""
+        image_paths = list(self.image_paths)
+        if not sha256_prefix or (
+            self.find_file_hash(image_paths[0][1]) or ""
+        ).startswith(sha256_prefix):
+            return image_paths
+        path = None
+        if (self.find_file_hash(self.firmware_path) or "").startswith(sha256_prefix):
+            path = self.firmware_path
+        elif self.store is not None:
+            path = self.store.find(sha256_prefix)
+        if path is None:
+            return None
+        return [("app", path)] + image_paths[1:]
+
+    def analyze_core_dump(self, path):
+        """Runs in the background once a core dump was received."""
+        try:
+            dump = CoreDump.from_file(path)
+        except (OSError, CoreDumpError) as e:
+            return "\n  Saved the core dump to %s, failed to decode it: %s\n\n" % (
+                path,
+                e,
+            )
+        image_paths = self.find_core_dump_images(dump.app_sha256)
+        if image_paths is None:
+            return (
+                "\n  Saved the core dump to %s, no firmware ELF with SHA256 %s\n\n"
+                % (path, dump.app_sha256)
             )
 
-        return trace + "\n" if trace else ""
+        # the image map of the decoder belongs to the serial thread
+        symbolizer = self.create_image_map(self.backend, image_paths)
+        if symbolizer is None:
+            return "\n  Saved the core dump to %s\n\n" % path
+        try:
+            output = format_core_dump(
+                dump,
+                symbolizer.lookup,
+                lambda address: symbolizer.find(address) is not None,
+            )
+        except Exception as e:  # pylint: disable=broad-except
+            output = "  Failed to decode the core dump: %s\n" % e
+        finally:
+            symbolizer.close()
+
+        output += "  Saved the core dump to %s\n" % path
+        elf_path = os.path.splitext(path)[0] + ".elf"
+        try:
+            dump.save_elf(elf_path)
+        except OSError as e:
+            output += "  Failed to save the core dump ELF: %s\n" % e
+        else:
+            if self.addr2line_path:
+                output += "  Debug it with %s %s %s\n" % (
+                    os.path.basename(self.addr2line_path).replace(
+                        "-addr2line", "-gdb"
+                    ),
+                    image_paths[0][1],
+                    elf_path,
+                )
+        return "\n" + self.strip_project_dir(output) + "\n"
 
     def strip_project_dir(self, trace):
         while True:
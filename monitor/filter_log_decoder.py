@@ -0,0 +1,172 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import codecs
+import os
+import sys
+
+from platformio.exception import PlatformioException
+from platformio.public import (
+    DeviceMonitorFilterBase,
+    load_build_metadata,
+)
+
+# PlatformIO loads filters by their file path, make the helper package
+# located next to this file importable
+MONITOR_DIR = os.path.dirname(os.path.realpath(__file__))
+if MONITOR_DIR not in sys.path:
+    sys.path.insert(0, MONITOR_DIR)
+
+from esp32_decoder.cache import get_file_sha256  # noqa: E402
+from esp32_decoder.logfmt import LogFormatTable, RecordSplitter  # noqa: E402
+from esp32_decoder.parser import ELF_SHA256_MARKER, ELF_SHA256_RE  # noqa: E402
+from esp32_decoder.store import SymbolStore  # noqa: E402
+from esp32_decoder.stream import LineAssembler  # noqa: E402
+
+# By design, __init__ is called inside miniterm and we can't pass context to it.
+# pylint: disable=attribute-defined-outside-init
+
+
+class Esp32LogDecoder(DeviceMonitorFilterBase):
+    """Expands the compact log records of `esp_log_compact.h` into text."""
+
+    NAME = "esp32_log_decoder"
+
+    def __call__(self):
+        self.tables = {}
+        self.table = None
+        self.firmware_path = None
+        self.store = None
+        # tag names of the device by ID, defined by the records
+        self.tags = {}
+        self.splitter = RecordSplitter()
+        # the monitor decodes with latin-1, the text is decoded again here
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.colors = self.config.get(
+            "env:" + self.environment, "custom_log_compact_colors", "no"
+        ).lower() in ("1", "yes", "true")
+        self.assembler = LineAssembler(markers=(ELF_SHA256_MARKER,))
+        self.enabled = self.check_encoding() and self.setup_table()
+        return self
+
+    def check_encoding(self):
+        """The records are binary, the monitor must pass every byte."""
+        encoding = self.options.get("encoding") or "utf-8"
+        try:
+            if codecs.lookup(encoding).name == "iso8859-1":
+                return True
+        except LookupError:
+            pass
+        sys.stderr.write(
+            "%s: disabling, compact log records need `monitor_encoding = latin-1`\n"
+            % self.__class__.__name__
+        )
+        return False
+
+    def setup_table(self):
+        try:
+            data = load_build_metadata(
+                os.path.abspath(self.project_dir), self.environment, cache=True
+            )
+        except PlatformioException as e:
+            sys.stderr.write(
+                "%s: disabling, exception while looking for the firmware: %s\n"
+                % (self.__class__.__name__, e)
+            )
+            return False
+        self.firmware_path = data["prog_path"]
+        if not os.path.isfile(self.firmware_path):
+            sys.stderr.write(
+                "%s: firmware at %s does not exist, rebuild the project?\n"
+                % (self.__class__.__name__, self.firmware_path)
+            )
+            return False
+        self.store = SymbolStore(
+            self.config.get(
+                "env:" + self.environment,
+                "custom_exception_decoder_symbol_store",
+                os.path.join(self.config.get("platformio", "workspace_dir"), "symbols"),
+            )
+        )
+        self.table = self.load_table(self.firmware_path)
+        return True
+
+    def load_table(self, path):
+        """Indexes the format strings of a firmware once."""
+        sha256 = get_file_sha256(path)
+        if sha256 not in self.tables:
+            try:
+                self.tables[sha256] = LogFormatTable.from_elf(path, self.colors)
+            except (OSError, ValueError) as e:
+                sys.stderr.write(
+                    "%s: failed to read the log formats of %s: %s\n"
+                    % (self.__class__.__name__, path, e)
+                )
+                self.tables[sha256] = None
+        return self.tables[sha256]
+
+    def rx(self, text):
+        if not self.enabled:
+            return text
+        result = []
+        for is_record, data in self.splitter.feed(text.encode("latin-1", "replace")):
+            if is_record:
+                result.append(self.decode_record(data))
+                continue
+            data = self.text_decoder.decode(data)
+            for _, line in self.assembler.feed(data):
+                self.handle_line(line)
+            result.append(data)
+        return "".join(result)
+
+    def decode_record(self, payload):
+        if self.table is None:
+            LogFormatTable.define_tag(payload, self.tags)
+            return ""
+        line = self.table.decode(payload, self.tags)
+        return line + "\n" if line else ""
+
+    def handle_line(self, line):
+        m = ELF_SHA256_RE.search(line)
+        if m is not None:
+            # the tag IDs start over with every boot
+            self.tags.clear()
+            self.select_firmware(m.group(1).lower())
+
+    def select_firmware(self, sha256_prefix):
+        for sha256, table in self.tables.items():
+            if sha256.startswith(sha256_prefix):
+                self.table = table
+                return
+        path = None
+        try:
+            firmware_sha256 = get_file_sha256(self.firmware_path)
+        except OSError:
+            # the firmware is missing while the project is rebuilt
+            firmware_sha256 = ""
+        if firmware_sha256.startswith(sha256_prefix):
+            # the firmware was rebuilt since the monitor started
+            path = self.firmware_path
+        elif self.store is not None:
+            path = self.store.find(sha256_prefix)
+        if path is None:
+            sys.stderr.write(
+                "%s: the device runs a firmware with ELF SHA256 %s which is "
+                "neither the current build nor in the symbol store, compact "
+                "log records are not decoded\n"
+                % (self.__class__.__name__, sha256_prefix)
+            )
+            self.table = None
+            return
+        self.table = self.load_table(path)
@@ -0,0 +1,251 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import atexit
+import os
+import sys
+import time
+
+from platformio.exception import PlatformioException
+from platformio.public import (
+    DeviceMonitorFilterBase,
+    load_build_metadata,
+)
+
+# PlatformIO loads filters by their file path, make the helper package
+# located next to this file importable
+MONITOR_DIR = os.path.dirname(os.path.realpath(__file__))
+if MONITOR_DIR not in sys.path:
+    sys.path.insert(0, MONITOR_DIR)
+
+from esp32_decoder.images import find_rom_elf  # noqa: E402
+from esp32_decoder.offline import SymbolServer  # noqa: E402
+from esp32_decoder.parser import (  # noqa: E402
+    ELF_SHA256_MARKER,
+    ELF_SHA256_RE,
+    get_elf_arch,
+)
+from esp32_decoder.profile import (  # noqa: E402
+    PROFILE_FORMATS,
+    PROFILE_MARKER,
+    SampleProfile,
+    fold_stacks,
+    write_profile,
+)
+from esp32_decoder.stream import (  # noqa: E402
+    LineAssembler,
+    hold_partial_line,
+    replace_lines,
+)
+from esp32_decoder.worker import DecodeWorker  # noqa: E402
+
+# By design, __init__ is called inside miniterm and we can't pass context to it.
+# pylint: disable=attribute-defined-outside-init
+
+
+class Esp32Profiler(DeviceMonitorFilterBase):
+    """Builds CPU profiles from the `PROF:` sample lines of the firmware.
+
+    The profile is written as folded stacks, speedscope JSON and a flame
+    graph SVG when the monitor exits, when the firmware prints `PROF:END`
+    and every `custom_profiler_interval` seconds.
+    """
+
+    NAME = "esp32_profiler"
+
+    def __call__(self):
+        self.profile = SampleProfile()
+        self.server = None
+        self.firmware = None
+        self.arch = None
+        self.worker = None
+        self.held = ""
+        self.session = time.strftime("%Y%m%d-%H%M%S")
+        self.last_write = time.time()
+        self.assembler = LineAssembler(markers=(PROFILE_MARKER, ELF_SHA256_MARKER))
+        self.enabled = self.setup_server()
+        if self.enabled:
+            self.directory = self.get_option(
+                "dir",
+                os.path.join(
+                    self.config.get("platformio", "build_dir"),
+                    self.environment,
+                    "profile",
+                ),
+            )
+            self.formats = [
+                item
+                for item in self.config.parse_multi_values(
+                    self.get_option("formats", ", ".join(PROFILE_FORMATS))
+                )
+                if item in PROFILE_FORMATS
+            ]
+            self.interval = float(self.get_option("interval", 0))
+            self.quiet = self.get_option("quiet", "yes").lower() in ("1", "yes", "true")
+            # symbolizing and writing happen outside of the serial thread
+            self.worker = DecodeWorker(self.emit, max_pending=4)
+            atexit.register(self.close)
+        return self
+
+    def get_option(self, name, default=None):
+        return self.config.get(
+            "env:" + self.environment, "custom_profiler_" + name, default
+        )
+
+    def setup_server(self):
+        try:
+            data = load_build_metadata(
+                os.path.abspath(self.project_dir), self.environment, cache=True
+            )
+        except PlatformioException as e:
+            sys.stderr.write(
+                "%s: disabling, exception while looking for the firmware: %s\n"
+                % (self.__class__.__name__, e)
+            )
+            return False
+        firmware_path = data["prog_path"]
+        if not os.path.isfile(firmware_path):
+            sys.stderr.write(
+                "%s: firmware at %s does not exist, rebuild the project?\n"
+                % (self.__class__.__name__, firmware_path)
+            )
+            return False
+
+        # share the symbol backend and the store of the exception decoder
+        section = "env:" + self.environment
+        addr2line_path = None
+        cc_path = data.get("cc_path", "")
+        backend = self.config.get(
+            section, "custom_exception_decoder_backend", "auto"
+        )
+        if backend not in SymbolServer.BACKENDS:
+            backend = "auto"
+        if backend != "elf" and "-gcc" in cc_path:
+            path = cc_path.replace("-gcc", "-addr2line")
+            if os.path.isfile(path):
+                addr2line_path = path
+        if backend == "addr2line" and addr2line_path is None:
+            sys.stderr.write(
+                "%s: disabling, failed to find addr2line\n" % self.__class__.__name__
+            )
+            return False
+        rom_elf = self.config.get(
+            section, "custom_exception_decoder_rom_elf", None
+        ) or find_rom_elf(data.get("extra", {}).get("mcu"))
+        store_path = self.config.get(
+            section,
+            "custom_exception_decoder_symbol_store",
+            os.path.join(self.config.get("platformio", "workspace_dir"), "symbols"),
+        )
+        self.server = SymbolServer(
+            [firmware_path],
+            [("rom", rom_elf)] if rom_elf and os.path.isfile(rom_elf) else [],
+            store_path if os.path.isdir(store_path) else None,
+            addr2line_path,
+            backend,
+        )
+        self.firmware = self.server.get_default()
+        self.arch = get_elf_arch(firmware_path)
+        return True
+
+    def emit(self, text):
+        terminal = self.get_running_terminal()
+        if terminal is not None:
+            terminal.console.write(text)
+            return
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+    def rx(self, text):
+        if not self.enabled:
+            return text
+        if not self.quiet:
+            for _, line in self.assembler.feed(text):
+                self.handle_line(line)
+            self.check_interval()
+            return text
+
+        text, self.held = hold_partial_line(self.held + text, PROFILE_MARKER)
+        text = replace_lines(
+            text,
+            self.assembler.feed(text),
+            lambda line: "" if self.handle_line(line) else None,
+        )
+        self.check_interval()
+        return text
+
+    def handle_line(self, line):
+        """Returns whether the line holds samples."""
+        if PROFILE_MARKER in line:
+            if not self.profile.feed_line(line):
+                self.write(finished=True)
+            return True
+        m = ELF_SHA256_RE.search(line)
+        if m is not None:
+            self.select_firmware(m.group(1))
+        return False
+
+    def check_interval(self):
+        if self.interval and time.time() - self.last_write >= self.interval:
+            self.write()
+
+    def select_firmware(self, sha256_prefix):
+        firmware = self.server.select(sha256_prefix)
+        if firmware is None:
+            sys.stderr.write(
+                "%s: the device runs a firmware with ELF SHA256 %s which is "
+                "neither the current build nor in the symbol store\n"
+                % (self.__class__.__name__, sha256_prefix)
+            )
+        if firmware == self.firmware:
+            return
+        # samples of different firmwares are never mixed
+        self.write(finished=True)
+        self.firmware = firmware
+        self.arch = self.server.get_arch(firmware) if firmware else None
+
+    def write(self, finished=False, force=False):
+        self.last_write = time.time()
+        if self.profile.total and self.firmware is not None:
+            stacks = self.profile.get_stacks(self.arch)
+            self.worker.submit(
+                self.write_stacks, stacks, self.firmware, self.session, force=force
+            )
+        if finished:
+            self.profile.clear()
+            self.session = time.strftime("%Y%m%d-%H%M%S")
+
+    def write_stacks(self, stacks, firmware, session):
+        try:
+            folded, frames = fold_stacks(
+                stacks, lambda addresses: self.server.lookup(firmware, addresses)
+            )
+            paths = write_profile(
+                self.directory, folded, frames, self.formats, "profile-" + session
+            )
+        except Exception as e:  # pylint: disable=broad-except
+            return "%s: failed to write the profile: %s\n" % (
+                self.__class__.__name__,
+                e,
+            )
+        return "%s: %d samples written to %s\n" % (
+            self.__class__.__name__,
+            sum(folded.values()),
+            ", ".join(paths),
+        )
+
+    def close(self):
+        self.write(force=True)
+        self.worker.stop(timeout=30)
+        self.server.close()
@@ -0,0 +1,127 @@
+# Copyright (c) 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import atexit
+import os
+import sys
+import time
+
+from platformio.public import DeviceMonitorFilterBase
+
+# PlatformIO loads filters by their file path, make the helper package
+# located next to this file importable
+MONITOR_DIR = os.path.dirname(os.path.realpath(__file__))
+if MONITOR_DIR not in sys.path:
+    sys.path.insert(0, MONITOR_DIR)
+
+from esp32_decoder.rtos import CsvWriter, TaskTracker, format_summary  # noqa: E402
+from esp32_decoder.stream import LineAssembler, insert_after_lines  # noqa: E402
+
+# By design, __init__ is called inside miniterm and we can't pass context to it.
+# pylint: disable=attribute-defined-outside-init
+
+
+class Esp32RtosTop(DeviceMonitorFilterBase):
+    """Shows the CPU usage and stack usage of the FreeRTOS tasks.
+
+    The firmware prints `vTaskGetRunTimeStats()` and/or `vTaskList()`
+    periodically, a top-style summary is shown after each table and/or a
+    row per task is appended to a CSV file.
+    """
+
+    NAME = "esp32_rtos_top"
+
+    OUTPUTS = ("summary", "csv", "both")
+    # a table ends when no line of it arrives for this long
+    TABLE_TIMEOUT = 0.5
+    CLEAR_SCREEN = "\033[2J\033[H"
+
+    def __call__(self):
+        self.tracker = TaskTracker(int(self.get_option("history", 120)))
+        output = self.get_option("output", "summary").lower()
+        if output not in self.OUTPUTS:
+            sys.stderr.write(
+                "%s: unknown output `%s`, expected one of %s\n"
+                % (self.__class__.__name__, output, ", ".join(self.OUTPUTS))
+            )
+            output = "summary"
+        self.show_summary = output in ("summary", "both")
+        self.interval = float(self.get_option("interval", 0))
+        self.clear = self.get_option("clear", "no").lower() in ("1", "yes", "true")
+        self.last_summary = 0
+        self.summary_due = False
+        self.csv = None
+        if output in ("csv", "both"):
+            self.setup_csv()
+        self.assembler = LineAssembler(markers=("\t",))
+        return self
+
+    def get_option(self, name, default=None):
+        return self.config.get(
+            "env:" + self.environment, "custom_rtos_top_" + name, default
+        )
+
+    def setup_csv(self):
+        path = self.get_option(
+            "csv",
+            os.path.join(
+                self.config.get("platformio", "build_dir"),
+                self.environment,
+                "rtos_top.csv",
+            ),
+        )
+        try:
+            if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+                os.makedirs(os.path.dirname(os.path.abspath(path)))
+            self.csv = CsvWriter(path)
+        except OSError as e:
+            sys.stderr.write(
+                "%s: failed to open %s: %s\n" % (self.__class__.__name__, path, e)
+            )
+            return
+        atexit.register(self.csv.close)
+
+    def rx(self, text):
+        now = time.time()
+        output = ""
+        if self.tracker.pending and now - self.tracker.last_line > self.TABLE_TIMEOUT:
+            output = self.handle_table(self.tracker.finish(now), now)
+        text = insert_after_lines(
+            text,
+            self.assembler.feed(text),
+            lambda line: self.handle_table(self.tracker.feed_line(line, now), now),
+        )
+        return output + text
+
+    def handle_table(self, table, now):
+        if table is not None:
+            self.summary_due = self.show_summary
+            if self.csv is not None:
+                self.csv.write(
+                    self.tracker,
+                    table,
+                    time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(now)),
+                )
+        # the run time and task tables are usually printed one after another
+        if (
+            not self.summary_due
+            or self.tracker.pending
+            or now - self.last_summary < self.interval
+        ):
+            return ""
+        self.summary_due = False
+        self.last_summary = now
+        return (self.CLEAR_SCREEN if self.clear else "\n") + format_summary(
+            self.tracker
+        )